@@ -1,15 +1,24 @@
-import requests
-from bs4 import BeautifulSoup
 import re
 import time
 import json
-import random
+import argparse
+from concurrent.futures import Future
+from functools import partial
+from corpus_store import corpus
+from crawl_metrics import CrawlMetrics
+from crawl_state import CrawlState
+from http_cache import HttpCache
+from image_pipeline import ImagePipeline
+from page_parser import parse_artist_page
+from parse_pool import ParsePool, chain
+from rate_control import RateController
+from requests_get import RequestsGet, HEADERS, COOKIES
+from store import ARTIST_HREFS_PATH, ARTIST_IMAGE_PATH, ARTIST_THUMB_PATH
 
 def get_all_artist_ids() -> list[int]:
 
     """get all artist ids from the saved hrefs list"""
 
-    ARTIST_HREFS_PATH = "C:/Chris Liu/清华/25暑期/python-course/song_curl/saved_info/artist_hrefs.json"
     with open(ARTIST_HREFS_PATH, "r", encoding="utf-8") as f:
         hrefs_list = json.load(f)
     
@@ -22,138 +31,153 @@ def get_all_artist_ids() -> list[int]:
     
     return id_list
 
-def get_image(image_url: str, headers: dict[str, str], cookies: dict[str, str], id: int) -> None:
+def get_image(image_url: str, images: ImagePipeline, id: int) -> Future:
 
     """Getting the image using the url
 
-    Getting the image from the url and storing in the local folder
+    Queueing the image in the image pipeline, which streams it into the local folder
+    (with its thumbnail). In offline mode an image already stored is kept (the images
+    are not in the http cache).
 
     Args:
         image_url(str): the url used to make the request
-        headers(dict[str, str]): the headers for the request
-        cookies(dict[str, str]): the cookies for the request
+        images(ImagePipeline): the threads downloading the images
         id(int): the id of the artist
 
     Returns:
-        None
+        future (Future): the download of the image
     """
 
-    response = requests.get(image_url, headers=headers, cookies=cookies)
-    image = response.content
-    INFO_OUT_DIR = 'C:/Chris Liu/清华/25暑期/python-course/song_curl/saved_info/artist_info/artist_images'
-    OUT_PATH = f"{INFO_OUT_DIR}/artist{id}.jpg"
-    with open(OUT_PATH, "wb") as f:
-        f.write(image)
+    OUT_PATH = f"{ARTIST_IMAGE_PATH}/artist{id}.jpg"
+    THUMB_PATH = f"{ARTIST_THUMB_PATH}/artist{id}.webp"
+    return images.submit(image_url, OUT_PATH, THUMB_PATH)
 
-def analyze_response(response, headers: dict[str, str], cookies: dict[str, str], id: int) -> None:
+def analyze_response(html: str, url: str, id: int) -> tuple[str, dict]:
 
     """Analyze a response
     
     Analyze the response after getting the artist page, extract related info
-    (e.g. name, alias, intro, etc.) and store them in a local json file
+    (e.g. name, alias, intro, etc.) and store them in the corpus store. This
+    runs in the parse pool, so it gets the text and url of the response.
 
     Args:
-        response: the response of the artist page request
-        headers(dict[str, str]): headers using by the request
-        cookies(dict[str, str]): cookies using by the request
+        html: the text of the artist page response
+        url: the url of the artist page response
         id: the id of the artist
     
     Returns:
-        None
+        image_url (str): the url of the artist's image
+        timings (dict[str, float]): the seconds spent parsing and writing
     """
 
-    soup = BeautifulSoup(response.text, "lxml")
+    timings = {}
 
     #extracting info from artist
+    start = time.perf_counter()
+    artist_info, image_url = parse_artist_page(html)
     artist = {}
-    artist['name'] = soup.h2.text.strip()
-    artist['alias'] = re.split(r';', soup.h3.text.strip())
-    artist['url'] = response.url
+    artist['name'] = artist_info['name']
+    artist['alias'] = artist_info['alias']
+    artist['url'] = url
     artist['id'] = id
-
-    #further analyze the introduction block
-    artist_intro_block = soup.find(class_="n-artdesc")
-    artist_headers = artist_intro_block.find_all("h2")
-    artist_paragraphs = artist_intro_block.find_all("p")
-    artist_intro = {}
-    for i in range(len(artist_headers)):
-        header_name = artist_headers[i].text.strip()
-        if re.search(r'简介$', header_name):
-            artist_intro['intro'] = artist_paragraphs[i].text.strip()
-        elif header_name == '演艺经历':
-            artist_intro['history'] = artist_paragraphs[i].text.strip()
-        elif header_name == '代表作品':
-            artist_paragraph = artist_paragraphs[i].text.strip()
-            master_work = re.split(r'●', artist_paragraph)
-            if master_work[0] == "":
-                master_work.remove("")
-            artist_intro['master work'] = master_work
-        elif header_name == '重要里程碑':
-            artist_paragraph = artist_paragraphs[i].text.strip()
-            milestones = re.split(r'●', artist_paragraph)
-            if milestones[0] == "":
-                milestones.remove("")
-            artist_intro['milestones'] = milestones
-    artist['intro'] = artist_intro
+    artist['intro'] = artist_info['intro']
+    timings['parse'] = time.perf_counter() - start
 
     #store info found
-    INFO_OUT_DIR = 'C:/Chris Liu/清华/25暑期/python-course/song_curl/saved_info/artist_info/artist_intro'
-    OUT_PATH = f"{INFO_OUT_DIR}/artist{id}.json"
-    with open(OUT_PATH, "w", encoding='utf-8') as f:
-        json.dump(artist, f, indent=4, sort_keys=False, ensure_ascii=False)
+    start = time.perf_counter()
+    corpus().put('artists', artist)
+    timings['write'] = time.perf_counter() - start
+    return image_url, timings
+
+def get_analyzed_image(tool: RequestsGet, images: ImagePipeline, id: int, analyzed: tuple[str, dict]) -> Future:
 
-    #get the image after a small break
-    time.sleep(random.random() + 1)
-    image_url = soup.find_all("img")[0]['src']
-    get_image(image_url, headers, cookies, id)
+    """hand the image of an analyzed artist page to the image pipeline, returns its future"""
 
-def curl_info():
+    image_url, timings = analyzed
+    tool.metrics.record_stages(timings)
+    return get_image(image_url, images, id)
+
+def curl_info(tool: RequestsGet, images: ImagePipeline, parser: ParsePool, state: CrawlState,
+              site_url: str = "https://music.163.com"):
 
     """A function that gets info of artists in the artist_hrefs.
     
     This function gets the urls by analyzing artist_hrefs.json. Then, it sends get requests
-    to those urls and store the artist info locally.
+    to those urls and store the artist info locally. Only the artists still in the frontier
+    of the crawl state are fetched, so a crawl that stopped resumes from where it stopped.
+    The pages are analyzed by the parse pool while the next ones are fetched, and an
+    artist is done once its info and image are stored. The pace of the requests is set
+    by the tool's rate controller.
+
+    Args:
+        tool (RequestsGet): the tool making the requests (and consulting the http cache)
+        images (ImagePipeline): the threads downloading the artists' images
+        parser (ParsePool): the processes analyzing the pages and storing the info
+        state (CrawlState): the crawl state of the artists' pages
+        site_url (str): the root url of the site, can be pointed to a local stand-in
     """
 
-    #prepair url, headers, cookies, and ids for requests
-    ARTIST_PAGE_URL = "https://music.163.com/artist/desc"
-
-    headers = {
-        "referer": "https://music.163.com/",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
-    }
-
-    cookies = {
-        "_iuqxldmzr_": "32",
-        "*ntes*nnid": "66528d90a67b40f5083977b2aa13f1fb,1750984768492",
-        "*ntes*nuid": "66528d90a67b40f5083977b2aa13f1fb",
-        "WEVNSM": "1.0.0",
-        "WNMCID": "wvtjxf.1750984768861.01.0",
-        "NMTID": "00O7aLHpTbFcg_iC0nCm7NyqWczpIYAAAGXrtM58g",
-        "sDeviceId": "YD-l%2B6BoGmhqc1AF1EQQQaTPoj4t09g4aiS",
-        "ntes_utid": "tid._.mMP9FniabwxEBkRRUBeDP9jt8x8ksbiW._.0",
-        "WM_TID": "%2BYEnlCDbZ1xFVUQQQQOCOoi8p04hzMbF",
-        "**snaker**id": "CpNqIxmBogQLpWV9",
-        "gdxidpyhxdE": "oC5cpwv7PdGK%5CrmjJB8pisHZ9m1bBCR4w4gVu%5C3l%5CdaVIcn1L9PMEOTPvc2C8cMYGtX4%2BX3N43UcZQ%2FC5xOL2zmMWV4Avj84tVTrpcwfbjN%2BLY31po577AjeOjXkfxxdf9fUWC9iWY1Ko9l9AVy3zsovRIhtL%2BVVzbY9dl0EYqvKTeab%3A1750985729881",
-        "__csrf": "dd241c7029354383215c754cbca3fbbc",
-        "MUSIC_U": "00C3F1F27B7227B3ADC8357A5221494AD43A2E473D70140C67E44C374292212270FD60D72117FF1C8D04F475CFC613AF28264AF280B916F00CA8541633CD8FF0DCA322F55A7545CBE45807FB36FABC2D8C9765E4835C0E517CC51EBA66B07B63B88377B4AB73DEA1792995652DEFDFA3A100511F345AFB8948D4847DCFE5063CAEF379ECC1C3EB07DD3EE103BC7F385C3BB0C1D4B47F8CFF3C0B8E1BFE0260AFC372679E42AA7A852234A6BC65C4309550185473C79DE4ADF8AA60605B73674309FA299BF95F163D527B4EB504389D48829AD480E1BD63652CF1EDA146C77FDADE91A513C8719F7E00FAAFD93519D6437CB0C52E7B519F95698A5FA5C7E5E4B32968C75C52F20F06B46D80ED1E25A0B02F56837B26D608822215B2C8A34A946CAB151832BA86D2F3B32BD196A4FCA46D1D9044C74CF5D9823C1098DB7EB73AC2ADED8A88FFACC861B2981645C2EF743FBE6747205EE9A20619C0AA1B44AD6C92C185DAB10053BD76255C9312E6D7D02B58",
-        "__remember_me": "true",
-        "P_INFO": "15652144978|1750984965|1|music|00&99|null&null&null#bej&null#10#0|&0||15652144978",
-        "ntes_kaola_ad": "1",
-        "JSESSIONID-WYYY": "XS7a6BigwtwhR0RhteE%2FVuxgGr1HyDUHnZATC8pH37RU6I1Su8sOXsrf33Adk7Y0bRTtjhcwtdZ%5CyG%2FcTdFoOxy%2Fza0JOFnsAfob3Hjw2hRx%2B4xyCW4iEZfzGfxAh3uIsoO%2BW0gKEiAru2uFdm6FBpKdwuniVD9ZYB%2BGd23DDpqXqoys%3A1751068190136",
-        "WM_NI": "KaKg7wE4tYc7KsLvnkUbjDC0vBlN%2Bry9DP3%2B7O0osQKBQpX4wLoOA4r%2Bu%2BN9BICLyFdBTj0E1A%2BzViLHOjv9tEeD6WdfzVAunXOGebIELB2OeNdVX%2FHlzun8oRseYNnBQXU%3D",
-        "WM_NIKE": "9ca17ae2e6ffcda170e2e6eed4b16f8c95fb96c54aae9a8fb7c44f829e9ab1d66af7b0aa8eeb4990ae009bd62af0fea7c3b92a89bf8588b67d87ecbcbae23d89ad8497ed6197bea6a5c23cb69ea4afaa7abbe78cb1b221f5910090f25b899e9f91db40b594a1b0c440b2f5bbcccd3382978dadfc4ea89e9c8bb34ff39fe59bd5639098818bf533b89baba5b55da8bab6b7c47fae8881a8e86a8b9b84a3b145a792acb7db258cb4b696ed34ad8ebd86dc46ae9e9fb9d837e2a3"
-    }
-
-    id_list = get_all_artist_ids()
+    #prepair url and ids for requests
+    ARTIST_PAGE_URL = f"{site_url}/artist/desc"
+
+    #the artists not in the state yet join the frontier in the order of the hrefs
+    for id in get_all_artist_ids():
+        state.add(f"{ARTIST_PAGE_URL}?id={id}", 'artist desc')
 
     #curl all the artists
-    for id in id_list:
-        response = requests.get(url=ARTIST_PAGE_URL, headers=headers, cookies=cookies, 
-                                params={"id": id})
-        analyze_response(response, headers, cookies, id)
-        time.sleep(random.random() + 1)
-        
+    image_futures = []
+    for artist_url in state.pending('artist desc'):
+        _, id = re.split(r'=', artist_url, maxsplit=1)
+        id = int(id)
+        try:
+            response = tool.requests_get(url=ARTIST_PAGE_URL, params={"id": id})
+            response.raise_for_status()
+            analyzed = parser.submit(analyze_response, response.text, response.url, id)
+            image_futures.append((artist_url, id, chain(analyzed, partial(get_analyzed_image, tool, images, id))))
+        except Exception as error:
+            state.mark_failed(artist_url, repr(error))
+            tool.metrics.count('errors')
+            print(f"artist{id} failed: {error!r}")
+
+    #wait for the images
+    for artist_url, id, future in image_futures:
+        try:
+            future.result()
+        except Exception as error:
+            state.mark_failed(artist_url, repr(error))
+            tool.metrics.count('errors')
+            print(f"artist{id} failed: {error!r}")
+        else:
+            state.mark_done(artist_url)
+            tool.metrics.page_done('artist')
+    tool.report_latency()
+    print(state.counts())
 
 if __name__ == "__main__":
-    curl_info()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="crawl the info of the known artists")
+    parser.add_argument('--image-workers', type=int, default=8, help="number of threads downloading the images")
+    parser.add_argument('--parse-workers', type=int, default=None, help="processes analyzing the pages (0: no process)")
+    parser.add_argument('--parse-queue', type=int, default=None, help="most fetched pages waiting to be analyzed")
+    parser.add_argument('--requeue-failed', action='store_true', help="try the failed artists again")
+    parser.add_argument('--max-retries', type=int, default=None, help="don't re-queue artists that failed this often")
+    parser.add_argument('--no-cache', action='store_true', help="don't use the http cache")
+    parser.add_argument('--offline', action='store_true', help="parse every cached page again without the network")
+    parser.add_argument('--site-url', default="https://music.163.com", help="root url of the site (or a local stand-in)")
+    parser.add_argument('--rate', type=float, default=2.0, help="requests per second on each host at the start")
+    parser.add_argument('--max-rate', type=float, default=20.0, help="most requests per second on each host")
+    parser.add_argument('--progress', action='store_true', help="show a live progress line")
+    parser.add_argument('--report', default=None, help="path of the json report (default: under saved_info/crawl_reports)")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else HttpCache(offline=args.offline)
+    metrics = CrawlMetrics('artist_info_curl', progress=args.progress)
+    rate = RateController(initial_rate=args.rate, max_rate=args.max_rate, metrics=metrics)
+    tool = RequestsGet(headers=HEADERS, cookies=COOKIES, cache=cache, metrics=metrics, rate=rate)
+    # an offline run goes through all the artists again, so it has its own (temporary) state
+    state = CrawlState(':memory:') if args.offline else CrawlState()
+    if args.requeue_failed:
+        print(f"{state.requeue_failed('artist desc', args.max_retries)} failed artists re-queued")
+    with ImagePipeline(tool, workers=args.image_workers) as images, \
+            ParsePool(args.parse_workers, args.parse_queue) as parse_pool:
+        curl_info(tool, images, parse_pool, state, args.site_url)
+    print(f"report written to {metrics.write_report(args.report)}")
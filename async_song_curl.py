@@ -0,0 +1,288 @@
+"""an asyncio crawl mode for the songs of the known artists.
+
+This module crawls the same pages as song_curl.curl_song_through_artists and stores
+the same files, but the artists' song pages, the song pages and the images are fetched
+concurrently. The number of requests in flight is bounded by a semaphore, and each host
+has its own token bucket so the crawl never exceeds the configured request rate.
+
+The blocking RequestsGet tool runs in worker threads, the lyrics are handed to a
+DriverPool and the images to an ImagePipeline. The site_url argument is the root url
+of the pages fetched, so the crawl can be pointed at a local stand-in of the site. The
+SONG_CURL_SAVED_INFO variable is the folder the files are stored in (see store.py).
+"""
+
+import argparse
+import asyncio
+import re
+import time
+from urllib.parse import urlsplit
+from artist_info_curl import get_all_artist_ids
+from browser_pool import DriverPool
+from crawl_metrics import CrawlMetrics
+from crawl_state import CrawlState, DONE, FAILED
+from http_cache import HttpCache, CacheMiss
+from image_pipeline import ImagePipeline
+from rate_control import RateController
+from requests_get import RequestsGet, HEADERS, COOKIES
+from song_curl import (
+    SITE_URL, construct_song_id_list, parse_song_list, save_artist_song_ids,
+    parse_song_page, parse_cover_url, get_lyrics_with_requests, save_song_image, save_song_intro
+)
+
+class TokenBucket:
+
+    """a token bucket limiting the request rate to one host
+
+    Attributes:
+        rate (float): the number of tokens added per second
+        capacity (float): the maximum number of tokens, i.e. the allowed burst
+        tokens (float): the tokens available now
+        updated (float): the monotonic time the tokens were last refilled
+    """
+
+    def __init__(self, rate: float, capacity: float):
+
+        """initialize a full bucket"""
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+
+        """wait until a token is available and take it"""
+
+        # the lock keeps the waiters in order, so a burst of tasks is served first come first served
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AsyncSongCrawler:
+
+    """the crawler fetching the songs of the known artists concurrently
+
+    Attributes:
+        tool (RequestsGet): a tool contains headers and cookies for the get requests
+        pool (DriverPool): the headless drivers getting the lyrics and images' urls
+        images (ImagePipeline): the threads downloading the images
+        state (CrawlState): the crawl state of the artists and songs, shared with song_curl
+        site_url (str): the root url of the site, can be pointed to a local stand-in
+        rate (float): the requests per second allowed on each host
+        burst (float): the number of requests allowed at once on each host
+        semaphore (asyncio.Semaphore): bounds the number of requests in flight
+        buckets (dict[str, TokenBucket]): the token bucket of each host
+        song_id_set (set[str]): the songs already crawled (or being crawled) in this run
+    """
+
+    def __init__(self, tool: RequestsGet, pool: DriverPool, images: ImagePipeline, state: CrawlState,
+                 concurrency: int = 8, rate: float = 2.0, burst: float = 4, site_url: str = SITE_URL):
+
+        """initialize the crawler with its concurrency limit and per-host rate limit"""
+
+        self.tool = tool
+        self.pool = pool
+        self.images = images
+        self.state = state
+        self.site_url = site_url
+        self.rate = rate
+        self.burst = burst
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.buckets: dict[str, TokenBucket] = {}
+        self.song_id_set: set[str] = set()
+
+    async def wait_for_host(self, url: str) -> None:
+
+        """wait for the token bucket of the url's host"""
+
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        await self.buckets[host].acquire()
+
+    async def run_limited(self, url: str, func, *args):
+
+        """run a blocking request function in a thread after passing the rate and concurrency limits"""
+
+        await self.wait_for_host(url)
+        async with self.semaphore:
+            return await asyncio.to_thread(func, *args)
+
+    async def crawl_song(self, url: str) -> None:
+
+        """fetch one song and record in the crawl state whether it is done or failed"""
+
+        song_url = f"{self.site_url}{url}"
+        self.state.add(song_url, 'song')
+        try:
+            await self.fetch_song(url)
+        except Exception as error:
+            self.state.mark_failed(song_url, repr(error))
+            self.tool.metrics.count('errors')
+            print(f"song{url.split('=', 1)[1]} failed: {error!r}")
+        else:
+            self.state.mark_done(song_url)
+            self.tool.metrics.page_done('song')
+
+    async def fetch_song(self, url: str) -> None:
+
+        """fetch one song (page, lyrics and image) and store it like song_curl.get_songs_info"""
+
+        song_info = {}
+        _, song_id = re.split(r'=', url, maxsplit=1)
+        song_info['id'] = song_id
+        song_info['url'] = f"{self.site_url}{url}"
+
+        response = await self.run_limited(song_info['url'], self.tool.requests_get, song_info['url'])
+        response.raise_for_status()
+        with self.tool.metrics.stage('parse'):
+            song_info.update(parse_song_page(response.text))
+            img_url = parse_cover_url(response.text)
+
+        # try to get the lyrics and picture without a browser first
+        lyric_url = f"{self.site_url}/api/song/lyric"
+        lyrics = await self.run_limited(
+            lyric_url, get_lyrics_with_requests, self.tool, song_id, self.site_url
+        )
+        if img_url is not None and lyrics is not None:
+            source = 'http'
+        elif self.tool.offline:
+            # the browser can't be used without the network
+            raise CacheMiss(f"song{song_id}'s lyrics or image url are not in the cache")
+        else:
+            # the song waits for a free driver in the pool while the other songs'
+            # pages and images are still being fetched
+            await self.wait_for_host(song_info['url'])
+            img_url, lyrics = await asyncio.wrap_future(self.pool.submit(song_info['url']))
+            source = 'browser'
+        # the image is downloaded by the pipeline's threads, which don't hold the semaphore
+        await self.wait_for_host(img_url)
+        await asyncio.wrap_future(save_song_image(self.images, img_url, song_id))
+        print(f"song{song_id}'s image saved")
+        song_info['lyrics'] = lyrics
+        song_info['lyrics source'] = source
+        with self.tool.metrics.stage('write'):
+            save_song_intro(song_info)
+
+    async def crawl_songs(self, song_url_list: list[str]) -> None:
+
+        """crawl the songs concurrently, skipping the ones already done, failed or being crawled"""
+
+        tasks = []
+        for url in song_url_list:
+            # preventing same song appear twice, also across artists crawled at the same time
+            _, song_id = re.split(r'=', url, maxsplit=1)
+            if song_id in self.song_id_set or self.state.status(f"{self.site_url}{url}") in (DONE, FAILED):
+                continue
+            self.song_id_set.add(song_id)
+            tasks.append(self.crawl_song(url))
+        await asyncio.gather(*tasks)
+
+    async def crawl_artist(self, artist_url: str) -> None:
+
+        """fetch an artist's songs page, store the song ids, and crawl the first 25 songs
+
+        The artist is done once its song ids are stored: its songs are then in the frontier,
+        and each is recorded as done or failed on its own (a song failed is re-queued with
+        --requeue-failed, not through its artist).
+        """
+
+        _, artist_id = re.split(r'=', artist_url, maxsplit=1)
+        try:
+            response = await self.run_limited(artist_url, self.tool.requests_get, artist_url)
+            response.raise_for_status()
+            with self.tool.metrics.stage('parse'):
+                song_url_list = parse_song_list(response.text)[:25]
+            with self.tool.metrics.stage('write'):
+                save_artist_song_ids(artist_id, construct_song_id_list(song_url_list))
+        except Exception as error:
+            self.state.mark_failed(artist_url, repr(error))
+            self.tool.metrics.count('errors')
+            print(f"artist{artist_id} failed: {error!r}")
+            return
+        self.state.add_many([f"{self.site_url}{url}" for url in song_url_list], 'song')
+        self.state.mark_done(artist_url)
+        self.tool.metrics.page_done('artist')
+        await self.crawl_songs(song_url_list)
+
+    async def crawl(self, artist_id_list: list[int]) -> None:
+
+        """crawl the artists still in the frontier concurrently, then the songs left in it"""
+
+        for id in artist_id_list:
+            self.state.add(f"{self.site_url}/artist?id={id}", 'artist')
+        await asyncio.gather(*[self.crawl_artist(url) for url in self.state.pending('artist')])
+
+        song_url_list = [
+            url[len(self.site_url):] for url in self.state.pending('song') if url.startswith(self.site_url)
+        ]
+        await self.crawl_songs(song_url_list)
+
+def curl_song_through_artists_async(tool: RequestsGet, pool: DriverPool, images: ImagePipeline, state: CrawlState,
+                                    concurrency: int = 8, rate: float = 2.0, burst: float = 4,
+                                    site_url: str = SITE_URL) -> None:
+
+    """the asyncio version of song_curl.curl_song_through_artists
+
+    Args:
+        tool (RequestsGet): a tool contains headers and cookies for the get requests
+        pool (DriverPool): the headless drivers getting the lyrics
+        images (ImagePipeline): the threads downloading the images
+        state (CrawlState): the crawl state of the artists and songs
+        concurrency (int): the maximum number of requests in flight
+        rate (float): the maximum requests per second on each host
+        burst (float): the number of requests allowed at once on each host
+        site_url (str): the root url of the site, can be pointed to a local stand-in
+
+    Returns:
+        None
+    """
+
+    crawler = AsyncSongCrawler(tool, pool, images, state, concurrency, rate, burst, site_url)
+    asyncio.run(crawler.crawl(get_all_artist_ids()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="crawl the songs of the known artists concurrently")
+    parser.add_argument('--concurrency', type=int, default=8, help="maximum requests in flight")
+    parser.add_argument('--rate', type=float, default=2.0, help="maximum requests per second on each host")
+    parser.add_argument('--burst', type=float, default=4, help="requests allowed at once on each host")
+    parser.add_argument('--drivers', type=int, default=2, help="number of headless drivers")
+    parser.add_argument('--recycle-after', type=int, default=100, help="pages loaded before a driver is replaced")
+    parser.add_argument('--image-workers', type=int, default=8, help="number of threads downloading the images")
+    parser.add_argument('--site-url', default=SITE_URL, help="root url of the site (or a local stand-in)")
+    parser.add_argument('--requeue-failed', action='store_true', help="try the failed artists and songs again")
+    parser.add_argument('--max-retries', type=int, default=None, help="don't re-queue urls that failed this often")
+    parser.add_argument('--no-cache', action='store_true', help="don't use the http cache")
+    parser.add_argument('--offline', action='store_true', help="parse every cached page again without the network")
+    parser.add_argument('--progress', action='store_true', help="show a live progress line")
+    parser.add_argument('--report', default=None, help="path of the json report (default: under saved_info/crawl_reports)")
+    args = parser.parse_args()
+
+    # the pool should hold a connection for every request in flight
+    cache = None if args.no_cache else HttpCache(offline=args.offline)
+    metrics = CrawlMetrics('async_song_curl', progress=args.progress)
+    # the token buckets keep the rate under --rate, the rate controller slows down below it
+    # when a host throttles
+    rate = RateController(initial_rate=min(2.0, args.rate), max_rate=args.rate, metrics=metrics)
+    tool = RequestsGet(
+        headers=HEADERS, cookies=COOKIES, pool_size=args.concurrency, cache=cache, metrics=metrics, rate=rate
+    )
+    # an offline run goes through all the songs again, so it has its own (temporary) state
+    state = CrawlState(':memory:') if args.offline else CrawlState()
+    if args.requeue_failed:
+        print(f"{state.requeue_failed(max_retries=args.max_retries)} failed urls re-queued")
+    with DriverPool(args.drivers, args.recycle_after, metrics=metrics) as pool, \
+            ImagePipeline(tool, workers=args.image_workers) as images:
+        curl_song_through_artists_async(
+            tool, pool, images, state, args.concurrency, args.rate, args.burst, args.site_url
+        )
+    tool.report_latency()
+    print(state.counts())
+    print(f"report written to {metrics.write_report(args.report)}")
@@ -0,0 +1,241 @@
+"""an end-to-end benchmark of the crawlers against the local replay server.
+
+The replay server (see replay_server.py) serves the info under SAVED_INFO_PATH, and
+the crawlers (artist_info_curl.curl_info, song_curl.curl_song_through_artists and the
+discovery crawl song_curl.discover_songs) crawl it into a scratch directory, so the runs with different settings (or different code)
+can be compared on one machine. The replay server and each crawler run in processes of
+their own, so the cpu time measured is the crawler's only (with its parse pool).
+
+The report gives, for each crawler, the wall time, the cpu time, the requests (every
+try, with the retries) and pages per second, the crawl state at the end, and the
+timings of the stages (see crawl_metrics.py). With --max-rate the crawlers' requests
+go through the adaptive rate controller (see rate_control.py), whose final rates are
+reported with the gauges; without it they are not limited.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from artist_info_curl import curl_info
+from browser_pool import DriverPool
+from crawl_metrics import CrawlMetrics
+from crawl_state import CrawlState
+from image_pipeline import ImagePipeline
+from parse_pool import ParsePool
+from rate_control import RateController
+from requests_get import RequestsGet, HEADERS, COOKIES
+from song_curl import curl_song_through_artists, discover_songs
+from store import ARTIST_HREFS_PATH
+
+CRAWLERS = ('artist', 'song', 'discover')
+
+# the image directories the crawlers write into, under the scratch directory (the records
+# go to its corpus store)
+OUTPUT_DIRS = ('artist_info/artist_images', 'song_info/song_image')
+
+def prepare_output(out_path: str, artists: int | None) -> None:
+
+    """make the scratch directory the crawlers write into, with the first artists' hrefs"""
+
+    for directory in OUTPUT_DIRS:
+        os.makedirs(f"{out_path}/{directory}", exist_ok=True)
+    with open(ARTIST_HREFS_PATH, 'r', encoding='utf-8') as f:
+        hrefs_list = json.load(f)[:artists]
+    with open(f"{out_path}/artist_hrefs.json", 'w', encoding='utf-8') as f:
+        json.dump(hrefs_list, f, indent=4)
+
+def start_replay_server(latency: float, jitter: float, error_rate: float, reset_rate: float,
+                        seed: int | None) -> tuple[subprocess.Popen, str]:
+
+    """start the replay server in a process of its own
+
+    Returns:
+        process (subprocess.Popen): the process of the server
+        url (str): the root url of the server
+    """
+
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay_server.py'),
+            '--port', '0', '--latency', str(latency), '--jitter', str(jitter),
+            '--error-rate', str(error_rate), '--reset-rate', str(reset_rate),
+        ] + ([] if seed is None else ['--seed', str(seed)]),
+        stdout=subprocess.PIPE, text=True, encoding='utf-8'
+    )
+    # the first line is "replaying on <url> (...)"
+    line = process.stdout.readline()
+    if not line.startswith('replaying on '):
+        process.kill()
+        raise RuntimeError(f"the replay server did not start: {line!r}")
+    return process, line.split()[2]
+
+def cpu_seconds() -> float:
+
+    """the cpu time of this process and of its finished children (not counted on windows)"""
+
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def run_crawl(crawler: str, site_url: str, drivers: int = 2, image_workers: int = 8,
+              parse_workers: int | None = None, rate: float = 2.0, max_rate: float = 0.0,
+              max_songs: int | None = None) -> dict:
+
+    """run one crawler over the replay server and measure it (in the crawler's process)
+
+    Args:
+        crawler (str): 'artist' (curl_info), 'song' (curl_song_through_artists) or 'discover' (discover_songs)
+        site_url (str): the root url of the replay server
+        drivers (int): the number of headless drivers of the song crawler
+        image_workers (int): the number of threads downloading the images
+        parse_workers (int | None): the number of processes parsing the pages, one per core if None
+        rate (float): the starting requests per second of the rate controller
+        max_rate (float): the most requests per second of the rate controller, 0 for no controller
+        max_songs (int | None): the most songs of the discovery crawl, no limit if None
+
+    Returns:
+        result (dict): the measures of the run
+    """
+
+    metrics = CrawlMetrics(f"bench {crawler}")
+    controller = RateController(initial_rate=rate, max_rate=max_rate, metrics=metrics) if max_rate > 0 else None
+    tool = RequestsGet(headers=HEADERS, cookies=COOKIES, metrics=metrics, rate=controller)
+    state = CrawlState(':memory:')
+    wall_start = time.perf_counter()
+    cpu_start = cpu_seconds()
+    with ImagePipeline(tool, workers=image_workers) as images, ParsePool(parse_workers) as parser:
+        if crawler == 'artist':
+            curl_info(tool, images, parser, state, site_url)
+        else:
+            with DriverPool(drivers, metrics=metrics) as pool:
+                if crawler == 'song':
+                    curl_song_through_artists(tool, pool, images, parser, state, site_url)
+                else:
+                    discover_songs(tool, pool, images, parser, state, site_url, max_songs=max_songs)
+    wall_time = time.perf_counter() - wall_start
+    # the parse pool's processes are joined by now, so their cpu time is counted too
+    cpu_time = cpu_seconds() - cpu_start
+
+    summary = metrics.summary()
+    return {
+        'crawler': crawler,
+        'wall time': round(wall_time, 3),
+        'cpu time': round(cpu_time, 3),
+        'cpu share': round(cpu_time / wall_time, 3),
+        'requests': len(tool.latencies),
+        'requests per second': round(len(tool.latencies) / wall_time, 2),
+        'pages': summary['pages'],
+        'pages per second': round(summary['pages'] / wall_time, 2),
+        'crawl state': state.counts(),
+        'counters': summary['counters'],
+        'gauges': summary['gauges'],
+        'stages': summary['stages'],
+    }
+
+def run_benchmark(out_path: str, artists: int | None = 20, crawlers: tuple[str, ...] = ('artist', 'song'),
+                  latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                  reset_rate: float = 0.0, seed: int | None = 0, drivers: int = 2,
+                  image_workers: int = 8, parse_workers: int | None = None, rate: float = 2.0,
+                  max_rate: float = 0.0, max_songs: int | None = None, quiet: bool = True) -> list[dict]:
+
+    """run the crawlers one after the other against a new replay server
+
+    Args:
+        out_path (str): the scratch directory the crawlers write into
+        artists (int | None): the number of artists crawled, all if None
+        crawlers (tuple[str, ...]): the crawlers run, in order
+        latency, jitter, error_rate, reset_rate, seed: the settings of the replay server
+        drivers (int): the number of headless drivers of the song crawler
+        image_workers (int): the number of threads downloading the images
+        parse_workers (int | None): the number of processes parsing the pages, one per core if None
+        rate (float): the starting requests per second of the rate controller
+        max_rate (float): the most requests per second of the rate controller, 0 for no controller
+        max_songs (int | None): the most songs of the discovery crawl, no limit if None
+        quiet (bool): whether the crawlers' own output is hidden
+
+    Returns:
+        results (list[dict]): the measures of every crawler
+    """
+
+    prepare_output(out_path, artists)
+    server, site_url = start_replay_server(latency, jitter, error_rate, reset_rate, seed)
+    results = []
+    try:
+        for crawler in crawlers:
+            result_path = f"{out_path}/bench_{crawler}.json"
+            # the crawler writes into the scratch directory, see store.py
+            env = dict(os.environ, SONG_CURL_SAVED_INFO=out_path)
+            subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__), '--child', crawler, '--site-url', site_url,
+                    '--result', result_path, '--drivers', str(drivers), '--image-workers', str(image_workers),
+                    '--rate', str(rate), '--max-rate', str(max_rate),
+                ] + ([] if parse_workers is None else ['--parse-workers', str(parse_workers)])
+                + ([] if max_songs is None else ['--max-songs', str(max_songs)]),
+                env=env, check=True, stdout=subprocess.DEVNULL if quiet else None
+            )
+            with open(result_path, 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the crawlers against the local replay server")
+    parser.add_argument('--artists', type=int, default=20, help="number of artists crawled (0 for all)")
+    parser.add_argument('--crawlers', nargs='+', choices=CRAWLERS, default=['artist', 'song'], help="crawlers run")
+    parser.add_argument('--max-songs', type=int, default=None, help="most songs of the discovery crawl")
+    parser.add_argument('--latency', type=float, default=0.0, help="delay (seconds) of every answer")
+    parser.add_argument('--jitter', type=float, default=0.0, help="most random delay (seconds) added to the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of the requests answered with a 503")
+    parser.add_argument('--reset-rate', type=float, default=0.0, help="share of the connections closed without answer")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the replay server's jitter and failures")
+    parser.add_argument('--drivers', type=int, default=2, help="number of headless drivers")
+    parser.add_argument('--image-workers', type=int, default=8, help="number of threads downloading the images")
+    parser.add_argument('--parse-workers', type=int, default=None, help="processes parsing the pages (0: no process)")
+    parser.add_argument('--rate', type=float, default=2.0, help="starting requests per second of the rate controller")
+    parser.add_argument('--max-rate', type=float, default=0.0, help="most requests per second on each host (0: no limit)")
+    parser.add_argument('--out', default=None, help="scratch directory (default: a temporary one, removed after)")
+    parser.add_argument('--json', default=None, help="also write the results to this json file")
+    parser.add_argument('--verbose', action='store_true', help="show the crawlers' own output")
+    # the crawler processes started by run_benchmark
+    parser.add_argument('--child', choices=CRAWLERS, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--site-url', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        result = run_crawl(
+            args.child, args.site_url, args.drivers, args.image_workers, args.parse_workers, args.rate,
+            args.max_rate, args.max_songs
+        )
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=4)
+        sys.exit(0)
+
+    out_path = args.out if args.out is not None else tempfile.mkdtemp(prefix='bench_crawl_')
+    try:
+        results = run_benchmark(
+            out_path, args.artists or None, tuple(args.crawlers), args.latency, args.jitter,
+            args.error_rate, args.reset_rate, args.seed, args.drivers, args.image_workers,
+            args.parse_workers, args.rate, args.max_rate, args.max_songs, not args.verbose
+        )
+    finally:
+        if args.out is None:
+            shutil.rmtree(out_path, ignore_errors=True)
+    for result in results:
+        print(
+            f"{result['crawler']}: {result['wall time']}s wall, {result['cpu time']}s cpu "
+            f"({result['cpu share']:.0%}), {result['requests']} requests ({result['requests per second']}/s), "
+            f"{result['pages']} pages ({result['pages per second']}/s), {result['crawl state']}"
+        )
+        for gauge, value in result['gauges'].items():
+            print(f"    {gauge}: {value}")
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
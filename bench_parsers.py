@@ -0,0 +1,181 @@
+"""a benchmark of the page parsers: the XPath ones against the BeautifulSoup ones.
+
+The pages come from the http cache (the pages crawled before) when there are any.
+Otherwise they are rebuilt from the crawled info: the artists of artist_info_curl_exp
+and artist_intro give the desc pages, the songs of song_intro give the song pages and
+artist_song_ids gives the songs pages of the artists, with the markup the parsers look
+for and the usual navigation and scripts around it.
+
+Every parser first runs over all the pages to check the two versions give the same
+results. Then each runs alone in a new process, which reports its pages per second,
+the peak of the python memory (tracemalloc) and the growth of the process' peak
+resident memory (which also sees lxml's own memory, not on windows).
+"""
+
+import argparse
+import glob
+import json
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from page_parser import (
+    parse_artist_page, parse_artist_page_soup, parse_song_page, parse_song_page_soup,
+    parse_song_list, parse_song_list_soup
+)
+from replay_server import artist_page, song_page, song_list_page
+from store import SAVED_INFO_PATH, HTTP_CACHE_PATH, ARTIST_INTRO_PATH, SONG_INTRO_PATH, ARTIST_SONG_IDS_PATH
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+EXAMPLE_PATH = f"{SAVED_INFO_PATH}/artist_info_curl_exp"
+
+# the parsers of each kind of page, the new one first
+PARSERS = {
+    'artist desc': (parse_artist_page, parse_artist_page_soup),
+    'song': (parse_song_page, parse_song_page_soup),
+    'song list': (parse_song_list, parse_song_list_soup),
+}
+
+def load_json_files(pattern: str, limit: int | None) -> list:
+
+    """the content of the json files matching the pattern"""
+
+    contents = []
+    for path in sorted(glob.glob(pattern))[:limit]:
+        with open(path, 'r', encoding='utf-8') as f:
+            contents.append(json.load(f))
+    return contents
+
+def cached_pages() -> dict[str, list[str]]:
+
+    """the pages of each kind in the http cache"""
+
+    pages: dict[str, list[str]] = {kind: [] for kind in PARSERS}
+    for meta_path in glob.glob(f"{HTTP_CACHE_PATH}/*/*.json"):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if '/artist/desc?' in meta['url']:
+            kind = 'artist desc'
+        elif '/song?' in meta['url']:
+            kind = 'song'
+        elif '/artist?' in meta['url']:
+            kind = 'song list'
+        else:
+            continue
+        with open(f"{meta_path[:-len('.json')]}.body", 'rb') as f:
+            pages[kind].append(f.read().decode(meta['encoding'] or 'utf-8', errors='replace'))
+    return pages
+
+def rebuilt_pages(limit: int | None) -> dict[str, list[str]]:
+
+    """the pages of each kind rebuilt from the stored info"""
+
+    artists = load_json_files(f"{EXAMPLE_PATH}/*.json", None) + load_json_files(f"{ARTIST_INTRO_PATH}/*.json", limit)
+    return {
+        'artist desc': [artist_page(artist, f"https://p1.music.126.net/artist/{i}.jpg") for i, artist in enumerate(artists)],
+        'song': [
+            song_page(song, f"https://p1.music.126.net/cover/{song['id']}.jpg")
+            for song in load_json_files(f"{SONG_INTRO_PATH}/*.json", limit)
+        ],
+        'song list': [song_list_page(ids) for ids in load_json_files(f"{ARTIST_SONG_IDS_PATH}/*.json", limit)],
+    }
+
+def load_pages(limit: int | None = None) -> tuple[dict[str, list[str]], str]:
+
+    """the pages of each kind, from the http cache or else rebuilt, and where they come from"""
+
+    pages = cached_pages()
+    if all(pages.values()):
+        return {kind: kind_pages[:limit] for kind, kind_pages in pages.items()}, 'http cache'
+    return rebuilt_pages(limit), 'rebuilt from the stored info'
+
+def compare(kind: str, pages: list[str]) -> int:
+
+    """run both parsers of the kind over the pages, the number of pages they disagree on"""
+
+    new_parser, old_parser = PARSERS[kind]
+    mismatches = 0
+    for page in pages:
+        if new_parser(page) != old_parser(page):
+            mismatches += 1
+    return mismatches
+
+def measure(kind: str, version: int, pages: list[str], repeat: int) -> dict:
+
+    """time one parser over the pages and measure its memory (run in its own process)"""
+
+    parser = PARSERS[kind][version]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            parser(page)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+
+    # tracemalloc slows the parsers down, so the memory is measured in a second pass
+    tracemalloc.start()
+    for page in pages:
+        parser(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'parser': parser.__name__,
+        'pages per second': round(repeat * len(pages) / elapsed, 1),
+        'python peak (KB)': round(peak / 1024),
+        # ru_maxrss is in KB on linux
+        'rss growth (KB)': None if resource is None else rss_after - rss_before,
+    }
+
+def run_benchmark(limit: int | None = None, repeat: int = 3) -> dict:
+
+    """benchmark the two versions of every parser
+
+    Args:
+        limit (int | None): the most pages of each kind used, all if None
+        repeat (int): how many times the pages are parsed for the timing
+
+    Returns:
+        report (dict): where the pages come from, and for each kind the number of pages,
+            the mismatches of the two versions and the measures of each version
+    """
+
+    pages, source = load_pages(limit)
+    report = {'pages from': source, 'kinds': {}}
+    for kind, kind_pages in pages.items():
+        if not kind_pages:
+            continue
+        results = []
+        for version in range(2):
+            # a new process for each parser, so the peak memory is its own
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results.append(executor.submit(measure, kind, version, kind_pages, repeat).result())
+        report['kinds'][kind] = {
+            'pages': len(kind_pages),
+            'mismatches': compare(kind, kind_pages),
+            'results': results,
+        }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the XPath parsers against the BeautifulSoup parsers")
+    parser.add_argument('--limit', type=int, default=None, help="most pages of each kind")
+    parser.add_argument('--repeat', type=int, default=3, help="times the pages are parsed for the timing")
+    parser.add_argument('--json', default=None, help="also write the report to this json file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.limit, args.repeat)
+    print(f"pages {report['pages from']}")
+    for kind, kind_report in report['kinds'].items():
+        print(f"{kind}: {kind_report['pages']} pages, {kind_report['mismatches']} mismatches")
+        for result in kind_report['results']:
+            print(
+                f"    {result['parser']:<24} {result['pages per second']:>9} pages/s  "
+                f"python peak {result['python peak (KB)']:>6} KB  rss growth {result['rss growth (KB)']} KB"
+            )
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,220 @@
+"""a pool of reusable headless chrome drivers for getting the lyrics.
+
+Loading a song page in a browser is the slowest part of the crawl, so this module
+runs several headless drivers, each in its own thread, fed from one work queue.
+The drivers do not load images, fonts or css (the image's url is still read from the
+page), and a driver is replaced after a number of pages or when it crashes.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from crawl_metrics import CrawlMetrics
+
+# the resources the drivers never download, the lyrics only need the html and scripts
+BLOCKED_URLS = [
+    "*.css", "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+]
+
+def make_driver(block_resources: bool = False) -> webdriver.Chrome:
+
+    """prepare a selenium driver without screen
+
+    Args:
+        block_resources (bool): whether images, fonts and css should not be loaded
+
+    Returns:
+        driver (webdriver.Chrome): the headless driver
+    """
+
+    chrome_options = Options()
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--disable-gpu')
+    chrome_options.add_argument('--enable-javascript')
+    if block_resources:
+        # don't wait for the blocked resources before returning from driver.get
+        chrome_options.page_load_strategy = 'eager'
+        chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+        chrome_options.add_experimental_option(
+            'prefs', {'profile.managed_default_content_settings.images': 2}
+        )
+    driver = webdriver.Chrome(options=chrome_options)
+    if block_resources:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+    return driver
+
+def get_lyrics_with_driver(driver: webdriver.Chrome, song_url: str, explicit_waits: bool = False,
+                           timeout: float = 15) -> tuple[str, str]:
+
+    """get the image url and the lyrics of a song with the webdriver
+
+    Args:
+        driver (webdriver.Chrome): a driver constructed by selenium
+        song_url (str): the full url of the song page
+        explicit_waits (bool):
+            if True, wait for the lyrics themselves and expand them right away; if False,
+            wait for the "展开" button to be clickable and sleep before clicking it
+        timeout (float): the longest time (seconds) to wait for any element
+
+    Returns:
+        img_url (str): the url of the song's image
+        lyrics (str): the lyrics of the song
+    """
+
+    driver.get(song_url)
+    wait = WebDriverWait(driver, timeout) #driver will wait for at most timeout for any movement or raise errors
+
+    #change to iframe
+    iframe = wait.until(EC.presence_of_element_located((By.TAG_NAME, "iframe")))
+    driver.switch_to.frame(iframe)
+
+    #get the image
+    image = wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'j-img')))
+    img_url = image.get_attribute('src')
+
+    if explicit_waits:
+        # the "展开" button is rendered with the lyrics, so once the lyrics are there a
+        # missing button means there is nothing to expand (no need to wait for it)
+        element = wait.until(EC.presence_of_element_located((By.ID, "lyric-content")))
+        more = driver.find_elements(By.XPATH, "//*[text()='展开']")
+        if more:
+            driver.execute_script("arguments[0].click();", more[0])
+            wait.until(EC.presence_of_element_located((By.XPATH, "//*[text()='收起']")))
+        return img_url, element.text
+
+    #click the "展开" button for lyrics
+    try:
+        more = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[text()='展开']")))
+        driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", more)
+        time.sleep(0.5)
+        more.click()
+    except TimeoutException:
+        print('No "展开" button')
+
+    #get the lyrcis
+    element = driver.find_element(By.ID, "lyric-content")
+    return img_url, element.text
+
+class DriverPool:
+
+    """a pool of headless drivers getting the lyrics from a work queue
+
+    Each worker thread owns one driver. The driver is started when the worker gets its
+    first song, and is quit and replaced after max_pages songs or after it crashes.
+
+    Attributes:
+        size (int): the number of drivers (and worker threads)
+        max_pages (int): how many songs a driver loads before it is replaced
+        explicit_waits (bool): whether get_lyrics_with_driver uses explicit waits
+        timeout (float): the longest time (seconds) the drivers wait for any element
+        metrics (CrawlMetrics | None): where the time of every page is recorded (as 'browser')
+        jobs (queue.Queue): the songs waiting for a driver, with their futures
+        workers (list[threading.Thread]): the worker threads
+    """
+
+    def __init__(self, size: int = 2, max_pages: int = 100, explicit_waits: bool = True,
+                 timeout: float = 15, metrics: CrawlMetrics | None = None):
+
+        """start the worker threads (the drivers are started lazily)"""
+
+        self.size = size
+        self.max_pages = max_pages
+        self.explicit_waits = explicit_waits
+        self.timeout = timeout
+        self.metrics = metrics
+        self.jobs: queue.Queue = queue.Queue()
+        self.workers = [
+            threading.Thread(target=self.work, name=f"driver-{i}", daemon=True) for i in range(size)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, song_url: str) -> Future:
+
+        """queue a song page, the future's result is (img_url, lyrics)"""
+
+        future: Future = Future()
+        self.jobs.put((song_url, future))
+        return future
+
+    def work(self) -> None:
+
+        """the loop of a worker thread"""
+
+        driver = None
+        pages = 0
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            song_url, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                if driver is None:
+                    driver = make_driver(block_resources=True)
+                    pages = 0
+                result = get_lyrics_with_driver(driver, song_url, self.explicit_waits, self.timeout)
+            except TimeoutException as error:
+                # the page was too slow or has no lyrics, the driver itself is fine
+                future.set_exception(error)
+            except WebDriverException as error:
+                # the driver crashed (or lost its browser), start a new one for the next song
+                future.set_exception(error)
+                if driver is not None:
+                    self.quit_driver(driver)
+                driver = None
+            except Exception as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+            if self.metrics is not None:
+                self.metrics.record('browser', time.perf_counter() - start)
+            pages += 1
+            if driver is not None and pages >= self.max_pages:
+                self.quit_driver(driver)
+                driver = None
+        if driver is not None:
+            self.quit_driver(driver)
+
+    def quit_driver(self, driver: webdriver.Chrome) -> None:
+
+        """quit a driver, ignoring the errors of a driver that already crashed"""
+
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def close(self, cancel_pending: bool = False) -> None:
+
+        """finish (or cancel) the queued songs, then quit all the drivers"""
+
+        if cancel_pending:
+            while True:
+                try:
+                    _, future = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                future.cancel()
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # after an error nobody is waiting for the queued songs any more
+        self.close(cancel_pending=exc_type is not None)
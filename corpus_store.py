@@ -0,0 +1,475 @@
+"""a packed, append-only store of the crawled records, instead of one json file per record.
+
+The records (a dict with an 'id') are kept in collections:
+    songs: the songs' intros (what song_curl stored in song_intro/song{id}.json)
+    artists: the artists' intros (artist_intro/artist{id}.json)
+    artist songs: the song ids of each artist ({'id': ..., 'song ids': [...]},
+        artist_song_ids/artist{id}songs.json)
+Each collection is cut in shards by the crc32 of the ids, and each shard is written in
+append-only segments of json lines (segment_bytes at most). With zstd compression each
+record is a zstd frame of its own, so a record is still read alone, and a whole
+segment decompresses (zstd -d) to json lines. Every process writing has segments of
+its own (the writer in the segment's name), so the parse pool's processes write
+without locking each other.
+
+An sqlite index (index.sqlite3) holds the segment, offset and length of the latest
+version of every record, for the random access by id (get) and for the streaming
+readers (iterate, in the order of the segments). Writing a record again only appends
+it and moves its index entry. The images stay files (see image_pipeline.py), they are
+served as they are.
+
+The crawl workers (see crawl_worker.py) each write a store of their own (the variable
+SONG_CURL_CORPUS moves the store of corpus()), and merge_stores puts them together:
+the ids are put in order and an id crawled by several workers is taken from the first
+store by path, so the merged records don't depend on the order of the workers.
+
+The songs are fingerprinted as they are stored, to group the near duplicates (see
+near_dup.py and near_dups()); regroup() fingerprints a whole store again, after a
+conversion or a merge.
+
+Running this module converts the current layout (the json files under SAVED_INFO_PATH)
+into the store, merges the stores of the workers, regroups the near duplicates, or
+shows the records of the store.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Iterator
+from near_dup import NearDupIndex
+from store import CORPUS_PATH, SONG_INTRO_PATH, ARTIST_INTRO_PATH, ARTIST_SONG_IDS_PATH
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COLLECTIONS = ('songs', 'artists', 'artist songs')
+
+# the near-duplicate index of a store, in its directory (see near_dup.py)
+NEAR_DUP_FILE = 'near_dup.sqlite3'
+
+class CorpusStore:
+
+    """the sharded, append-only segments of the records, with their index
+
+    The settings (shards, compression, segment size) are chosen when the store is
+    made and kept in its corpus.json, every writer follows them. An instance is shared
+    by the threads of a process (the accesses hold a lock), each process opens its own.
+
+    Attributes:
+        path (str): the directory of the store
+        shards (int): the number of shards of each collection
+        compression (str | None): 'zstd' or None
+        segment_bytes (int): a segment is closed once it is this large
+        writer (str): the name of this writer, in the names of its segments
+        connection (sqlite3.Connection): the connection to the index
+        segments (dict[tuple[str, int], tuple[str, object]]): the open segment (name and file) of each shard written
+        readers (dict[str, int]): the file descriptors of the segments read
+        lock (threading.Lock): serializes the accesses of the threads
+    """
+
+    def __init__(self, path: str = CORPUS_PATH, shards: int = 16, compression: str | None = None,
+                 segment_bytes: int = 64 * 1024 * 1024, writer: str | None = None):
+
+        """open the store, making it with these settings if it doesn't exist (a new writer name if None)"""
+
+        self.path = path
+        settings_path = f"{path}/corpus.json"
+        if os.path.exists(settings_path):
+            with open(settings_path, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+        else:
+            settings = {'shards': shards, 'compression': compression, 'segment bytes': segment_bytes}
+            os.makedirs(path, exist_ok=True)
+            with open(settings_path, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, indent=4)
+        self.shards = settings['shards']
+        self.compression = settings['compression']
+        self.segment_bytes = settings['segment bytes']
+        if self.compression == 'zstd' and zstandard is None:
+            raise RuntimeError("the store is compressed with zstd, the zstandard package is needed")
+        self.compressor = zstandard.ZstdCompressor() if self.compression == 'zstd' else None
+        self.writer = writer if writer is not None else f"{time.strftime('%Y%m%d')}-{uuid.uuid4().hex[:8]}"
+        self.segments: dict[tuple[str, int], tuple[str, object]] = {}
+        self.readers: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+        # several processes write the index, they wait for each other's transactions
+        self.connection = sqlite3.connect(f"{path}/index.sqlite3", timeout=60, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "collection TEXT NOT NULL, id TEXT NOT NULL, shard INTEGER NOT NULL, "
+                "segment TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL, "
+                "PRIMARY KEY (collection, id)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS records_order ON records (collection, segment, offset)"
+            )
+
+    def shard(self, id) -> int:
+
+        """the shard of the id"""
+
+        return zlib.crc32(str(id).encode('utf-8')) % self.shards
+
+    def segment(self, collection: str, shard: int, size: int) -> tuple[str, object]:
+
+        """the segment of this writer the next record (of the size) of the shard goes to (hold the lock)"""
+
+        name, file = self.segments.get((collection, shard), (None, None))
+        if file is not None and file.tell() + size <= self.segment_bytes:
+            return name, file
+        if file is not None:
+            file.close()
+        directory = f"{self.path}/{collection.replace(' ', '_')}"
+        os.makedirs(directory, exist_ok=True)
+        suffix = '.jsonl.zst' if self.compressor is not None else '.jsonl'
+        number = len(glob.glob(f"{directory}/shard{shard:03d}-{self.writer}-*"))
+        name = f"{collection.replace(' ', '_')}/shard{shard:03d}-{self.writer}-{number:04d}{suffix}"
+        # unbuffered: a record is in the file as soon as put() returns, even if the process is killed
+        file = open(f"{self.path}/{name}", 'ab', buffering=0)
+        self.segments[(collection, shard)] = (name, file)
+        return name, file
+
+    def put(self, collection: str, record: dict) -> None:
+
+        """append the record (with its 'id') to its shard, and point the index to it"""
+
+        id = str(record['id'])
+        data = json.dumps(record, ensure_ascii=False, sort_keys=False).encode('utf-8') + b'\n'
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        shard = self.shard(id)
+        with self.lock:
+            name, file = self.segment(collection, shard, len(data))
+            offset = file.tell()
+            file.write(data)
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO records (collection, id, shard, segment, offset, length) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (collection, id, shard, name, offset, len(data))
+                )
+
+    def read(self, segment: str, offset: int, length: int) -> bytes:
+
+        """the json line of the record at the offset of the segment"""
+
+        with self.lock:
+            if segment not in self.readers:
+                self.readers[segment] = os.open(f"{self.path}/{segment}", os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            fd = self.readers[segment]
+        data = os.pread(fd, length, offset) if hasattr(os, 'pread') else self.read_at(fd, offset, length)
+        if segment.endswith('.zst'):
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return data
+
+    def read_at(self, fd: int, offset: int, length: int) -> bytes:
+
+        """read without pread (not on windows), moving the shared position under the lock"""
+
+        with self.lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, length)
+
+    def get(self, collection: str, id) -> dict | None:
+
+        """the latest record of the id, None if there is none"""
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT segment, offset, length FROM records WHERE collection = ? AND id = ?",
+                (collection, str(id))
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(self.read(*row))
+
+    def has(self, collection: str, id) -> bool:
+
+        """whether there is a record of the id"""
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM records WHERE collection = ? AND id = ?", (collection, str(id))
+            ).fetchone()
+        return row is not None
+
+    def count(self, collection: str) -> int:
+
+        """the number of records (latest versions) of the collection"""
+
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM records WHERE collection = ?", (collection,)
+            ).fetchone()[0]
+
+    def ids(self, collection: str) -> list[str]:
+
+        """the ids of the records of the collection"""
+
+        with self.lock:
+            rows = self.connection.execute("SELECT id FROM records WHERE collection = ?", (collection,)).fetchall()
+        return [row[0] for row in rows]
+
+    def locations(self, collection: str) -> dict[str, tuple[str, int, int]]:
+
+        """the segment, offset and length of the latest record of each id (a new version moves it)"""
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, segment, offset, length FROM records WHERE collection = ?", (collection,)
+            ).fetchall()
+        return {id: (segment, offset, length) for id, segment, offset, length in rows}
+
+    def iterate_lines(self, collection: str, shards: list[int] | None = None,
+                      batch: int = 1000) -> Iterator[bytes]:
+
+        """go through the json lines of the latest records, in the order of the segments
+
+        The index is read a batch at a time, so the stream holds one batch in memory
+        whatever the size of the collection.
+
+        Args:
+            collection (str): the collection read
+            shards (list[int] | None): only read these shards, all if None
+            batch (int): the number of index entries read at once
+
+        Returns:
+            lines (Iterator[bytes]): the json line of every record
+        """
+
+        query = (
+            "SELECT segment, offset, length FROM records WHERE collection = ? "
+            "AND (segment, offset) > (?, ?)"
+        )
+        if shards is not None:
+            query += f" AND shard IN ({', '.join('?' * len(shards))})"
+        query += " ORDER BY segment, offset LIMIT ?"
+        last = ('', -1)
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    query, [collection, *last, *(shards or []), batch]
+                ).fetchall()
+            if not rows:
+                return
+            for segment, offset, length in rows:
+                yield self.read(segment, offset, length)
+            last = rows[-1][:2]
+
+    def iterate(self, collection: str, shards: list[int] | None = None) -> Iterator[dict]:
+
+        """go through the latest records of the collection (see iterate_lines)"""
+
+        for line in self.iterate_lines(collection, shards):
+            yield json.loads(line)
+
+    def sync(self) -> None:
+
+        """write the open segments to the disk (fsync)"""
+
+        with self.lock:
+            for _, file in self.segments.values():
+                os.fsync(file.fileno())
+
+    def close(self) -> None:
+
+        """sync and close the segments and the index"""
+
+        self.sync()
+        with self.lock:
+            for _, file in self.segments.values():
+                file.close()
+            self.segments.clear()
+            for fd in self.readers.values():
+                os.close(fd)
+            self.readers.clear()
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+# the store of each process, see corpus()
+_corpus: CorpusStore | None = None
+_corpus_pid: int | None = None
+_corpus_lock = threading.Lock()
+
+def corpus() -> CorpusStore:
+
+    """the store of this process (under CORPUS_PATH, or SONG_CURL_CORPUS), opened at the first use
+
+    The crawlers (and the processes of their parse pool) write through it. The segments
+    are unbuffered, so nothing is lost when a process ends without closing it.
+    """
+
+    global _corpus, _corpus_pid
+    with _corpus_lock:
+        # a forked process gets its own writer (and its own sqlite connection)
+        if _corpus is None or _corpus_pid != os.getpid():
+            _corpus = CorpusStore(os.environ.get("SONG_CURL_CORPUS", CORPUS_PATH))
+            _corpus_pid = os.getpid()
+        return _corpus
+
+# the near-duplicate index of each process, see near_dups()
+_near_dups: NearDupIndex | None = None
+_near_dups_pid: int | None = None
+
+def near_dups() -> NearDupIndex:
+
+    """the near-duplicate index of the store of corpus(), opened at the first use"""
+
+    global _near_dups, _near_dups_pid
+    path = corpus().path
+    with _corpus_lock:
+        if _near_dups is None or _near_dups_pid != os.getpid():
+            _near_dups = NearDupIndex(f"{path}/{NEAR_DUP_FILE}")
+            _near_dups_pid = os.getpid()
+        return _near_dups
+
+def regroup(store: CorpusStore) -> dict[str, int]:
+
+    """fingerprint all the songs of the store again, in the order of their ids
+
+    The songs stored without a fingerprint (converted from the json files) get one, and
+    the groups of merged stores (each worker started its own groups) become the ones of
+    the songs in order. Only the songs whose fingerprint or group changed are put again.
+
+    Returns:
+        stats (dict[str, int]): the songs fingerprinted, the groups, the duplicates and the songs put again
+    """
+
+    index = NearDupIndex(f"{store.path}/{NEAR_DUP_FILE}")
+    try:
+        index.clear()
+        changed = 0
+        for id in sorted(store.ids('songs'), key=id_order):
+            song = store.get('songs', id)
+            fingerprint = index.fingerprint(id, song.get('lyrics', ''))
+            previous = {key: song.pop(key) for key in ('lyrics simhash', 'lyrics group') if key in song}
+            song.update(fingerprint)
+            if previous != fingerprint:
+                store.put('songs', song)
+                changed += 1
+        return dict(index.stats(), changed=changed)
+    finally:
+        index.close()
+
+def convert_layout(store: CorpusStore) -> dict[str, int]:
+
+    """put the records of the current layout (one json file per record) in the store
+
+    Returns:
+        counts (dict[str, int]): the number of records put in each collection
+    """
+
+    counts = {collection: 0 for collection in COLLECTIONS}
+    for collection, pattern in (('songs', f"{SONG_INTRO_PATH}/*.json"), ('artists', f"{ARTIST_INTRO_PATH}/*.json")):
+        for path in sorted(glob.glob(pattern)):
+            with open(path, 'r', encoding='utf-8') as f:
+                store.put(collection, json.load(f))
+            counts[collection] += 1
+    for path in sorted(glob.glob(f"{ARTIST_SONG_IDS_PATH}/*.json")):
+        # the artist's id is only in the file's name
+        artist_id = re.search(r'artist([0-9]+)songs\.json$', path).group(1)
+        with open(path, 'r', encoding='utf-8') as f:
+            store.put('artist songs', {'id': int(artist_id), 'song ids': json.load(f)})
+        counts['artist songs'] += 1
+    return counts
+
+def id_order(id: str) -> tuple:
+
+    """the sort key of an id: the numeric ids by value, before the others"""
+
+    return (0, int(id), id) if id.isdigit() else (1, 0, id)
+
+def merge_stores(target: CorpusStore, source_paths: list[str]) -> dict[str, int]:
+
+    """put the records of the stores (e.g. of the crawl workers) in the target store
+
+    The records are put in the order of their ids, and an id in several stores is taken
+    from the first one by path, so merging the same stores gives the same records
+    whatever the order they are given in.
+
+    Args:
+        target (CorpusStore): the store the records are put in
+        source_paths (list[str]): the directories of the stores merged
+
+    Returns:
+        counts (dict[str, int]): the number of records put in each collection
+    """
+
+    sources = [CorpusStore(path) for path in sorted(source_paths)]
+    counts = {}
+    try:
+        for collection in COLLECTIONS:
+            # the store each id is taken from (only the ids are held in memory)
+            chosen: dict[str, int] = {}
+            for i, source in enumerate(sources):
+                for id in source.ids(collection):
+                    chosen.setdefault(id, i)
+            for id in sorted(chosen, key=id_order):
+                target.put(collection, sources[chosen[id]].get(collection, id))
+            counts[collection] = len(chosen)
+    finally:
+        for source in sources:
+            source.close()
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="convert the crawled json files into the packed store, or read it")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help="put the json files of SAVED_INFO_PATH in the store")
+    convert_parser.add_argument('--shards', type=int, default=16, help="shards of each collection (new store)")
+    convert_parser.add_argument('--zstd', action='store_true', help="compress the records with zstd (new store)")
+    merge_parser = subparsers.add_parser('merge', help="put the stores of the crawl workers in the store")
+    merge_parser.add_argument('sources', nargs='+', help="directories of the workers' stores")
+    merge_parser.add_argument('--into', default=CORPUS_PATH, help="directory of the merged store")
+    subparsers.add_parser('regroup', help="fingerprint the songs of the store again, grouping the near duplicates")
+    subparsers.add_parser('stats', help="show the number of records and the size of each collection")
+    get_parser = subparsers.add_parser('get', help="show a record")
+    get_parser.add_argument('collection', choices=COLLECTIONS)
+    get_parser.add_argument('id')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        start = time.perf_counter()
+        with CorpusStore(CORPUS_PATH, args.shards, 'zstd' if args.zstd else None) as store:
+            counts = convert_layout(store)
+            groups = regroup(store)
+        print(f"{counts} converted in {time.perf_counter() - start:.2f}s into {CORPUS_PATH}, near duplicates: {groups}")
+    elif args.command == 'merge':
+        start = time.perf_counter()
+        # a fixed writer name, so the merged segments are the same from one merge to the other
+        with CorpusStore(args.into, writer='merge') as store:
+            counts = merge_stores(store, args.sources)
+            groups = regroup(store)
+        print(f"{counts} merged in {time.perf_counter() - start:.2f}s into {args.into}, near duplicates: {groups}")
+    elif args.command == 'regroup':
+        start = time.perf_counter()
+        with CorpusStore(CORPUS_PATH) as store:
+            groups = regroup(store)
+        print(f"near duplicates: {groups}, regrouped in {time.perf_counter() - start:.2f}s")
+    elif args.command == 'stats':
+        with CorpusStore(CORPUS_PATH) as store:
+            for collection in COLLECTIONS:
+                directory = f"{CORPUS_PATH}/{collection.replace(' ', '_')}"
+                size = sum(entry.stat().st_size for entry in os.scandir(directory)) if os.path.isdir(directory) else 0
+                print(f"{collection}: {store.count(collection)} records, {size / 1024 / 1024:.2f} MB")
+    else:
+        with CorpusStore(CORPUS_PATH) as store:
+            print(json.dumps(store.get(args.collection, args.id), ensure_ascii=False, indent=4))
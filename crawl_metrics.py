@@ -0,0 +1,193 @@
+"""timings and counters of the stages of a crawl, written to a json report.
+
+The crawlers time every stage of their work:
+    fetch: a try of an http request (one per retry)
+    parse: extracting the info from a page
+    browser: getting the lyrics with a headless driver
+    image: downloading and storing an image (with its thumbnail)
+    write: writing a json file
+    throttle: waiting for a slot of the host's request rate (see rate_control.py)
+and count the retries, the errors and the pages done. Gauges keep the last value of
+a measure that goes up and down, as the request rate of each host. At the end of a
+run the report (count, total, mean, p50, p95, p99 and max of each stage, the
+counters, the gauges and the pages per second) is written as json under CRAWL_REPORT_PATH, so the runs with
+different settings can be compared. A live progress line can also be shown.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from store import CRAWL_REPORT_PATH
+
+STAGES = ('fetch', 'parse', 'browser', 'image', 'write', 'throttle')
+
+def percentile(values: list[float], q: float) -> float:
+
+    """the q-th percentile (nearest rank) of the sorted values"""
+
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+class CrawlMetrics:
+
+    """the timings and counters of a crawl, shared by all the crawler's threads
+
+    Attributes:
+        name (str): the name of the run, used in the report's file name
+        progress (bool): whether the live progress line is shown
+        progress_interval (float): the least time (seconds) between two progress lines
+        last_progress (float): the monotonic time the last progress line was shown
+        started (float): the monotonic time the run started
+        started_at (float): the wall clock time the run started
+        timings (dict[str, list[float]]): the duration (seconds) of every timed stage
+        counters (dict[str, int]): the counters (retries, errors, pages of each kind...)
+        gauges (dict[str, float]): the last value of each gauge (the rate of each host...)
+        lock (threading.Lock): guards the timings, counters and gauges
+    """
+
+    def __init__(self, name: str = 'crawl', progress: bool = False, progress_interval: float = 1.0):
+
+        """start the clock of the run"""
+
+        self.name = name
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.timings: dict[str, list[float]] = {stage: [] for stage in STAGES}
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.last_progress = 0.0
+
+    def record(self, stage: str, seconds: float) -> None:
+
+        """record one duration of the stage"""
+
+        with self.lock:
+            self.timings.setdefault(stage, []).append(seconds)
+
+    def record_stages(self, timings: dict[str, float]) -> None:
+
+        """record the durations of several stages (e.g. measured in another process)"""
+
+        with self.lock:
+            for stage, seconds in timings.items():
+                self.timings.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def stage(self, stage: str):
+
+        """time the block as one run of the stage (also when it raises)"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def count(self, counter: str, n: int = 1) -> None:
+
+        """add n to the counter"""
+
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def set_gauge(self, gauge: str, value: float) -> None:
+
+        """set the current value of the gauge"""
+
+        with self.lock:
+            self.gauges[gauge] = value
+
+    def page_done(self, kind: str) -> None:
+
+        """count a page (an artist, a song...) done, and show the progress line if it is on"""
+
+        self.count('pages')
+        self.count(f'{kind} pages')
+        if self.progress:
+            now = time.monotonic()
+            if now - self.last_progress >= self.progress_interval:
+                self.last_progress = now
+                self.show_progress()
+
+    def show_progress(self) -> None:
+
+        """write the progress line (pages done, pages per second, retries, errors, rates) on stderr"""
+
+        with self.lock:
+            pages = self.counters.get('pages', 0)
+            retries = self.counters.get('retries', 0)
+            errors = self.counters.get('errors', 0)
+            rates = {gauge: value for gauge, value in self.gauges.items() if gauge.startswith('rate ')}
+        elapsed = time.monotonic() - self.started
+        rates_text = ''.join(f", {gauge} {value:.1f}/s" for gauge, value in rates.items())
+        sys.stderr.write(
+            f"\r{pages} pages in {elapsed:.0f}s ({pages / elapsed if elapsed else 0:.2f}/s), "
+            f"{retries} retries, {errors} errors{rates_text} "
+        )
+        sys.stderr.flush()
+
+    def summary(self) -> dict:
+
+        """the report of the run so far
+
+        Returns:
+            report (dict): the run's name, elapsed seconds, pages and pages per second,
+                the counters, the gauges, and count/total/mean/p50/p95/p99/max of each stage
+        """
+
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            timings = {stage: sorted(values) for stage, values in self.timings.items()}
+        stages = {}
+        for stage, values in timings.items():
+            total = sum(values)
+            stages[stage] = {
+                'count': len(values),
+                'total': round(total, 4),
+                'mean': round(total / len(values), 4) if values else 0.0,
+                'p50': round(percentile(values, 50), 4),
+                'p95': round(percentile(values, 95), 4),
+                'p99': round(percentile(values, 99), 4),
+                'max': round(values[-1], 4) if values else 0.0,
+            }
+        pages = counters.get('pages', 0)
+        return {
+            'name': self.name,
+            'started at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'elapsed': round(elapsed, 3),
+            'pages': pages,
+            'pages per second': round(pages / elapsed, 3) if elapsed else 0.0,
+            'counters': counters,
+            'gauges': gauges,
+            'stages': stages,
+        }
+
+    def write_report(self, path: str | None = None) -> str:
+
+        """write the report as json
+
+        Args:
+            path (str | None): the report's path, by default a new file under CRAWL_REPORT_PATH
+
+        Returns:
+            path (str): the path of the written report
+        """
+
+        if self.progress:
+            # end the progress line
+            sys.stderr.write("\n")
+        if path is None:
+            os.makedirs(CRAWL_REPORT_PATH, exist_ok=True)
+            path = f"{CRAWL_REPORT_PATH}/{self.name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=4)
+        return path
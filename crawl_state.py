@@ -0,0 +1,285 @@
+"""a durable crawl state stored in sqlite, so the crawlers resume instead of restarting.
+
+Every url the crawlers know about has a row with its kind ('artist', 'song',
+'artist desc', 'artist albums' or 'album'), its status and how many times it has failed:
+    frontier: known but not fetched yet
+    done: fetched and stored
+    failed: the last try failed, it is not tried again until it is re-queued
+and its depth: how many co-artists away from the artists of artist_hrefs.json it was
+found (0 for those artists and their pages).
+
+The frontier is also the queue of the discovery crawl: stream() goes through it in the
+order the urls were added, and also yields the urls added meanwhile, so what a page
+links to is queued in the state instead of being kept in memory.
+
+It is also the work queue of the crawl workers (see crawl_worker.py): a worker claims
+a batch of frontier urls with a lease, and renews it while it works on them. The urls
+of a worker that stopped (crashed, killed, lost its network) go back to the other
+workers once their lease has expired. The workers on other machines reach the state
+through lease_server.py.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Iterator
+from store import CRAWL_STATE_PATH
+
+FRONTIER = 'frontier'
+DONE = 'done'
+FAILED = 'failed'
+
+class CrawlState:
+
+    """the crawl state of all the urls, backed by a sqlite file
+
+    The connection is shared by the crawler's threads (the driver pool and the async
+    crawler's workers), so every access holds a lock. Every change is committed at
+    once, so a crash loses at most the url being fetched.
+
+    Attributes:
+        path (str): the path of the sqlite file
+        connection (sqlite3.Connection): the connection to the sqlite file
+        lock (threading.Lock): serializes the accesses to the connection
+    """
+
+    def __init__(self, path: str = CRAWL_STATE_PATH):
+
+        """open (or create) the state file"""
+
+        self.path = path
+        # the crawl workers sharing the file wait for each other's transactions
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS urls ("
+                "url TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                "retries INTEGER NOT NULL DEFAULT 0, error TEXT, updated REAL NOT NULL, "
+                "depth INTEGER NOT NULL DEFAULT 0, lease_owner TEXT, lease_expires REAL)"
+            )
+            # the state files made before the depth was recorded
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(urls)")]
+            if 'depth' not in columns:
+                self.connection.execute("ALTER TABLE urls ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+            if 'lease_owner' not in columns:
+                self.connection.execute("ALTER TABLE urls ADD COLUMN lease_owner TEXT")
+                self.connection.execute("ALTER TABLE urls ADD COLUMN lease_expires REAL")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS urls_kind_status ON urls (kind, status)")
+
+    def add(self, url: str, kind: str, depth: int = 0) -> bool:
+
+        """put a url in the frontier, returns False if the url is already known"""
+
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO urls (url, kind, status, updated, depth) VALUES (?, ?, ?, ?, ?)",
+                (url, kind, FRONTIER, time.time(), depth)
+            )
+        return cursor.rowcount == 1
+
+    def add_many(self, urls: list[str], kind: str, depth: int = 0) -> int:
+
+        """put the urls in the frontier in one transaction, returns how many were not known"""
+
+        now = time.time()
+        with self.lock, self.connection:
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO urls (url, kind, status, updated, depth) VALUES (?, ?, ?, ?, ?)",
+                [(url, kind, FRONTIER, now, depth) for url in urls]
+            )
+        return cursor.rowcount
+
+    def status(self, url: str) -> str | None:
+
+        """the status of the url, None if it is not known"""
+
+        with self.lock:
+            row = self.connection.execute("SELECT status FROM urls WHERE url = ?", (url,)).fetchone()
+        return None if row is None else row[0]
+
+    def is_done(self, url: str) -> bool:
+
+        """whether the url has already been fetched and stored"""
+
+        return self.status(url) == DONE
+
+    def mark_done(self, url: str) -> None:
+
+        """record that the url is fetched and stored"""
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE urls SET status = ?, error = NULL, updated = ?, lease_owner = NULL, "
+                "lease_expires = NULL WHERE url = ?",
+                (DONE, time.time(), url)
+            )
+
+    def mark_failed(self, url: str, error: str) -> None:
+
+        """record that fetching the url failed, and count the failure"""
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE urls SET status = ?, retries = retries + 1, error = ?, updated = ?, "
+                "lease_owner = NULL, lease_expires = NULL WHERE url = ?",
+                (FAILED, error, time.time(), url)
+            )
+
+    def pending(self, kind: str) -> list[str]:
+
+        """the urls of the kind still in the frontier, in the order they were added"""
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT url FROM urls WHERE kind = ? AND status = ? ORDER BY rowid", (kind, FRONTIER)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def stream(self, kinds: tuple[str, ...], batch: int = 100) -> Iterator[tuple[str, str, int]]:
+
+        """go through the frontier's urls of the kinds, including the ones added meanwhile
+
+        The urls are read a batch at a time in the order they were added, so the urls
+        added while the stream is used come after the ones known when it started (a
+        breadth first order). A url that left the frontier since its batch was read is
+        skipped. The stream ends when no url of the kinds is left after the last one.
+
+        Args:
+            kinds (tuple[str, ...]): the kinds of the urls
+            batch (int): the number of urls read at once
+
+        Returns:
+            stream (Iterator[tuple[str, str, int]]): the url, kind and depth of every url
+        """
+
+        last = 0
+        placeholders = ', '.join('?' * len(kinds))
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    f"SELECT rowid, url, kind, depth FROM urls WHERE status = ? AND kind IN ({placeholders}) "
+                    "AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (FRONTIER, *kinds, last, batch)
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, url, kind, depth in rows:
+                last = rowid
+                if self.status(url) == FRONTIER:
+                    yield url, kind, depth
+
+    def count(self, kind: str) -> int:
+
+        """the number of urls of the kind, whatever their status"""
+
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM urls WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def claim(self, worker: str, kinds: tuple[str, ...], batch: int, lease: float) -> list[tuple[str, str, int]]:
+
+        """lease a batch of frontier urls of the kinds to the worker
+
+        The urls leased to no one (or whose lease has expired) are taken in the order they
+        were added. The claim is one statement, so the workers sharing the sqlite file
+        never claim the same url.
+
+        Args:
+            worker (str): the name of the worker
+            kinds (tuple[str, ...]): the kinds of the urls claimed
+            batch (int): the most urls claimed
+            lease (float): the seconds the urls are leased for
+
+        Returns:
+            claimed (list[tuple[str, str, int]]): the url, kind and depth of every url claimed
+        """
+
+        now = time.time()
+        placeholders = ', '.join('?' * len(kinds))
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "UPDATE urls SET lease_owner = ?, lease_expires = ? WHERE rowid IN ("
+                f"SELECT rowid FROM urls WHERE status = ? AND kind IN ({placeholders}) "
+                "AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY rowid LIMIT ?"
+                ") RETURNING rowid, url, kind, depth",
+                (worker, now + lease, FRONTIER, *kinds, now, batch)
+            ).fetchall()
+        return [(url, kind, depth) for _, url, kind, depth in sorted(rows)]
+
+    def renew(self, worker: str, lease: float) -> int:
+
+        """extend the leases of the worker's urls not done yet, returns how many there are"""
+
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE urls SET lease_expires = ? WHERE lease_owner = ? AND status = ?",
+                (time.time() + lease, worker, FRONTIER)
+            )
+        return cursor.rowcount
+
+    def release(self, worker: str) -> int:
+
+        """give the worker's urls not done yet back to the other workers, returns how many"""
+
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE urls SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ? AND status = ?",
+                (worker, FRONTIER)
+            )
+        return cursor.rowcount
+
+    def leased(self, kinds: tuple[str, ...]) -> int:
+
+        """the number of frontier urls of the kinds under a lease that has not expired"""
+
+        placeholders = ', '.join('?' * len(kinds))
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT COUNT(*) FROM urls WHERE status = ? AND kind IN ({placeholders}) AND lease_expires >= ?",
+                (FRONTIER, *kinds, time.time())
+            ).fetchone()[0]
+
+    def requeue_failed(self, kind: str | None = None, max_retries: int | None = None) -> int:
+
+        """put the failed urls back in the frontier
+
+        Args:
+            kind (str | None): only re-queue the urls of this kind, all kinds if None
+            max_retries (int | None): skip the urls that already failed this many times
+
+        Returns:
+            count (int): the number of urls re-queued
+        """
+
+        query = "UPDATE urls SET status = ?, updated = ? WHERE status = ?"
+        params: list = [FRONTIER, time.time(), FAILED]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        if max_retries is not None:
+            query += " AND retries < ?"
+            params.append(max_retries)
+        with self.lock, self.connection:
+            cursor = self.connection.execute(query, params)
+        return cursor.rowcount
+
+    def counts(self) -> dict[str, dict[str, int]]:
+
+        """the number of urls of each kind in each status"""
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT kind, status, COUNT(*) FROM urls GROUP BY kind, status"
+            ).fetchall()
+        counts: dict[str, dict[str, int]] = {}
+        for kind, status, count in rows:
+            counts.setdefault(kind, {})[status] = count
+        return counts
+
+    def close(self) -> None:
+
+        """close the connection to the state file"""
+
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,175 @@
+"""a crawl worker: claims batches of artists and songs from a shared crawl state and crawls them.
+
+Any number of workers crawl together, on one machine (sharing the sqlite file of the
+crawl state) or on several (through lease_server.py). A worker claims a batch of
+frontier urls with a lease (see CrawlState.claim) and renews the lease from a
+heartbeat thread while it works on them:
+    an artist's songs page gives the artist's song ids, and its first songs join the
+        frontier for any worker to claim
+    the songs are crawled by song_curl.get_songs_info, as the songs of song_curl
+The urls of a worker that stopped go back to the others once their lease has expired.
+A worker stops when nothing is left to claim and no other worker holds a lease (whose
+urls could add songs, or come back).
+
+Each worker has its own request rate (see rate_control.py), so N workers (on N
+addresses) go N times faster until the parse pools or the site's limit are reached,
+and writes its records in a corpus store of its own, under WORKER_CORPORA_PATH by
+default. `python corpus_store.py merge` puts the workers' stores together.
+"""
+
+import argparse
+import os
+import socket
+import threading
+from artist_info_curl import get_all_artist_ids
+from browser_pool import DriverPool
+from crawl_metrics import CrawlMetrics
+from crawl_state import CrawlState
+from http_cache import HttpCache
+from image_pipeline import ImagePipeline
+from lease_server import RemoteCrawlState
+from parse_pool import ParsePool
+from rate_control import RateController
+from requests_get import RequestsGet, HEADERS, COOKIES
+from song_curl import SITE_URL, get_songs_info, parse_song_list, save_artist_song_ids, construct_song_id_list
+from store import SAVED_INFO_PATH, CRAWL_STATE_PATH
+
+WORKER_CORPORA_PATH = f"{SAVED_INFO_PATH}/worker_corpora"
+
+# the kinds of urls the workers crawl
+KINDS = ('artist', 'song')
+
+def crawl_artist(tool: RequestsGet, state: CrawlState | RemoteCrawlState, artist_url: str, depth: int,
+                 site_url: str = SITE_URL, songs_per_artist: int | None = 25) -> None:
+
+    """fetch an artist's songs page, store its song ids, and put its songs in the frontier
+
+    Args:
+        tool (RequestsGet): the tool making the requests
+        state (CrawlState | RemoteCrawlState): the shared crawl state
+        artist_url (str): the url of the artist's songs page
+        depth (int): the depth of the artist, given to its songs
+        site_url (str): the root url of the site
+        songs_per_artist (int | None): the most songs of the artist crawled (as song_curl), all if None
+    """
+
+    _, id = artist_url.split('=', 1)
+    try:
+        response = tool.requests_get(artist_url)
+        response.raise_for_status()
+        with tool.metrics.stage('parse'):
+            song_url_list = parse_song_list(response.text)[:songs_per_artist]
+        with tool.metrics.stage('write'):
+            save_artist_song_ids(id, construct_song_id_list(song_url_list))
+        state.add_many([f"{site_url}{url}" for url in song_url_list], 'song', depth)
+    except Exception as error:
+        state.mark_failed(artist_url, repr(error))
+        tool.metrics.count('errors')
+        print(f"artist{id} failed: {error!r}")
+        return
+    state.mark_done(artist_url)
+    tool.metrics.page_done('artist')
+
+def heartbeat(state: CrawlState | RemoteCrawlState, worker: str, lease: float, stop: threading.Event) -> None:
+
+    """renew the worker's leases every third of a lease until stop is set"""
+
+    while not stop.wait(lease / 3):
+        try:
+            state.renew(worker, lease)
+        except Exception as error:
+            # the next renewal may work, the leases last three times longer
+            print(f"renewing the leases failed: {error!r}")
+
+def run_worker(worker: str, state: CrawlState | RemoteCrawlState, tool: RequestsGet, pool: DriverPool,
+               images: ImagePipeline, parser: ParsePool, site_url: str = SITE_URL, batch: int = 20,
+               lease: float = 120.0, poll: float = 5.0, songs_per_artist: int | None = 25) -> int:
+
+    """claim and crawl batches of urls until the crawl is over
+
+    Args:
+        worker (str): the name of the worker, unique among the workers
+        state (CrawlState | RemoteCrawlState): the shared crawl state
+        tool (RequestsGet): the tool making the requests
+        pool (DriverPool): the headless drivers, used by get_songs_info(...)
+        images (ImagePipeline): the threads downloading the images
+        parser (ParsePool): the processes parsing the song pages and storing the songs
+        site_url (str): the root url of the site
+        batch (int): the most urls claimed at once
+        lease (float): the seconds a claim lasts without being renewed
+        poll (float): the seconds waited before claiming again while the other workers hold leases
+        songs_per_artist (int | None): the most songs of an artist crawled, all if None
+
+    Returns:
+        claimed (int): the number of urls the worker claimed
+    """
+
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(state, worker, lease, stop), name="heartbeat", daemon=True)
+    beat.start()
+    total = 0
+    try:
+        while True:
+            claimed = state.claim(worker, KINDS, batch, lease)
+            if not claimed:
+                # the workers holding leases may still add songs, or stop and leave their urls
+                if state.leased(KINDS) == 0:
+                    break
+                stop.wait(poll)
+                continue
+            total += len(claimed)
+            song_url_list = []
+            for url, kind, depth in claimed:
+                if kind == 'artist':
+                    crawl_artist(tool, state, url, depth, site_url, songs_per_artist)
+                else:
+                    song_url_list.append(url[len(site_url):])
+            get_songs_info(tool, pool, images, parser, song_url_list, state, site_url)
+            # what is still leased could not be crawled, the next claims (of any worker) retry it
+            state.release(worker)
+    finally:
+        stop.set()
+        state.release(worker)
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="crawl the artists and songs claimed from a shared crawl state")
+    parser.add_argument('--queue', default=CRAWL_STATE_PATH, help="sqlite file of the crawl state, or url of a lease server")
+    parser.add_argument('--worker', default=f"{socket.gethostname()}-{os.getpid()}", help="name of the worker")
+    parser.add_argument('--out', default=None, help="directory of the worker's corpus store (default: under saved_info/worker_corpora)")
+    parser.add_argument('--seed', action='store_true', help="put the artists of artist_hrefs.json in the frontier first")
+    parser.add_argument('--batch', type=int, default=20, help="most urls claimed at once")
+    parser.add_argument('--lease', type=float, default=120.0, help="seconds a claim lasts without being renewed")
+    parser.add_argument('--all-songs', action='store_true', help="crawl all the songs of an artist's songs page, not the first 25")
+    parser.add_argument('--drivers', type=int, default=2, help="number of headless drivers")
+    parser.add_argument('--image-workers', type=int, default=8, help="number of threads downloading the images")
+    parser.add_argument('--parse-workers', type=int, default=None, help="processes parsing the pages (0: no process)")
+    parser.add_argument('--rate', type=float, default=2.0, help="requests per second on each host at the start")
+    parser.add_argument('--max-rate', type=float, default=20.0, help="most requests per second on each host")
+    parser.add_argument('--no-cache', action='store_true', help="don't use the http cache")
+    parser.add_argument('--site-url', default=SITE_URL, help="root url of the site (or a local stand-in)")
+    parser.add_argument('--progress', action='store_true', help="show a live progress line")
+    parser.add_argument('--report', default=None, help="path of the json report (default: under saved_info/crawl_reports)")
+    args = parser.parse_args()
+
+    state = RemoteCrawlState(args.queue) if args.queue.startswith(('http://', 'https://')) else CrawlState(args.queue)
+    if args.seed:
+        state.add_many([f"{args.site_url}/artist?id={id}" for id in get_all_artist_ids()], 'artist')
+    # the worker's records (also written by its parse pool's processes) go to its own store
+    os.environ["SONG_CURL_CORPUS"] = args.out or f"{WORKER_CORPORA_PATH}/{args.worker}"
+
+    metrics = CrawlMetrics(f"crawl_worker-{args.worker}", progress=args.progress)
+    rate = RateController(initial_rate=args.rate, max_rate=args.max_rate, metrics=metrics)
+    tool = RequestsGet(
+        headers=HEADERS, cookies=COOKIES, cache=None if args.no_cache else HttpCache(), metrics=metrics, rate=rate
+    )
+    with DriverPool(args.drivers, metrics=metrics) as pool, \
+            ImagePipeline(tool, workers=args.image_workers) as images, \
+            ParsePool(args.parse_workers) as parse_pool:
+        claimed = run_worker(
+            args.worker, state, tool, pool, images, parse_pool, args.site_url, args.batch, args.lease,
+            songs_per_artist=None if args.all_songs else 25
+        )
+    print(f"{args.worker} crawled {claimed} urls into {os.environ['SONG_CURL_CORPUS']}")
+    tool.report_latency()
+    print(f"report written to {metrics.write_report(args.report)}")
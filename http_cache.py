@@ -0,0 +1,160 @@
+"""an on-disk cache of the crawlers' http responses.
+
+Every cached response is stored under HTTP_CACHE_PATH as two files named by the hash
+of its full url (with the params): the body, and a json file with the url, status,
+encoding, ETag and Last-Modified. A fresh entry (younger than the ttl of its kind of
+url) is used without touching the network; a stale one is revalidated with a
+conditional request, and a 304 answer keeps the cached body.
+
+In offline mode only the cache is used, so the parsers can be run again over all the
+pages crawled before without sending any request.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+from store import HTTP_CACHE_PATH
+
+DAY = 24 * 60 * 60
+
+# the ttl (seconds) of each kind of url, the first pattern matching the url is used.
+# None means the url is never cached (the images are stored by the crawlers anyway)
+TTL_POLICY = [
+    (r'\.(jpg|jpeg|png|gif|webp)(\?|$)', None),
+    (r'/artist/desc\?', 30 * DAY),
+    (r'/artist\?', 1 * DAY),
+    (r'/song\?', 30 * DAY),
+    (r'/api/song/lyric\?', 7 * DAY),
+]
+DEFAULT_TTL = 1 * DAY
+
+class CacheMiss(requests.RequestException):
+
+    """raised in offline mode when a url is not in the cache"""
+
+class HttpCache:
+
+    """the on-disk cache of the responses
+
+    Attributes:
+        root (str): the directory of the cached files
+        offline (bool): whether only the cache is used (no request is sent)
+        ttl_policy (list[tuple[str, int | None]]): the ttl of each kind of url
+    """
+
+    def __init__(self, root: str = HTTP_CACHE_PATH, offline: bool = False,
+                 ttl_policy: list[tuple[str, int | None]] = TTL_POLICY):
+
+        """initialize the cache in the root directory"""
+
+        self.root = root
+        self.offline = offline
+        self.ttl_policy = ttl_policy
+
+    def full_url(self, url: str, params: dict | None = None) -> str:
+
+        """the url with its params encoded, as requests would send it"""
+
+        return requests.Request('GET', url, params=params).prepare().url
+
+    def ttl(self, url: str) -> int | None:
+
+        """the ttl of the url, None if it should not be cached"""
+
+        for pattern, ttl in self.ttl_policy:
+            if re.search(pattern, url):
+                return ttl
+        return DEFAULT_TTL
+
+    def paths(self, url: str) -> tuple[str, str]:
+
+        """the paths of the body and the meta file of the url"""
+
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        directory = f"{self.root}/{key[:2]}"
+        return f"{directory}/{key}.body", f"{directory}/{key}.json"
+
+    def load(self, url: str) -> dict | None:
+
+        """the meta of the cached url, None if it is not cached"""
+
+        _, meta_path = self.paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, meta: dict) -> bool:
+
+        """whether the cached entry can be used without revalidation"""
+
+        ttl = self.ttl(meta['url'])
+        return ttl is not None and time.time() - meta['fetched_at'] < ttl
+
+    def conditional_headers(self, meta: dict | None) -> dict[str, str]:
+
+        """the headers asking the server whether the cached entry is still valid"""
+
+        headers = {}
+        if meta is None:
+            return headers
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def store(self, url: str, response) -> None:
+
+        """store a successful response of the url"""
+
+        body_path, meta_path = self.paths(url)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        meta = {
+            'url': url,
+            'status': response.status_code,
+            'encoding': response.encoding,
+            'content_type': response.headers.get('Content-Type'),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        # the body first, so a meta file always has its body
+        with open(body_path, 'wb') as f:
+            f.write(response.content)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def touch(self, meta: dict) -> None:
+
+        """mark a revalidated (304) entry as fresh again"""
+
+        meta['fetched_at'] = time.time()
+        _, meta_path = self.paths(meta['url'])
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def to_response(self, meta: dict) -> requests.Response:
+
+        """rebuild the response of a cached entry"""
+
+        body_path, _ = self.paths(meta['url'])
+        with open(body_path, 'rb') as f:
+            content = f.read()
+        response = requests.Response()
+        response.status_code = meta['status']
+        response.reason = 'OK'
+        response.url = meta['url']
+        response.encoding = meta['encoding']
+        response.headers = CaseInsensitiveDict()
+        if meta.get('content_type'):
+            response.headers['Content-Type'] = meta['content_type']
+        response._content = content
+        # read already, closing it has no stream to close
+        response._content_consumed = True
+        return response
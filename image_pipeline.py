@@ -0,0 +1,271 @@
+"""a concurrent, content-addressed pipeline for the song and artist images.
+
+The images are downloaded by a pool of threads and streamed to disk while being
+hashed. Each distinct image is stored once under IMAGE_STORE_PATH by its sha256
+(the covers shared by the songs of an album are only stored once), and the usual
+song{id}.jpg / artist{id}.jpg files are hard links to the stored image (a copy if
+the file system has no hard links). INDEX_PATH maps every song/artist image name to
+its hash.
+
+Each stored image also gets a fixed-size webp thumbnail for the list pages of the
+site, linked as song{id}.webp / artist{id}.webp in the thumbnail folders. The
+thumbnails need pillow; without it only the images are stored.
+
+Running this module moves the images already downloaded into the store, and makes
+the thumbnails of the images copied into the site's static folder (links to the
+thumbnail of their hash, as the store's). The site's thumbnails are not committed:
+run it (--site-only for the site's alone) when the site is deployed.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests_get import RequestsGet, HEADERS, COOKIES
+from store import (
+    IMAGE_STORE_PATH, SONG_IMAGE_PATH, SONG_THUMB_PATH, ARTIST_IMAGE_PATH, ARTIST_THUMB_PATH
+)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+INDEX_PATH = f"{IMAGE_STORE_PATH}/index.json"
+THUMB_SIZE = (240, 240) # the list pages show the images in 120px squares
+SITE_STATIC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "songsite/song/static/song")
+
+def link_or_copy(source: str, target: str) -> None:
+
+    """make target a hard link to source (a copy if hard links are not supported)"""
+
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def file_hash(path: str) -> str:
+
+    """the sha256 of a file"""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_thumbnail(image_path: str, thumb_path: str) -> bool:
+
+    """write the fixed-size webp thumbnail of an image, False if the image can't be read"""
+
+    try:
+        with Image.open(image_path) as image:
+            thumb = ImageOps.fit(image.convert('RGB'), THUMB_SIZE)
+    except OSError as error:
+        print(f"can't make the thumbnail of {image_path}: {error!r}")
+        return False
+    # written to a temporary name first, another thread may make the same thumbnail
+    temp_path = f"{thumb_path}.{threading.get_ident()}.part"
+    thumb.save(temp_path, 'WEBP', quality=80)
+    os.replace(temp_path, thumb_path)
+    return True
+
+class ImagePipeline:
+
+    """the pool downloading and storing the images
+
+    Attributes:
+        tool (RequestsGet): the tool making the requests
+        executor (ThreadPoolExecutor): the threads downloading the images
+        thumbnails (bool): whether the thumbnails are made
+        index (dict[str, str]): the hash of every image name (e.g. 'song123')
+        lock (threading.Lock): guards the index and the renames into the store
+    """
+
+    def __init__(self, tool: RequestsGet, workers: int = 8, thumbnails: bool = True):
+
+        """start the download threads and load the index"""
+
+        self.tool = tool
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+        self.thumbnails = thumbnails and Image is not None
+        self.lock = threading.Lock()
+        os.makedirs(IMAGE_STORE_PATH, exist_ok=True)
+        try:
+            with open(INDEX_PATH, 'r', encoding='utf-8') as f:
+                self.index: dict[str, str] = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def submit(self, image_url: str, out_path: str, thumb_path: str | None = None) -> Future:
+
+        """queue an image, the future's result is the image's hash
+
+        Args:
+            image_url (str): the url of the image
+            out_path (str): where the image is linked (e.g. .../song_image/song123.jpg)
+            thumb_path (str | None): where the thumbnail is linked, None for no thumbnail
+
+        Returns:
+            future (Future): the download of the image
+        """
+
+        if self.tool.offline and os.path.exists(out_path):
+            # the images are not in the http cache, keep the one already stored
+            future: Future = Future()
+            future.set_result(self.index.get(os.path.splitext(os.path.basename(out_path))[0]))
+            return future
+        return self.executor.submit(self.download, image_url, out_path, thumb_path)
+
+    def download(self, image_url: str, out_path: str, thumb_path: str | None) -> str:
+
+        """stream the image into the store, then link it (and its thumbnail) by name"""
+
+        with self.tool.metrics.stage('image'), self.tool.requests_get(image_url, stream=True) as response:
+            response.raise_for_status()
+            digest = hashlib.sha256()
+            part_path = None
+            try:
+                with tempfile.NamedTemporaryFile(dir=IMAGE_STORE_PATH, suffix='.part', delete=False) as f:
+                    part_path = f.name
+                    for chunk in response.iter_content(chunk_size=8192):
+                        digest.update(chunk)
+                        f.write(chunk)
+                return self.add(part_path, digest.hexdigest(), out_path, thumb_path, move=True)
+            finally:
+                # add moves (or removes) the file into the store, unless the download or add failed
+                if part_path is not None and os.path.exists(part_path):
+                    os.unlink(part_path)
+
+    def add(self, path: str, image_hash: str, out_path: str, thumb_path: str | None,
+            move: bool = False) -> str:
+
+        """put the file (whose hash is known) in the store and link it by name
+
+        Args:
+            path (str): the image file
+            image_hash (str): the sha256 of the file
+            out_path (str): where the image is linked
+            thumb_path (str | None): where the thumbnail is linked, None for no thumbnail
+            move (bool): whether the file can be moved into the store (else it is linked)
+
+        Returns:
+            image_hash (str): the hash of the image
+        """
+
+        stored_path = f"{IMAGE_STORE_PATH}/{image_hash[:2]}/{image_hash}.jpg"
+        with self.lock:
+            if os.path.exists(stored_path):
+                # the same image is already stored (e.g. the cover of another song of the album)
+                if move:
+                    os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+                if move:
+                    os.replace(path, stored_path)
+                else:
+                    link_or_copy(path, stored_path)
+            if not (os.path.exists(out_path) and os.path.samefile(stored_path, out_path)):
+                link_or_copy(stored_path, out_path)
+            self.index[os.path.splitext(os.path.basename(out_path))[0]] = image_hash
+
+        if self.thumbnails and thumb_path is not None:
+            stored_thumb = self.make_thumbnail(stored_path, image_hash)
+            if stored_thumb is not None:
+                os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+                link_or_copy(stored_thumb, thumb_path)
+        return image_hash
+
+    def make_thumbnail(self, stored_path: str, image_hash: str) -> str | None:
+
+        """make the webp thumbnail of a stored image (once per hash), None if it can't be read"""
+
+        return stored_thumbnail(stored_path, image_hash)
+
+    def save_index(self) -> None:
+
+        """write the index of the image names' hashes"""
+
+        with self.lock:
+            with open(f"{INDEX_PATH}.part", 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, sort_keys=True, indent=4)
+            os.replace(f"{INDEX_PATH}.part", INDEX_PATH)
+
+    def close(self) -> None:
+
+        """wait for the queued images, then write the index"""
+
+        self.executor.shutdown(wait=True)
+        self.save_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+def stored_thumbnail(image_path: str, image_hash: str) -> str | None:
+
+    """the thumbnail of the hash in the store, made from the image if there is none (None if it can't be read)"""
+
+    stored_thumb = f"{IMAGE_STORE_PATH}/thumbs/{image_hash[:2]}/{image_hash}.webp"
+    if os.path.exists(stored_thumb):
+        return stored_thumb
+    os.makedirs(os.path.dirname(stored_thumb), exist_ok=True)
+    return stored_thumb if make_thumbnail(image_path, stored_thumb) else None
+
+def store_existing_images(pipeline: ImagePipeline, image_dir: str, thumb_dir: str) -> None:
+
+    """move the images already downloaded in image_dir into the store (with thumbnails)"""
+
+    for path in sorted(glob.glob(f"{image_dir}/*.jpg")):
+        name = os.path.splitext(os.path.basename(path))[0]
+        # the original file becomes a link to the stored one
+        pipeline.add(path, file_hash(path), path, f"{thumb_dir}/{name}.webp")
+
+def make_site_thumbnails(static_path: str = SITE_STATIC_PATH) -> int:
+
+    """link the missing thumbnails of the site's images (static images/ into static thumbs/)
+
+    The images with the same content (the covers of an album) share the thumbnail of
+    their hash in the store, made once.
+
+    Returns:
+        count (int): the number of thumbnails linked
+    """
+
+    thumb_dir = f"{static_path}/thumbs"
+    os.makedirs(thumb_dir, exist_ok=True)
+    count = 0
+    for path in sorted(glob.glob(f"{static_path}/images/*.jpg")):
+        name = os.path.splitext(os.path.basename(path))[0]
+        thumb_path = f"{thumb_dir}/{name}.webp"
+        if os.path.exists(thumb_path):
+            continue
+        stored_thumb = stored_thumbnail(path, file_hash(path))
+        if stored_thumb is not None:
+            link_or_copy(stored_thumb, thumb_path)
+            count += 1
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="store the downloaded images by hash and make their thumbnails")
+    parser.add_argument('--site-only', action='store_true', help="only make the thumbnails of the site's images")
+    args = parser.parse_args()
+
+    if Image is None:
+        print("pillow is not installed, no thumbnail is made")
+    else:
+        print(f"{make_site_thumbnails()} thumbnails linked for the site")
+    if not args.site_only:
+        with ImagePipeline(RequestsGet(headers=HEADERS, cookies=COOKIES)) as pipeline:
+            store_existing_images(pipeline, SONG_IMAGE_PATH, SONG_THUMB_PATH)
+            store_existing_images(pipeline, ARTIST_IMAGE_PATH, ARTIST_THUMB_PATH)
+        print(f"{len(pipeline.index)} images, {len(set(pipeline.index.values()))} distinct")
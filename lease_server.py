@@ -0,0 +1,223 @@
+"""an http server sharing a crawl state with the crawl workers of other machines.
+
+The crawl workers of one machine can share the sqlite file of the crawl state, but
+the workers of other machines reach it through this server. Every call is a POST of
+{"method": ..., "args": [...]} to /call, answered with {"result": ...}, and runs the
+CrawlState method of the same name (only the ones in METHODS). RemoteCrawlState has
+the methods of CrawlState the workers use, so a worker (and song_curl.get_songs_info)
+uses either one the same way.
+
+Running this module serves a crawl state, after seeding it with the artists of
+artist_hrefs.json if asked.
+"""
+
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from artist_info_curl import get_all_artist_ids
+from crawl_state import CrawlState
+from store import CRAWL_STATE_PATH
+
+# the methods of the crawl state the workers can call
+METHODS = {
+    'add', 'add_many', 'status', 'mark_done', 'mark_failed', 'claim', 'renew', 'release', 'leased', 'counts'
+}
+
+def seed_artists(state: CrawlState, site_url: str) -> int:
+
+    """put the artists of artist_hrefs.json in the frontier, returns how many were not known"""
+
+    return state.add_many([f"{site_url}/artist?id={id}" for id in get_all_artist_ids()], 'artist')
+
+class LeaseServer:
+
+    """the http server of a crawl state, run in a thread of its own
+
+    Attributes:
+        state (CrawlState): the crawl state served
+        host (str): the address the server listens on
+        port (int): the port the server listens on (0 for any free port)
+        httpd (ThreadingHTTPServer | None): the running server, None before start()
+    """
+
+    def __init__(self, state: CrawlState, host: str = '127.0.0.1', port: int = 0):
+
+        """prepare the server of the state"""
+
+        self.state = state
+        self.host = host
+        self.port = port
+        self.httpd: ThreadingHTTPServer | None = None
+
+    @property
+    def url(self) -> str:
+
+        """the root url of the running server"""
+
+        return f"http://{self.host}:{self.httpd.server_address[1]}"
+
+    def start(self) -> str:
+
+        """start serving in a daemon thread, returns the root url"""
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), LeaseHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        threading.Thread(target=self.httpd.serve_forever, name="lease", daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+
+        """stop serving"""
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+class LeaseHandler(BaseHTTPRequestHandler):
+
+    """runs a call of a worker on the crawl state of the http server"""
+
+    # keep-alive, the workers call the server for every url
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self) -> None:
+        try:
+            call = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if call['method'] not in METHODS:
+                raise ValueError(f"unknown method {call['method']!r}")
+            result = getattr(self.server.state, call['method'])(*call.get('args', []))
+            status, answer = 200, {'result': result}
+        except (ValueError, KeyError, TypeError) as error:
+            status, answer = 400, {'error': repr(error)}
+        body = json.dumps(answer, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        # one line per call would slow the workers down
+        pass
+
+class RemoteCrawlState:
+
+    """the crawl state served by a lease server, with the methods of CrawlState the workers use
+
+    Attributes:
+        url (str): the root url of the lease server
+        timeout (float): the seconds a call may take
+        session (requests.Session): the keep-alive connection to the server
+        lock (threading.Lock): the session is shared by the worker's threads
+    """
+
+    def __init__(self, url: str, timeout: float = 60.0):
+
+        """connect to the lease server at the url"""
+
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+
+    def call(self, method: str, *args):
+
+        """run the method of the served crawl state, returns its result"""
+
+        with self.lock:
+            response = self.session.post(
+                f"{self.url}/call", json={'method': method, 'args': list(args)}, timeout=self.timeout
+            )
+        if response.status_code != 200:
+            raise RuntimeError(f"{method} failed on the lease server: {response.text}")
+        return response.json()['result']
+
+    def add(self, url: str, kind: str, depth: int = 0) -> bool:
+
+        """see CrawlState.add"""
+
+        return self.call('add', url, kind, depth)
+
+    def add_many(self, urls: list[str], kind: str, depth: int = 0) -> int:
+
+        """see CrawlState.add_many"""
+
+        return self.call('add_many', urls, kind, depth)
+
+    def status(self, url: str) -> str | None:
+
+        """see CrawlState.status"""
+
+        return self.call('status', url)
+
+    def mark_done(self, url: str) -> None:
+
+        """see CrawlState.mark_done"""
+
+        self.call('mark_done', url)
+
+    def mark_failed(self, url: str, error: str) -> None:
+
+        """see CrawlState.mark_failed"""
+
+        self.call('mark_failed', url, error)
+
+    def claim(self, worker: str, kinds: tuple[str, ...], batch: int, lease: float) -> list[tuple[str, str, int]]:
+
+        """see CrawlState.claim"""
+
+        return [tuple(row) for row in self.call('claim', worker, list(kinds), batch, lease)]
+
+    def renew(self, worker: str, lease: float) -> int:
+
+        """see CrawlState.renew"""
+
+        return self.call('renew', worker, lease)
+
+    def release(self, worker: str) -> int:
+
+        """see CrawlState.release"""
+
+        return self.call('release', worker)
+
+    def leased(self, kinds: tuple[str, ...]) -> int:
+
+        """see CrawlState.leased"""
+
+        return self.call('leased', list(kinds))
+
+    def counts(self) -> dict[str, dict[str, int]]:
+
+        """see CrawlState.counts"""
+
+        return self.call('counts')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="serve a crawl state to the crawl workers of other machines")
+    parser.add_argument('--state', default=CRAWL_STATE_PATH, help="sqlite file of the crawl state")
+    parser.add_argument('--host', default='0.0.0.0', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8100, help="port to listen on (0 for any free port)")
+    parser.add_argument('--seed', action='store_true', help="put the artists of artist_hrefs.json in the frontier")
+    parser.add_argument('--site-url', default="https://music.163.com", help="root url of the seeded artists' pages")
+    args = parser.parse_args()
+
+    state = CrawlState(args.state)
+    if args.seed:
+        print(f"{seed_artists(state, args.site_url)} artists seeded")
+    server = LeaseServer(state, args.host, args.port)
+    print(f"serving the crawl state on {server.start()}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+        print(state.counts())
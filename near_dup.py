@@ -0,0 +1,213 @@
+"""the near-duplicate songs: the songs whose lyrics are (almost) the same, as live versions and re-releases.
+
+The lyrics are normalized (the credit lines as "作词 : ..." dropped, the case, the
+punctuation and the spaces ignored) and fingerprinted with a 64 bit SimHash of their
+3-character shingles: two lyrics differing by a few lines have fingerprints differing
+by a few bits. Two songs are near duplicates when their fingerprints differ by at most
+`distance` bits.
+
+The fingerprints are kept in a NearDupIndex (an sqlite file, next to the corpus store,
+see corpus_store.near_dups), cut in distance + 1 bands: two fingerprints differing by
+at most `distance` bits have a band in common, so a new song is only compared to the
+songs sharing one of its bands. Every song gets a group: the id of the first song of
+its lyrics (itself if it has no near duplicate before it). The lyrics too short to
+tell (no lyrics, instrumentals) get no fingerprint and no group.
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+# the length of the shingles, and the fewest shingles of a lyrics fingerprinted
+SHINGLE = 3
+MIN_SHINGLES = 16
+
+# a credit line: a short name (作词, 作曲, 编曲, 制作人, ...) and a colon
+CREDIT_LINE = re.compile(r'^[^:：\n]{1,15}[:：].{0,60}$', re.MULTILINE)
+# what the lyrics shown on the page may end with
+FOLDED_SUFFIX = '收起'
+
+# the bits of the size of the votes of a bit (a lyrics has far less than 2 ** 24 shingles)
+FIELD = 24
+# SPREAD[k][byte]: the bits of the byte at the position k of a hash, each in the field of its bit
+SPREAD = [
+    [sum(((byte >> i) & 1) << (FIELD * (8 * k + i)) for i in range(8)) for byte in range(256)]
+    for k in range(8)
+]
+
+def normalize_lyrics(lyrics: str) -> str:
+
+    """the lyrics without their credits, case, punctuation and spaces"""
+
+    lyrics = unicodedata.normalize('NFKC', lyrics).removesuffix(FOLDED_SUFFIX)
+    lyrics = CREDIT_LINE.sub('', lyrics).lower()
+    # only the letters and digits (of any script) are kept
+    return ''.join(char for char in lyrics if char.isalnum())
+
+def simhash(text: str) -> int | None:
+
+    """the 64 bit SimHash of the text's shingles, None if the text is too short
+
+    Every shingle votes for the bits of its hash, weighted by the times it appears, and
+    the fingerprint has the bits with more votes for than against. The votes of all the
+    bits are counted at once, in the fields of one big integer (see SPREAD).
+    """
+
+    shingles = Counter(text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1))
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    s0, s1, s2, s3, s4, s5, s6, s7 = SPREAD
+    votes = 0
+    total = 0
+    for shingle, weight in shingles.items():
+        b0, b1, b2, b3, b4, b5, b6, b7 = hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest()
+        votes += weight * (s0[b0] | s1[b1] | s2[b2] | s3[b3] | s4[b4] | s5[b5] | s6[b6] | s7[b7])
+        total += weight
+    mask = (1 << FIELD) - 1
+    fingerprint = 0
+    for bit in range(64):
+        # the votes for the bit, the votes against are total - votes
+        if 2 * ((votes >> (FIELD * bit)) & mask) > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def hamming(a: int, b: int) -> int:
+
+    """the number of bits the fingerprints differ by"""
+
+    return (a ^ b).bit_count()
+
+def to_signed(fingerprint: int) -> int:
+
+    """the fingerprint as an sqlite integer (signed 64 bits)"""
+
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+class NearDupIndex:
+
+    """the fingerprints and groups of the songs, in an sqlite file shared by the processes
+
+    Attributes:
+        path (str): the sqlite file
+        distance (int): the most bits two near duplicates differ by
+        bands (int): the number of bands the fingerprints are cut in (distance + 1)
+        width (int): the bits of a band
+        connection (sqlite3.Connection): the connection to the file
+        lock (threading.Lock): serializes the accesses of the threads
+    """
+
+    def __init__(self, path: str, distance: int = 3):
+
+        """open the index, making it if it doesn't exist"""
+
+        self.path = path
+        self.distance = distance
+        self.bands = distance + 1
+        self.width = -(-64 // self.bands)
+        self.lock = threading.Lock()
+        # the parse pool's processes add to the same index, they wait for each other
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "id TEXT PRIMARY KEY, simhash INTEGER NOT NULL, grp TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS bands ("
+                "band INTEGER NOT NULL, value INTEGER NOT NULL, id TEXT NOT NULL, "
+                "PRIMARY KEY (band, value, id)) WITHOUT ROWID"
+            )
+
+    def band_values(self, fingerprint: int) -> list[int]:
+
+        """the value of each band of the fingerprint"""
+
+        mask = (1 << self.width) - 1
+        return [(fingerprint >> (band * self.width)) & mask for band in range(self.bands)]
+
+    def candidates(self, fingerprint: int) -> list[tuple[str, int, str]]:
+
+        """the id, fingerprint and group of the songs sharing a band with the fingerprint (hold the lock)"""
+
+        rows = set()
+        for band, value in enumerate(self.band_values(fingerprint)):
+            rows.update(self.connection.execute(
+                "SELECT f.rowid, f.id, f.simhash, f.grp FROM bands AS b JOIN fingerprints AS f ON f.id = b.id "
+                "WHERE b.band = ? AND b.value = ?",
+                (band, value)
+            ))
+        # in the order the songs were added, for the ties
+        return [(id, signed & ((1 << 64) - 1), group) for _, id, signed, group in sorted(rows)]
+
+    def group(self, id: str, fingerprint: int) -> str:
+
+        """add the song's fingerprint, returns its group (the group it had if it is already in)
+
+        The group is the one of the nearest song at most `distance` bits away (the first
+        added of the nearest), or the song's own id.
+        """
+
+        id = str(id)
+        with self.lock:
+            # one writer at a time, so two processes don't both start a group for the same lyrics
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT grp FROM fingerprints WHERE id = ?", (id,)).fetchone()
+                if row is not None:
+                    self.connection.execute("COMMIT")
+                    return row[0]
+                group, nearest = id, self.distance + 1
+                for _, other, other_group in self.candidates(fingerprint):
+                    distance = hamming(fingerprint, other)
+                    if distance < nearest:
+                        group, nearest = other_group, distance
+                self.connection.execute(
+                    "INSERT INTO fingerprints (id, simhash, grp) VALUES (?, ?, ?)", (id, to_signed(fingerprint), group)
+                )
+                self.connection.executemany(
+                    "INSERT INTO bands (band, value, id) VALUES (?, ?, ?)",
+                    [(band, value, id) for band, value in enumerate(self.band_values(fingerprint))]
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return group
+
+    def fingerprint(self, id: str, lyrics: str) -> dict:
+
+        """the song's 'lyrics simhash' (hex) and 'lyrics group', nothing if its lyrics are too short"""
+
+        fingerprint = simhash(normalize_lyrics(lyrics))
+        if fingerprint is None:
+            return {}
+        return {'lyrics simhash': f"{fingerprint:016x}", 'lyrics group': self.group(id, fingerprint)}
+
+    def clear(self) -> None:
+
+        """remove all the fingerprints"""
+
+        with self.lock:
+            self.connection.execute("DELETE FROM fingerprints")
+            self.connection.execute("DELETE FROM bands")
+
+    def stats(self) -> dict[str, int]:
+
+        """the number of songs fingerprinted, of groups, and of songs in another song's group"""
+
+        with self.lock:
+            songs, groups = self.connection.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT grp) FROM fingerprints"
+            ).fetchone()
+        return {'songs': songs, 'groups': groups, 'duplicates': songs - groups}
+
+    def close(self) -> None:
+
+        """close the connection"""
+
+        with self.lock:
+            self.connection.close()
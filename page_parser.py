@@ -0,0 +1,217 @@
+"""the parsers extracting the crawled info from the artist and song pages.
+
+The pages are parsed with lxml and the few fields needed are found with XPath, so no
+BeautifulSoup tree is built for a page. The BeautifulSoup parsers used before are kept
+(the *_soup functions) as the reference the XPath parsers must agree with, see
+bench_parsers.py.
+
+This module contains these parsers:
+    parse_artist_page: the name, alias, intro and image url of an artist's desc page
+    parse_song_page: the name, alias, artists and artist ids of a song page
+    parse_song_list: the song hrefs of an artist's songs page (or of an album page)
+    parse_album_list: the album hrefs of a page of an artist's albums, and the next page
+"""
+
+import re
+from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+
+# matches the elements whose class attribute contains the class name
+HAS_CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+
+ARTIST_HREF = re.compile(r'^/artist\?id=[0-9]+$')
+ALBUM_HREF = re.compile(r'^/album\?id=[0-9]+$')
+
+def make_tree(html: str):
+
+    """parse the page into an lxml tree"""
+
+    return lxml_html.document_fromstring(html)
+
+def first_text(tree, xpath: str) -> str:
+
+    """the text of the first element matching the xpath (as bs4's .text)"""
+
+    return tree.xpath(xpath)[0].text_content()
+
+def split_work_list(paragraph: str) -> list[str]:
+
+    """split a "●" list of the artist's intro, without the empty piece before the first "●" """
+
+    items = re.split(r'●', paragraph)
+    if items[0] == "":
+        items.remove("")
+    return items
+
+def artist_intro_section(artist_intro: dict, header_name: str, paragraph: str) -> None:
+
+    """put the paragraph of a section of the artist's intro in artist_intro, by its header"""
+
+    if re.search(r'简介$', header_name):
+        artist_intro['intro'] = paragraph
+    elif header_name == '演艺经历':
+        artist_intro['history'] = paragraph
+    elif header_name == '代表作品':
+        artist_intro['master work'] = split_work_list(paragraph)
+    elif header_name == '重要里程碑':
+        artist_intro['milestones'] = split_work_list(paragraph)
+
+def parse_artist_page(html: str) -> tuple[dict, str]:
+
+    """extract the artist's info from the artist's desc page
+
+    Args:
+        html (str): the text of the artist's desc page
+
+    Returns:
+        artist (dict): contains 'name', 'alias' (a list) and 'intro' (the sections of the intro)
+        image_url (str): the url of the artist's image (the first image of the page)
+    """
+
+    tree = make_tree(html)
+    artist = {}
+    artist['name'] = first_text(tree, '(//h2)[1]').strip()
+    artist['alias'] = re.split(r';', first_text(tree, '(//h3)[1]').strip())
+
+    #the sections of the introduction block, each header with the paragraph of the same rank
+    artist_intro_block = tree.xpath(f"(//*[{HAS_CLASS.format('n-artdesc')}])[1]")[0]
+    artist_headers = artist_intro_block.xpath('.//h2')
+    artist_paragraphs = artist_intro_block.xpath('.//p')
+    artist_intro = {}
+    for i in range(len(artist_headers)):
+        artist_intro_section(
+            artist_intro, artist_headers[i].text_content().strip(), artist_paragraphs[i].text_content().strip()
+        )
+    artist['intro'] = artist_intro
+
+    image_url = tree.xpath('(//img)[1]/@src')[0]
+    return artist, image_url
+
+def parse_artist_page_soup(html: str) -> tuple[dict, str]:
+
+    """the BeautifulSoup version of parse_artist_page"""
+
+    soup = BeautifulSoup(html, "lxml")
+    artist = {}
+    artist['name'] = soup.h2.text.strip()
+    artist['alias'] = re.split(r';', soup.h3.text.strip())
+
+    artist_intro_block = soup.find(class_="n-artdesc")
+    artist_headers = artist_intro_block.find_all("h2")
+    artist_paragraphs = artist_intro_block.find_all("p")
+    artist_intro = {}
+    for i in range(len(artist_headers)):
+        artist_intro_section(
+            artist_intro, artist_headers[i].text.strip(), artist_paragraphs[i].text.strip()
+        )
+    artist['intro'] = artist_intro
+
+    image_url = soup.find_all("img")[0]['src']
+    return artist, image_url
+
+def split_song_title(title: str) -> dict:
+
+    """the song's name and alias (if it has one) in the page's title"""
+
+    song_info = {}
+    if re.search(r'（.+）', title) is not None:
+        song_info['name'] = re.split(r'（', title, maxsplit=1)[0].strip()
+        song_alias = re.search(r'（.+）', title).group(0)
+        song_info['alias'] = song_alias[1:len(song_alias) - 1]
+    else:
+        song_info['name'] = re.split(r'-', title)[0].strip()
+    return song_info
+
+def parse_song_page(html: str) -> dict:
+
+    """extract the song name, alias and artists from a song page
+
+    Args:
+        html (str): the text of the song page
+
+    Returns:
+        song_info (dict): contains 'name', 'alias' (if the song has one), 'artist list'
+            and 'artist id list'
+    """
+
+    tree = make_tree(html)
+    song_info = split_song_title(first_text(tree, '(//title)[1]'))
+
+    #artists' names and ids
+    artist_list = []
+    artist_id_list = []
+    for tag in tree.xpath(f"//*[{HAS_CLASS.format('s-fc7')}][starts-with(@href, '/artist?id=')]"):
+        artist_href = tag.get('href')
+        if ARTIST_HREF.match(artist_href) is None:
+            continue
+        artist_list.append(tag.text_content())
+        artist_id_list.append(re.split(r'=', artist_href, maxsplit=1)[1])
+    song_info['artist list'] = artist_list
+    song_info['artist id list'] = artist_id_list
+    return song_info
+
+def parse_song_page_soup(html: str) -> dict:
+
+    """the BeautifulSoup version of parse_song_page"""
+
+    song_soup = BeautifulSoup(html, 'lxml')
+    song_info = split_song_title(song_soup.title.text)
+
+    artist_tags = song_soup.find_all(href=re.compile(r'^/artist\?id=[0-9]+$'), class_="s-fc7")
+    artist_list = []
+    artist_id_list = []
+    for tag in artist_tags:
+        artist_list.append(tag.text)
+        _, artist_id = re.split(r'=', tag['href'], maxsplit=1)
+        artist_id_list.append(artist_id)
+    song_info['artist list'] = artist_list
+    song_info['artist id list'] = artist_id_list
+    return song_info
+
+def parse_song_list(html: str) -> list[str]:
+
+    """extract the song urls (hrefs) from an artist's songs page
+
+    Args:
+        html (str): the text of the artist's songs page
+
+    Returns:
+        song_url_list (list[str]): the hrefs of the songs, in the order of the page
+    """
+
+    tree = make_tree(html)
+    song_list = tree.xpath(f"(//ul[{HAS_CLASS.format('f-hide')}])[1]")[0]
+    return [song.find('.//a').get('href') for song in song_list.xpath('./*')]
+
+def parse_song_list_soup(html: str) -> list[str]:
+
+    """the BeautifulSoup version of parse_song_list"""
+
+    song_list_soup = BeautifulSoup(html, 'lxml')
+    song_list = song_list_soup.find("ul", class_="f-hide")
+    return [song.a['href'] for song in song_list]
+
+def parse_album_list(html: str) -> tuple[list[str], str | None]:
+
+    """extract the album urls (hrefs) from a page of an artist's albums
+
+    The albums of an artist are shown a page at a time (/artist/album?id=...&limit=...&offset=...),
+    the "下一页" button links the next page, and is disabled on the last one.
+
+    Args:
+        html (str): the text of the page of the artist's albums
+
+    Returns:
+        album_url_list (list[str]): the hrefs of the albums, in the order of the page
+        next_url (str | None): the href of the next page, None on the last page
+    """
+
+    tree = make_tree(html)
+    album_url_list = []
+    for href in tree.xpath(f"//ul[@id='m-song-module']//a[{HAS_CLASS.format('tit')}]/@href"):
+        if ALBUM_HREF.match(href) is not None and href not in album_url_list:
+            album_url_list.append(href)
+    next_url = tree.xpath(
+        f"//a[{HAS_CLASS.format('znxt')}][not({HAS_CLASS.format('js-disabled')})]/@href"
+    )
+    return album_url_list, next_url[0] if next_url and next_url[0].startswith('/') else None
@@ -0,0 +1,105 @@
+"""a pool of processes parsing the crawled pages and writing the results.
+
+The crawlers' threads only fetch: each page fetched is handed to the pool with the
+function parsing (and storing) it, so the parsing uses all the cores while the next
+pages are being fetched. At most max_pending pages wait in the pool, a fetcher
+handing one more page waits for a free place (backpressure), so a slow parse can't
+fill the memory with pages.
+
+The functions run in the pool must be defined at the top level of a module (they
+are pickled to the processes), and return what the crawler needs afterwards. What
+happens next is chained to the future with chain(), so no thread waits for a page.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+def chain(future: Future, func) -> Future:
+
+    """the future of func(result of the future)
+
+    func is called in the thread completing the future. If func returns a future, the
+    chained future completes with it. An exception of the future or of func is the
+    exception of the chained future.
+    """
+
+    chained: Future = Future()
+
+    def follow(done: Future) -> None:
+        try:
+            chained.set_result(done.result())
+        except BaseException as error:
+            chained.set_exception(error)
+
+    def callback(done: Future) -> None:
+        try:
+            result = func(done.result())
+        except BaseException as error:
+            chained.set_exception(error)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(follow)
+        else:
+            chained.set_result(result)
+
+    future.add_done_callback(callback)
+    return chained
+
+class ParsePool:
+
+    """the processes parsing the pages, fed through a bounded queue
+
+    Attributes:
+        workers (int): the number of processes, 0 to parse in the calling thread
+        max_pending (int): the most pages submitted and not parsed yet
+        executor (ProcessPoolExecutor | None): the processes, None if workers is 0
+        slots (threading.BoundedSemaphore): the free places of the queue
+    """
+
+    def __init__(self, workers: int | None = None, max_pending: int | None = None):
+
+        """start the processes (one per core by default)"""
+
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending if max_pending is not None else 4 * max(self.workers, 1)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 0 else None
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+
+    def submit(self, func, *args) -> Future:
+
+        """queue func(*args), waiting for a free place in the queue
+
+        Don't call it from a callback of a future of the pool: the callbacks run in the
+        thread freeing the places.
+        """
+
+        if self.executor is None:
+            future: Future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def close(self, cancel_pending: bool = False) -> None:
+
+        """finish (or cancel) the queued pages, then stop the processes"""
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=cancel_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # after an error nobody is waiting for the queued pages any more
+        self.close(cancel_pending=exc_type is not None)
@@ -0,0 +1,164 @@
+"""an adaptive request rate shared by all the fetches of a crawl.
+
+Every try of a request (see RequestsGet.fetch) first takes a slot of its host: the
+slots of a host are 1 / rate seconds apart, so the threads of the crawler, the image
+pipeline and the drivers' pages together never go faster than the host's rate.
+
+The rate of a host adapts to its answers (AIMD, as tcp's congestion window):
+    a good answer adds increase / rate to the rate, so the rate grows by about
+        `increase` requests per second every second while the host answers well
+    a 429, a 5xx, a failed connection or a latency spike (a latency more than
+        spike_factor times the usual one) multiplies the rate by `decrease`, at most
+        once per cooldown, so the answers of the requests already in flight when the
+        host started throttling count once
+    a Retry-After header holds all the requests of the host until it has passed
+The current rate of each host is a gauge of the crawl metrics ('rate <host>'), the
+time spent waiting for a slot is the 'throttle' stage.
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+from crawl_metrics import CrawlMetrics
+
+# the answers asking to slow down: rate limited or the server overloaded
+BACKOFF_STATUS = {429, 500, 502, 503, 504}
+
+class HostRate:
+
+    """the rate of one host
+
+    Attributes:
+        rate (float): the requests per second allowed now
+        next_slot (float): the monotonic time of the next free slot
+        blocked_until (float): the monotonic time asked by the last Retry-After
+        decreased_at (float): the monotonic time of the last decrease
+        latency (float | None): the moving average of the good answers' latencies
+    """
+
+    def __init__(self, rate: float):
+
+        """a host free right now, at the rate"""
+
+        self.rate = rate
+        self.next_slot = 0.0
+        self.blocked_until = 0.0
+        self.decreased_at = float('-inf')
+        self.latency: float | None = None
+
+class RateController:
+
+    """the adaptive request rates of the hosts, shared by the threads of a crawl
+
+    Attributes:
+        initial_rate (float): the rate (requests per second) of a host not seen yet
+        min_rate (float): the rate never goes below this
+        max_rate (float): the rate never goes above this
+        increase (float): the requests per second added after about a second of good answers
+        decrease (float): the factor of the rate after a bad answer
+        spike_factor (float): a latency this many times the usual one is a spike
+        min_spike (float): a latency (seconds) under this is never a spike
+        cooldown (float): the least time (seconds) between two decreases of a host
+        smoothing (float): the weight of a new latency in the moving average
+        metrics (CrawlMetrics | None): where the rates and the waits are reported
+        hosts (dict[str, HostRate]): the rate of each host
+        lock (threading.Lock): guards the hosts
+    """
+
+    def __init__(self, initial_rate: float = 2.0, min_rate: float = 0.2, max_rate: float = 20.0,
+                 increase: float = 0.5, decrease: float = 0.5, spike_factor: float = 3.0,
+                 min_spike: float = 1.0, cooldown: float = 1.0, smoothing: float = 0.2,
+                 metrics: CrawlMetrics | None = None):
+
+        """start every host at the initial rate"""
+
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.spike_factor = spike_factor
+        self.min_spike = min_spike
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.metrics = metrics
+        self.hosts: dict[str, HostRate] = {}
+        self.lock = threading.Lock()
+
+    def host(self, url: str) -> HostRate:
+
+        """the rate of the url's host (call it holding the lock)"""
+
+        netloc = urlsplit(url).netloc
+        if netloc not in self.hosts:
+            self.hosts[netloc] = HostRate(self.initial_rate)
+        return self.hosts[netloc]
+
+    def acquire(self, url: str) -> float:
+
+        """wait for a slot of the url's host, returns the seconds waited"""
+
+        with self.lock:
+            host = self.host(url)
+            now = time.monotonic()
+            start = max(now, host.next_slot, host.blocked_until)
+            host.next_slot = start + 1 / host.rate
+        wait = start - now
+        if wait > 0:
+            time.sleep(wait)
+        if self.metrics is not None:
+            self.metrics.record('throttle', wait)
+        return wait
+
+    def feedback(self, url: str, status: int | None, latency: float, retry_after: float = 0.0) -> float:
+
+        """adapt the rate of the url's host to an answer
+
+        Args:
+            url (str): the url of the request
+            status (int | None): the status code of the answer, None if the request failed
+            latency (float): the seconds the answer took
+            retry_after (float): the seconds asked by a Retry-After header, 0 if none
+
+        Returns:
+            rate (float): the new rate of the host
+        """
+
+        with self.lock:
+            host = self.host(url)
+            now = time.monotonic()
+            if retry_after > 0:
+                host.blocked_until = max(host.blocked_until, now + retry_after)
+            spike = (
+                host.latency is not None and latency > self.min_spike
+                and latency > self.spike_factor * host.latency
+            )
+            if status is None or status in BACKOFF_STATUS or spike:
+                decreased = now - host.decreased_at >= self.cooldown
+                if decreased:
+                    host.decreased_at = now
+                    host.rate = max(self.min_rate, host.rate * self.decrease)
+            else:
+                decreased = False
+                host.rate = min(self.max_rate, host.rate + self.increase / host.rate)
+                # the bad answers don't count in the usual latency
+                if host.latency is None:
+                    host.latency = latency
+                else:
+                    host.latency += self.smoothing * (latency - host.latency)
+            rate = host.rate
+            netloc = urlsplit(url).netloc
+        if self.metrics is not None:
+            self.metrics.set_gauge(f'rate {netloc}', round(rate, 3))
+            if decreased:
+                self.metrics.count('rate decreases')
+            if retry_after > 0:
+                self.metrics.count('retry after')
+        return rate
+
+    def rates(self) -> dict[str, float]:
+
+        """the current rate of each host"""
+
+        with self.lock:
+            return {netloc: host.rate for netloc, host in self.hosts.items()}
@@ -0,0 +1,486 @@
+"""a local http server replaying the site, so the crawlers can be measured reproducibly.
+
+The server answers the urls the crawlers request:
+    /artist/desc?id=: the desc page of an artist
+    /artist?id=: the songs page of an artist
+    /artist/album?id=&limit=&offset=: a page of an artist's albums
+    /album?id=: the page of an album
+    /song?id=: the page of a song
+    /api/song/lyric?id=: the lyrics of a song
+    /img/... and /cdn/...: the images
+A page recorded in the http cache (a crawl without --no-cache records every page it
+gets) is replayed as it was, with the urls of the image servers pointed to the
+replay server. The pages that are not recorded are rebuilt from the crawled info
+(the records of the corpus store, and the json files of artist_intro, artist_song_ids
+and song_intro not converted into it), and the images are the stored ones.
+The albums are made up: the songs of an artist (every stored song listing the artist)
+are cut into albums of ALBUM_SIZE songs, so the discography of an artist is longer
+than its songs page and goes on for several pages of albums, with co-artists.
+
+Every answer can be delayed (latency plus a random jitter), and a share of the
+requests can fail, with an error status (and its Retry-After) or with a connection
+closed without answer, to measure the retries.
+"""
+
+import argparse
+import html
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from corpus_store import CorpusStore
+from store import (
+    CORPUS_PATH, SAVED_INFO_PATH, HTTP_CACHE_PATH, ARTIST_INTRO_PATH, ARTIST_SONG_IDS_PATH, ARTIST_IMAGE_PATH,
+    SONG_INTRO_PATH, SONG_IMAGE_PATH
+)
+
+# the image served for an image that is not stored
+PLACEHOLDER_IMAGE_PATH = f"{SAVED_INFO_PATH}/song_info_curl_exp/img.jpg"
+
+# the image servers of the site, whose urls in the recorded pages go to /cdn/ instead
+IMAGE_HOSTS = re.compile(r'https?://p[0-9]+\.music\.126\.net')
+
+# what the lyric api answers for a song without lyrics (see song_curl.NO_LYRICS_TEXT)
+NO_LYRICS_TEXT = "纯音乐，请欣赏"
+
+# the songs of a made up album, and the albums of a page of an artist's albums by default
+ALBUM_SIZE = 10
+ALBUM_PAGE_SIZE = 12
+
+# the navigation and scripts of every page of the site, around the parsed markup
+PAGE_SCRIPT = '<script>' + 'window.GRef="artist";var GUser={};var GAllowRejectComment=false;' * 40 + '</script>'
+PAGE_TOP = (
+    '</head><body><div class="g-topbar"><div class="m-top"><ul class="m-nav j-tflag">'
+    + ''.join(f'<li><span><a href="/discover/{i}" class="z-slt"><em>nav{i}</em></a></span></li>' for i in range(30))
+    + '</ul></div></div><div class="g-bd4 f-cb"><div class="g-mn4"><div class="g-mn4c"><div class="g-wrap6">'
+)
+PAGE_FOOT = (
+    '</div></div></div><div class="g-sd4"><ul class="m-piclist f-cb">'
+    + ''.join(f'<li><a href="/user/home?id={i}" class="s-fc3">user{i}</a></li>' for i in range(60))
+    + '</ul></div></div><div class="g-ft"><p class="copy">网易公司版权所有©1997-2025</p></div>'
+    '<script src="https://s2.music.126.net/web/s/pt_frame_index.js"></script></body></html>'
+)
+
+def page(title: str, body: str, meta: str = '') -> str:
+
+    """a page of the site with the title, the extra meta tags and the body"""
+
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title>'
+        f'<link rel="stylesheet" href="https://s2.music.126.net/web/s/core.css">{meta}'
+        + PAGE_SCRIPT + PAGE_TOP + body + PAGE_FOOT
+    )
+
+def artist_page(artist: dict, image_url: str) -> str:
+
+    """rebuild the desc page of an artist from the artist's stored info"""
+
+    intro = artist.get('intro', artist.get('artist_intro', {}))
+    name = html.escape(artist['name'])
+    sections = []
+    for key, header in (('intro', f"{name}简介"), ('history', '演艺经历'),
+                        ('master work', '代表作品'), ('milestones', '重要里程碑')):
+        if key not in intro:
+            continue
+        paragraph = intro[key] if isinstance(intro[key], str) else ''.join(f"●{item}" for item in intro[key])
+        sections.append(f'<h2 class="ztag">{header}</h2><div class="n-desc"><p>{html.escape(paragraph)}</p></div>')
+    body = (
+        f'<div class="n-artist f-cb"><div class="btm"><h2 id="artist-name" class="sname f-thide">{name}</h2>'
+        f'<h3 id="artist-alias" class="salias f-thide">{html.escape(";".join(artist["alias"]))}</h3></div>'
+        f'<img src="{html.escape(image_url)}"><div class="mask f-alpha"></div></div>'
+        f'<ul class="m-tabs f-cb"><li class="fst"><a href="/artist?id=1"><em>热门作品</em></a></li></ul>'
+        f'<div class="n-artdesc">{"".join(sections)}</div>'
+    )
+    return page(f"{name} - 歌手 - 网易云音乐", body)
+
+def song_page(song: dict, cover_url: str) -> str:
+
+    """rebuild the page of a song from the song's stored info"""
+
+    name = song['name'] if 'alias' not in song else f"{song['name']}（{song['alias']}）"
+    artists = ''.join(
+        f'<a class="s-fc7" href="/artist?id={id}">{html.escape(artist)}</a>'
+        for artist, id in zip(song['artist list'], song['artist id list'])
+    )
+    cover = html.escape(cover_url)
+    body = (
+        f'<div class="m-lycifo"><div class="f-cb"><div class="cvrwrap f-cb f-pr">'
+        f'<div class="u-cover u-cover-6 f-fl"><img src="{cover}" class="j-img"></div></div>'
+        f'<div class="cnt"><div class="hd"><em class="f-ff2">{html.escape(song["name"])}</em></div>'
+        f'<p class="des s-fc4">歌手：<span>{artists}</span></p>'
+        f'<div id="lyric-content" class="bd bd-open f-brk f-ib">{html.escape(song.get("lyrics", ""))}</div>'
+        f'</div></div></div>'
+    )
+    meta = f'<meta property="og:image" content="{cover}" />'
+    title = f"{html.escape(name)} - {html.escape('/'.join(song['artist list']))} - 单曲 - 网易云音乐"
+    return page(title, body, meta)
+
+def song_list_page(song_id_list: list[int]) -> str:
+
+    """rebuild the songs page of an artist from the artist's stored song ids"""
+
+    songs = ''.join(f'<li><a href="/song?id={id}">song{id}</a></li>' for id in song_id_list)
+    body = f'<div id="song-list-pre-cache"><ul class="f-hide">{songs}</ul></div>'
+    return page("歌手 - 网易云音乐", body)
+
+def album_list_page(artist_id: int, album_id_list: list[int], offset: int, limit: int, total: int) -> str:
+
+    """rebuild a page of an artist's albums (the albums from offset on, of the total)"""
+
+    albums = ''.join(
+        f'<li><div class="u-cover u-cover-alb3" title="album{id}"><a href="/album?id={id}" class="msk"></a></div>'
+        f'<p class="dec dec-1 f-thide2 f-pre" title="album{id}"><a class="tit s-fc0" href="/album?id={id}">album{id}</a></p></li>'
+        for id in album_id_list
+    )
+    previous = (
+        f'<a href="/artist/album?id={artist_id}&limit={limit}&offset={max(0, offset - limit)}" class="zbtn zprv">上一页</a>'
+        if offset > 0 else '<a href="javascript:void(0)" class="zbtn zprv js-disabled">上一页</a>'
+    )
+    following = (
+        f'<a href="/artist/album?id={artist_id}&limit={limit}&offset={offset + limit}" class="zbtn znxt">下一页</a>'
+        if offset + limit < total else '<a href="javascript:void(0)" class="zbtn znxt js-disabled">下一页</a>'
+    )
+    body = (
+        f'<ul class="m-cvrlst m-cvrlst-alb4 f-cb" id="m-song-module">{albums}</ul>'
+        f'<div class="u-page">{previous}{following}</div>'
+    )
+    return page("专辑 - 歌手 - 网易云音乐", body)
+
+def read_json(path: str):
+
+    """the content of a json file, None if there is no such file"""
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+class ReplayServer:
+
+    """the replaying http server, run in a thread of its own
+
+    Attributes:
+        host (str): the address the server listens on
+        port (int): the port the server listens on (0 for any free port)
+        latency (float): the delay (seconds) of every answer
+        jitter (float): the most random delay (seconds) added to the latency
+        error_rate (float): the share of the requests answered with error_status
+        error_status (int): the status of the injected errors
+        retry_after (float | None): the Retry-After sent with the injected errors, None for none
+        reset_rate (float): the share of the requests whose connection is closed without answer
+        random (random.Random): draws the jitter and the injected failures (seeded for replays)
+        recorded (dict[str, str]): the meta file of every recorded url (path and query)
+        corpus (CorpusStore | None): the corpus store of the crawled info, None if there is none
+        artist_songs (dict[int, list[int]] | None): the stored songs of each artist, read at the first use
+        counts (dict[str, int]): the requests, and how each was answered
+        lock (threading.Lock): guards the counts
+        httpd (ThreadingHTTPServer | None): the running server, None before start()
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, retry_after: float | None = None,
+                 reset_rate: float = 0.0, seed: int | None = None, use_recorded: bool = True):
+
+        """prepare the server and find the recorded pages"""
+
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.reset_rate = reset_rate
+        self.random = random.Random(seed)
+        self.recorded = self.load_recorded() if use_recorded else {}
+        self.corpus = CorpusStore(CORPUS_PATH) if os.path.exists(f"{CORPUS_PATH}/corpus.json") else None
+        self.artist_songs: dict[int, list[int]] | None = None
+        self.counts: dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.httpd: ThreadingHTTPServer | None = None
+
+    def load_recorded(self) -> dict[str, str]:
+
+        """the meta files of the pages in the http cache, by path and query"""
+
+        recorded = {}
+        for directory in (os.scandir(HTTP_CACHE_PATH) if os.path.isdir(HTTP_CACHE_PATH) else []):
+            for entry in os.scandir(directory.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    url = urlsplit(json.load(f)['url'])
+                recorded[f"{url.path}?{url.query}" if url.query else url.path] = entry.path
+        return recorded
+
+    def record(self, collection: str, id: str) -> dict | None:
+
+        """the stored record of the id (see corpus_store.py), from the corpus store or its json file"""
+
+        if self.corpus is not None:
+            record = self.corpus.get(collection, id)
+            if record is not None:
+                return record
+        if collection == 'artist songs':
+            song_id_list = read_json(f"{ARTIST_SONG_IDS_PATH}/artist{id}songs.json")
+            return None if song_id_list is None else {'id': int(id), 'song ids': song_id_list}
+        if collection == 'artists':
+            return read_json(f"{ARTIST_INTRO_PATH}/artist{id}.json")
+        return read_json(f"{SONG_INTRO_PATH}/song{id}.json")
+
+    def songs_of(self, artist_id: int) -> list[int]:
+
+        """the ids of the stored songs listing the artist, in order"""
+
+        with self.lock:
+            if self.artist_songs is None:
+                songs = [read_json(entry.path) for entry in os.scandir(SONG_INTRO_PATH)] \
+                    if os.path.isdir(SONG_INTRO_PATH) else []
+                if self.corpus is not None:
+                    songs += self.corpus.iterate('songs')
+                artist_songs: dict[int, set[int]] = {}
+                for song in songs:
+                    for id in song.get('artist id list', []):
+                        artist_songs.setdefault(int(id), set()).add(int(song['id']))
+                self.artist_songs = {id: sorted(songs) for id, songs in artist_songs.items()}
+            return self.artist_songs.get(artist_id, [])
+
+    def albums_of(self, artist_id: int) -> list[list[int]]:
+
+        """the made up albums of the artist: its songs cut in ALBUM_SIZE pieces"""
+
+        songs = self.songs_of(artist_id)
+        return [songs[i:i + ALBUM_SIZE] for i in range(0, len(songs), ALBUM_SIZE)]
+
+    @property
+    def url(self) -> str:
+
+        """the root url of the running server"""
+
+        return f"http://{self.host}:{self.httpd.server_address[1]}"
+
+    def start(self) -> str:
+
+        """start serving in a daemon thread, returns the root url"""
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), ReplayHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.replay = self
+        threading.Thread(target=self.httpd.serve_forever, name="replay", daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+
+        """stop serving"""
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def count(self, name: str) -> None:
+
+        """add one to a count"""
+
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def delay(self) -> float:
+
+        """the delay of the next answer"""
+
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+    def failure(self) -> str | None:
+
+        """the failure injected in the next answer: 'reset', 'error' or None"""
+
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.reset_rate:
+            return 'reset'
+        if draw < self.reset_rate + self.error_rate:
+            return 'error'
+        return None
+
+    def answer(self, path: str, base: str) -> tuple[int, str, bytes]:
+
+        """the status, content type and body of the answer to the path (with its query)
+
+        Args:
+            path (str): the requested path and query
+            base (str): the root url of the server, as the client sees it
+
+        Returns:
+            status (int): the status of the answer
+            content_type (str): the content type of the body
+            body (bytes): the body of the answer
+        """
+
+        if path in self.recorded:
+            self.count('recorded')
+            return self.recorded_answer(self.recorded[path], base)
+        answer = self.rebuilt_answer(path, base)
+        if answer is None:
+            self.count('not found')
+            return 404, 'text/plain; charset=utf-8', b'not found'
+        self.count('rebuilt')
+        return answer
+
+    def recorded_answer(self, meta_path: str, base: str) -> tuple[int, str, bytes]:
+
+        """the recorded answer, with the image urls pointed to the server"""
+
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(f"{meta_path[:-len('.json')]}.body", 'rb') as f:
+            body = f.read()
+        content_type = meta.get('content_type') or 'text/html; charset=utf-8'
+        if content_type.startswith(('text/', 'application/json')):
+            encoding = meta.get('encoding') or 'utf-8'
+            body = IMAGE_HOSTS.sub(f"{base}/cdn", body.decode(encoding, errors='replace')).encode(encoding, errors='replace')
+        return meta['status'], content_type, body
+
+    def rebuilt_answer(self, path: str, base: str) -> tuple[int, str, bytes] | None:
+
+        """the answer rebuilt from the crawled info, None if there is nothing to answer"""
+
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+        id = query.get('id', [''])[0]
+        if not id.isdigit() and not url.path.startswith(('/img/', '/cdn/')):
+            return None
+        page_html = None
+        if url.path == '/artist/desc':
+            artist = self.record('artists', id)
+            if artist is not None:
+                page_html = artist_page(artist, f"{base}/img/artist{id}.jpg")
+        elif url.path == '/artist':
+            artist_songs = self.record('artist songs', id)
+            song_id_list = None if artist_songs is None else artist_songs['song ids']
+            if song_id_list is None:
+                # an artist found through its songs, whose songs page was not crawled
+                song_id_list = self.songs_of(int(id))[:50] or None
+            if song_id_list is not None:
+                page_html = song_list_page(song_id_list)
+        elif url.path == '/artist/album':
+            albums = self.albums_of(int(id))
+            limit = int(query.get('limit', [ALBUM_PAGE_SIZE])[0])
+            offset = int(query.get('offset', [0])[0])
+            if albums:
+                # an album's id is the artist's id followed by the album's number on 4 digits
+                album_id_list = [int(f"{id}{i:04d}") for i in range(offset, min(offset + limit, len(albums)))]
+                page_html = album_list_page(int(id), album_id_list, offset, limit, len(albums))
+        elif url.path == '/album':
+            artist_id, number = int(id[:-4] or 0), int(id[-4:])
+            albums = self.albums_of(artist_id)
+            if number < len(albums):
+                page_html = song_list_page(albums[number])
+        elif url.path == '/song':
+            song = self.record('songs', id)
+            if song is not None:
+                page_html = song_page(song, f"{base}/img/song{id}.jpg")
+        elif url.path == '/api/song/lyric':
+            song = self.record('songs', id)
+            if song is None:
+                return None
+            if song.get('lyrics') == NO_LYRICS_TEXT:
+                lyric = {'nolyric': True, 'code': 200}
+            else:
+                lyric = {'lrc': {'version': 1, 'lyric': song.get('lyrics', '')}, 'code': 200}
+            return 200, 'application/json; charset=utf-8', json.dumps(lyric, ensure_ascii=False).encode('utf-8')
+        elif url.path.startswith(('/img/', '/cdn/')):
+            return 200, 'image/jpeg', self.image(os.path.basename(url.path))
+        if page_html is None:
+            return None
+        return 200, 'text/html; charset=utf-8', page_html.encode('utf-8')
+
+    def image(self, name: str) -> bytes:
+
+        """the stored image of the name (e.g. song123.jpg), the placeholder if it is not stored"""
+
+        if name.startswith('song'):
+            path = f"{SONG_IMAGE_PATH}/{name}"
+        elif name.startswith('artist'):
+            path = f"{ARTIST_IMAGE_PATH}/{name}"
+        else:
+            path = PLACEHOLDER_IMAGE_PATH
+        if not os.path.exists(path):
+            path = PLACEHOLDER_IMAGE_PATH
+        with open(path, 'rb') as f:
+            return f.read()
+
+class ReplayHandler(BaseHTTPRequestHandler):
+
+    """answers a request of the crawlers with the ReplayServer of the http server"""
+
+    # keep-alive, like the site, so the crawlers' connection pool is measured too
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately, don't let them wait for an ack
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        replay: ReplayServer = self.server.replay
+        replay.count('requests')
+        time.sleep(replay.delay())
+
+        failure = replay.failure()
+        if failure == 'reset':
+            replay.count('resets')
+            self.close_connection = True
+            return
+        if failure == 'error':
+            replay.count('errors')
+            self.send_response(replay.error_status)
+            if replay.retry_after is not None:
+                self.send_header('Retry-After', str(replay.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        status, content_type, body = replay.answer(self.path, f"http://{self.headers['Host']}")
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        # one line per request would slow the replay down
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay the site locally for the crawlers")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on (0 for any free port)")
+    parser.add_argument('--latency', type=float, default=0.0, help="delay (seconds) of every answer")
+    parser.add_argument('--jitter', type=float, default=0.0, help="most random delay (seconds) added to the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of the requests answered with an error")
+    parser.add_argument('--error-status', type=int, default=503, help="status of the injected errors")
+    parser.add_argument('--retry-after', type=float, default=None, help="Retry-After of the injected errors")
+    parser.add_argument('--reset-rate', type=float, default=0.0, help="share of the connections closed without answer")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the jitter and the injected failures")
+    parser.add_argument('--no-recorded', action='store_true', help="rebuild every page instead of replaying the recorded ones")
+    args = parser.parse_args()
+
+    server = ReplayServer(
+        args.host, args.port, args.latency, args.jitter, args.error_rate, args.error_status,
+        args.retry_after, args.reset_rate, args.seed, use_recorded=not args.no_recorded
+    )
+    print(f"replaying on {server.start()} ({len(server.recorded)} recorded pages)", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+        print(server.counts)
@@ -1,34 +1,230 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
 import requests
+from requests.adapters import HTTPAdapter
+from crawl_metrics import CrawlMetrics
+from http_cache import HttpCache, CacheMiss
+from rate_control import RateController
+
+# the responses worth retrying: rate limited or a temporary failure of the server
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# the headers and cookies used by the requests of all the crawlers
+HEADERS = {
+    "referer": "https://music.163.com/",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
+}
+
+COOKIES = {
+    "_iuqxldmzr_": "32",
+    "*ntes*nnid": "66528d90a67b40f5083977b2aa13f1fb,1750984768492",
+    "*ntes*nuid": "66528d90a67b40f5083977b2aa13f1fb",
+    "WEVNSM": "1.0.0",
+    "WNMCID": "wvtjxf.1750984768861.01.0",
+    "NMTID": "00O7aLHpTbFcg_iC0nCm7NyqWczpIYAAAGXrtM58g",
+    "sDeviceId": "YD-l%2B6BoGmhqc1AF1EQQQaTPoj4t09g4aiS",
+    "ntes_utid": "tid._.mMP9FniabwxEBkRRUBeDP9jt8x8ksbiW._.0",
+    "WM_TID": "%2BYEnlCDbZ1xFVUQQQQOCOoi8p04hzMbF",
+    "**snaker**id": "CpNqIxmBogQLpWV9",
+    "gdxidpyhxdE": "oC5cpwv7PdGK%5CrmjJB8pisHZ9m1bBCR4w4gVu%5C3l%5CdaVIcn1L9PMEOTPvc2C8cMYGtX4%2BX3N43UcZQ%2FC5xOL2zmMWV4Avj84tVTrpcwfbjN%2BLY31po577AjeOjXkfxxdf9fUWC9iWY1Ko9l9AVy3zsovRIhtL%2BVVzbY9dl0EYqvKTeab%3A1750985729881",
+    "__csrf": "dd241c7029354383215c754cbca3fbbc",
+    "MUSIC_U": "00C3F1F27B7227B3ADC8357A5221494AD43A2E473D70140C67E44C374292212270FD60D72117FF1C8D04F475CFC613AF28264AF280B916F00CA8541633CD8FF0DCA322F55A7545CBE45807FB36FABC2D8C9765E4835C0E517CC51EBA66B07B63B88377B4AB73DEA1792995652DEFDFA3A100511F345AFB8948D4847DCFE5063CAEF379ECC1C3EB07DD3EE103BC7F385C3BB0C1D4B47F8CFF3C0B8E1BFE0260AFC372679E42AA7A852234A6BC65C4309550185473C79DE4ADF8AA60605B73674309FA299BF95F163D527B4EB504389D48829AD480E1BD63652CF1EDA146C77FDADE91A513C8719F7E00FAAFD93519D6437CB0C52E7B519F95698A5FA5C7E5E4B32968C75C52F20F06B46D80ED1E25A0B02F56837B26D608822215B2C8A34A946CAB151832BA86D2F3B32BD196A4FCA46D1D9044C74CF5D9823C1098DB7EB73AC2ADED8A88FFACC861B2981645C2EF743FBE6747205EE9A20619C0AA1B44AD6C92C185DAB10053BD76255C9312E6D7D02B58",
+    "__remember_me": "true",
+    "P_INFO": "15652144978|1750984965|1|music|00&99|null&null&null#bej&null#10#0|&0||15652144978",
+    "ntes_kaola_ad": "1",
+    "JSESSIONID-WYYY": "XS7a6BigwtwhR0RhteE%2FVuxgGr1HyDUHnZATC8pH37RU6I1Su8sOXsrf33Adk7Y0bRTtjhcwtdZ%5CyG%2FcTdFoOxy%2Fza0JOFnsAfob3Hjw2hRx%2B4xyCW4iEZfzGfxAh3uIsoO%2BW0gKEiAru2uFdm6FBpKdwuniVD9ZYB%2BGd23DDpqXqoys%3A1751068190136",
+    "WM_NI": "KaKg7wE4tYc7KsLvnkUbjDC0vBlN%2Bry9DP3%2B7O0osQKBQpX4wLoOA4r%2Bu%2BN9BICLyFdBTj0E1A%2BzViLHOjv9tEeD6WdfzVAunXOGebIELB2OeNdVX%2FHlzun8oRseYNnBQXU%3D",
+    "WM_NIKE": "9ca17ae2e6ffcda170e2e6eed4b16f8c95fb96c54aae9a8fb7c44f829e9ab1d66af7b0aa8eeb4990ae009bd62af0fea7c3b92a89bf8588b67d87ecbcbae23d89ad8497ed6197bea6a5c23cb69ea4afaa7abbe78cb1b221f5910090f25b899e9f91db40b594a1b0c440b2f5bbcccd3382978dadfc4ea89e9c8bb34ff39fe59bd5639098818bf533b89baba5b55da8bab6b7c47fae8881a8e86a8b9b84a3b145a792acb7db258cb4b696ed34ad8ebd86dc46ae9e9fb9d837e2a3"
+}
 
 class RequestsGet:
 
     """a class for the get requests
 
     A class that stores headers and cookies for get requests. This class exists
-    since all the requests in the code use the same headers and cookies.
+    since all the requests in the code use the same headers and cookies. All the
+    requests go through one keep-alive session, so the connections (and their TLS
+    handshakes) are reused, and failed requests are retried with backoff. With a rate
+    controller every try waits for a slot of its host, and the answers adapt the rate.
 
     Attributes:
         headers (dict[str, str]): the headers for the requests
         cookies (dict[str, str]): the cookies for the requests
+        session (requests.Session): the session owning the connection pool
+        timeout (tuple[float, float]): the connect and read timeouts in seconds
+        max_retries (int): how many times a failed request is retried
+        backoff (float): the base delay (seconds) of the exponential backoff
+        max_backoff (float): the maximum delay (seconds) between two tries
+        latencies (list[tuple[str, int | None, float]]):
+            the url, status code (None if no response) and latency in seconds of every try
+        cache (HttpCache | None): the on-disk cache consulted before any request, None for no cache
+        metrics (CrawlMetrics): the timings and counters of the crawl (every try is a 'fetch')
+        rate (RateController | None): the adaptive request rate of each host, None for no limit
     """
 
-    def __init__(self, headers: dict[str, str], cookies: dict[str, str]):
+    def __init__(self, headers: dict[str, str], cookies: dict[str, str], pool_size: int = 10,
+                 connect_timeout: float = 5.0, read_timeout: float = 20.0, max_retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 30.0, cache: HttpCache | None = None,
+                 metrics: CrawlMetrics | None = None, rate: RateController | None = None):
 
         """using the headers and cookies to initialize this request class"""
 
         self.headers = headers
         self.cookies = cookies
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latencies: list[tuple[str, int | None, float]] = []
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else CrawlMetrics()
+        self.rate = rate
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.cookies.update(cookies)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
-    def requests_get(self, url: str, params: dict | None = None):
+    @property
+    def offline(self) -> bool:
+
+        """whether the requests are only answered from the cache"""
+
+        return self.cache is not None and self.cache.offline
+
+    def requests_get(self, url: str, params: dict | None = None, stream: bool = False):
 
         """using the url and params to do the get request
+
+        If there is a cache, a fresh cached response is returned without a request, and a
+        stale one is revalidated with a conditional request (a 304 keeps the cached body).
+        In offline mode a url that is not cached raises CacheMiss. A streamed request
+        bypasses the cache (but in offline mode): caching its body would read it all.
+
+        Args:
+            url (str): the url of the request
+            params (dict | None): the params of the request
+            stream (bool): whether the body should be streamed (e.g. for images)
+
+        Returns:
+            response (Response): the response of the request
+        """
+
+        if self.cache is None:
+            return self.fetch(url, params, stream)
+        full_url = self.cache.full_url(url, params)
+        if (stream or self.cache.ttl(full_url) is None) and not self.cache.offline:
+            # this kind of url is never cached, nor a body streamed to the caller
+            return self.fetch(url, params, stream)
+
+        meta = self.cache.load(full_url)
+        if meta is not None and (self.cache.offline or self.cache.is_fresh(meta)):
+            self.metrics.count('cache hits')
+            return self.cache.to_response(meta)
+        if self.cache.offline:
+            raise CacheMiss(f"{full_url} is not in the cache")
+
+        response = self.fetch(full_url, headers=self.cache.conditional_headers(meta))
+        if response.status_code == 304 and meta is not None:
+            self.metrics.count('cache revalidated')
+            self.cache.touch(meta)
+            return self.cache.to_response(meta)
+        if response.status_code == 200:
+            self.cache.store(full_url, response)
+        return response
+
+    def fetch(self, url: str, params: dict | None = None, stream: bool = False,
+              headers: dict[str, str] | None = None):
+
+        """send the get request, retrying the failures
         
+        Connection errors, timeouts and the status codes in RETRY_STATUS are retried
+        up to max_retries times. Every try waits for a slot of the rate controller, and
+        tells it how the host answered. The response of the last try is returned even if its
+        status code is an error, so the callers can still use raise_for_status().
+
         Args:
             url (str): the url of the request
             params (dict | None): the params of the request
+            stream (bool): whether the body should be streamed (e.g. for images)
+            headers (dict[str, str] | None): the headers added to the session's headers
 
         Returns:
             response (Response): the response of the request
         """
 
-        return requests.get(url, headers=self.headers, cookies=self.cookies, params=params)
\ No newline at end of file
+        for attempt in range(self.max_retries + 1):
+            if self.rate is not None:
+                self.rate.acquire(url)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(
+                    url, params=params, headers=headers, timeout=self.timeout, stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as error:
+                latency = time.perf_counter() - start
+                self.latencies.append((url, None, latency))
+                self.metrics.record('fetch', latency)
+                if self.rate is not None:
+                    self.rate.feedback(url, None, latency)
+                if attempt == self.max_retries:
+                    self.metrics.count('request errors')
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(f"{url} failed ({error.__class__.__name__}), retrying in {delay:.1f}s")
+            else:
+                latency = time.perf_counter() - start
+                self.latencies.append((url, response.status_code, latency))
+                self.metrics.record('fetch', latency)
+                retry_after = self.retry_after(response) if response.status_code in RETRY_STATUS else 0
+                if self.rate is not None:
+                    self.rate.feedback(url, response.status_code, latency, retry_after)
+                if response.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                    return response
+                delay = max(self.backoff_delay(attempt), retry_after)
+                response.close()
+                print(f"{url} got {response.status_code}, retrying in {delay:.1f}s")
+            self.metrics.count('retries')
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt: int) -> float:
+
+        """the exponential backoff with full jitter for the attempt (counted from 0)"""
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def retry_after(self, response) -> float:
+
+        """the delay (seconds) asked by the Retry-After header, 0 if there is none"""
+
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return 0
+        try:
+            return max(0, min(self.max_backoff, float(value)))
+        except ValueError:
+            pass
+        # Retry-After can also be an http date
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return 0
+        return max(0, min(self.max_backoff, delay))
+
+    def report_latency(self) -> None:
+
+        """print the count, mean, median, p95 and max latency of the requests made so far"""
+
+        latencies = sorted(latency for _, _, latency in self.latencies)
+        if not latencies:
+            print("no requests made")
+            return
+        count = len(latencies)
+        print(
+            f"{count} requests, mean {sum(latencies) / count:.3f}s, "
+            f"p50 {latencies[count // 2]:.3f}s, p95 {latencies[min(count - 1, int(count * 0.95))]:.3f}s, "
+            f"max {latencies[-1]:.3f}s"
+        )
@@ -1,17 +1,29 @@
 import requests
-from bs4 import BeautifulSoup
 import re
-import time
 import json
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException
+import argparse
+import time
+from concurrent.futures import Future
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
 from artist_info_curl import get_all_artist_ids
-from requests_get import RequestsGet
-from store import ARTIST_SONG_IDS_PATH, SONG_IMAGE_PATH, SONG_INTRO_PATH
+from browser_pool import DriverPool
+from corpus_store import corpus, near_dups
+from crawl_metrics import CrawlMetrics
+from crawl_state import CrawlState, DONE, FAILED
+from http_cache import HttpCache, CacheMiss
+from image_pipeline import ImagePipeline
+from page_parser import parse_song_page, parse_song_list, parse_album_list
+from parse_pool import ParsePool, chain
+from rate_control import RateController
+from requests_get import RequestsGet, HEADERS, COOKIES
+from store import SONG_IMAGE_PATH, SONG_THUMB_PATH
+
+SITE_URL = "https://music.163.com"
+
+# what the song page shows instead of the lyrics when there are none
+NO_LYRICS_TEXT = "纯音乐，请欣赏"
+UNCOLLECTED_LYRICS_TEXT = "暂时没有歌词 求歌词"
 
 def construct_song_id_list(song_url_list: list[str]) -> list[int]:
     
@@ -32,101 +44,238 @@ def construct_song_id_list(song_url_list: list[str]) -> list[int]:
         id_list.append(int(id))
     return id_list
 
-def get_songs_info(tool: RequestsGet, driver: webdriver.Chrome, song_url_list: list[str]):
+def save_artist_song_ids(artist_id: int, song_id_list: list[int]) -> None:
+
+    """store the song ids of an artist in the corpus store ('artist songs')"""
+
+    corpus().put('artist songs', {'id': int(artist_id), 'song ids': song_id_list})
+    print(f"artist{artist_id}'s songs' ids saved")
+
+def parse_cover_url(html: str) -> str | None:
+
+    """find the url of the song's cover image in the song page, None if it is not there"""
+
+    cover = re.search(r'<meta property="og:image" content="([^"]+)"', html)
+    if cover is None:
+        cover = re.search(r'<img[^>]*class="j-img"[^>]*src="([^"]+)"', html)
+    if cover is None:
+        return None
+    return cover.group(1)
+
+def lrc_to_text(lrc: str) -> str:
+
+    """convert lrc lyrics into the text shown on the song page
+
+    The time tags (e.g. "[00:12.34]") are removed. Some lines (the credits of newer songs)
+    are json objects whose "c" list holds the pieces of the text.
+    """
+
+    lines = []
+    for line in lrc.split('\n'):
+        line = line.strip()
+        if line.startswith('{'):
+            try:
+                line = ''.join(piece['tx'] for piece in json.loads(line)['c'])
+            except (ValueError, KeyError, TypeError):
+                pass
+        lines.append(re.sub(r'\[[0-9:.]*\]', '', line).strip())
+    return '\n'.join(lines).strip()
+
+def get_lyrics_with_requests(tool: RequestsGet, song_id: str, site_url: str = SITE_URL) -> str | None:
+
+    """get the lyrics of a song from the lyric api without a browser
+
+    Args:
+        tool (RequestsGet): the tool making the request
+        song_id (str): the id of the song
+        site_url (str): the root url of the site
+
+    Returns:
+        lyrics (str | None): the lyrics, or None if they can't be got this way
+    """
+
+    try:
+        response = tool.requests_get(
+            f"{site_url}/api/song/lyric", params={'id': song_id, 'lv': 1, 'kv': 1, 'tv': -1}
+        )
+        response.raise_for_status()
+        data = response.json()
+    except (requests.RequestException, ValueError):
+        return None
+    if data.get('nolyric'):
+        return NO_LYRICS_TEXT
+    if data.get('uncollected'):
+        return UNCOLLECTED_LYRICS_TEXT
+    lrc = (data.get('lrc') or {}).get('lyric')
+    if not lrc:
+        return None
+    lyrics = lrc_to_text(lrc)
+    return lyrics or None
+
+def save_song_image(images: ImagePipeline, img_url: str, song_id: str) -> Future:
+
+    """queue the song's image (and its thumbnail) in the image pipeline
+    
+    In offline mode an image already stored is kept (the images are not in the http cache).
+    """
+
+    IMG_PATH = f'{SONG_IMAGE_PATH}/song{song_id}.jpg'
+    THUMB_PATH = f'{SONG_THUMB_PATH}/song{song_id}.webp'
+    return images.submit(img_url, IMG_PATH, THUMB_PATH)
+
+def save_song_intro(song_info: dict) -> None:
+
+    """store the song's intro in the corpus store ('songs'), with its lyrics' fingerprint and group"""
+
+    song_info.update(near_dups().fingerprint(song_info['id'], song_info['lyrics']))
+    corpus().put('songs', song_info)
+    if song_info.get('lyrics group', song_info['id']) != song_info['id']:
+        print(f"song{song_info['id']}'s intro is saved (a near duplicate of song{song_info['lyrics group']})")
+    else:
+        print(f"song{song_info['id']}'s intro is saved")
+
+def parse_and_save_song(html: str, song_info: dict, lyrics: str | None) -> tuple[dict, str | None, dict]:
+
+    """parse a song page, and store the song if its lyrics are known (run in the parse pool)
+
+    Args:
+        html (str): the text of the song page
+        song_info (dict): the song's id and url
+        lyrics (str | None): the lyrics from the lyric api, None if they couldn't be got there
+
+    Returns:
+        song_info (dict): the song's info, with its 'lyrics' and 'lyrics source' if it is stored
+        img_url (str | None): the url of the song's image, None if it is not in the page
+        timings (dict[str, float]): the seconds spent parsing and writing
+    """
+
+    timings = {}
+    start = time.perf_counter()
+    song_info.update(parse_song_page(html))
+    img_url = parse_cover_url(html)
+    timings['parse'] = time.perf_counter() - start
+
+    if img_url is not None and lyrics is not None:
+        song_info['lyrics'] = lyrics
+        song_info['lyrics source'] = 'http'
+        start = time.perf_counter()
+        save_song_intro(song_info)
+        timings['write'] = time.perf_counter() - start
+    return song_info, img_url, timings
+
+def store_parsed_song(tool: RequestsGet, pool: DriverPool, images: ImagePipeline, parsed: tuple) -> Future:
+
+    """hand a parsed song to its image, or to the driver pool if its lyrics or image url are missing
+
+    Args:
+        tool (RequestsGet): the tool whose metrics record the parse pool's timings
+        pool (DriverPool): the headless drivers getting the lyrics and the images' urls
+        images (ImagePipeline): the threads downloading the images
+        parsed (tuple): what parse_and_save_song returned
+
+    Returns:
+        future (Future): done once the song is stored with its image
+    """
+
+    song_info, img_url, timings = parsed
+    tool.metrics.record_stages(timings)
+    if 'lyrics source' in song_info:
+        return save_song_image(images, img_url, song_info['id'])
+    if tool.offline:
+        #the browser can't be used without the network
+        raise CacheMiss(f"song{song_info['id']}'s lyrics or image url are not in the cache")
+    #getting the lyrics and picture with the driver pool
+    return chain(pool.submit(song_info['url']), partial(store_browser_song, tool, images, song_info))
+
+def store_browser_song(tool: RequestsGet, images: ImagePipeline, song_info: dict, result: tuple[str, str]) -> Future:
+
+    """store a song whose image url and lyrics were got by a driver, returns its image's future"""
+
+    img_url, lyrics = result
+    song_info['lyrics'] = lyrics
+    song_info['lyrics source'] = 'browser'
+    with tool.metrics.stage('write'):
+        save_song_intro(song_info)
+    return save_song_image(images, img_url, song_info['id'])
+
+def get_songs_info(tool: RequestsGet, pool: DriverPool, images: ImagePipeline, parser: ParsePool,
+                   song_url_list: list[str], state: CrawlState, site_url: str = SITE_URL):
 
     """A function gets song info using the tools and url list in the input.
 
     This function stores the song info (picture and intro) locally by the RequestsGet tool, 
-    driver, and song url list in the args.
+    driver pool, and song url list in the args. The lyrics and the image's url are first
+    read from plain http responses; only the songs where that fails are handed to the
+    driver pool (which starts its drivers on the first such song). The path used is
+    recorded in the song's 'lyrics source' ('http' or 'browser').
+
+    This thread only fetches: the pages are parsed and the songs stored by the parse pool,
+    and the images are downloaded by the image pipeline meanwhile. A song is only done
+    once it is stored with its image.
+
+    The songs already done or failed in the crawl state (through any artist, in this run
+    or an earlier one) are skipped, and a failed song is recorded instead of stopping the crawl.
+    The info of the songs stored is returned (with their artists, for the discovery crawl).
 
     Args:
         tool (RequestsGet): a tool contains the headers and cookies that will be used
-        driver (webdriver.Chrome): a driver constructed by selenium
+        pool (DriverPool): the headless drivers getting the lyrics and the images' urls
+        images (ImagePipeline): the threads downloading the images
+        parser (ParsePool): the processes parsing the pages and storing the songs
         song_url_list (list[str]): a list contains all songs' urls needed
+        state (CrawlState): the crawl state recording which songs are done or failed
+        site_url (str): the root url of the site the songs are fetched from
 
     Returns:
-        None
+        stored (list[dict]): the info of the songs stored
     """
 
-    #preventing same song appear twice
-    song_id_set = set()
+    song_futures = []
     for url in song_url_list:
         song_info = {}
 
         #getting the id from the url
         _, song_id = re.split(r'=', url, maxsplit=1)
-        if song_id in song_id_set:
-            continue
-        song_id_set.add(song_id)
         song_info['id'] = song_id
-        song_info['url'] = f"https://music.163.com{url}"
+        song_info['url'] = f"{site_url}{url}"
+
+        #preventing same song appear twice
+        if state.status(song_info['url']) in (DONE, FAILED):
+            continue
+        state.add(song_info['url'], 'song')
 
-        #getting song name, artists information from requests
-        response = tool.requests_get(song_info['url'])
-        response.raise_for_status()
-        song_soup = BeautifulSoup(response.text, 'lxml')
-
-        #find the song name and alias
-        song_title = song_soup.title
-        if re.search(r'（.+）', song_title.text) is not None:
-            song_info['name'] = re.split(r'（', song_title.text, maxsplit=1)[0].strip()
-            song_alias = re.search(r'（.+）', song_title.text)
-            song_alias = song_alias.group(0)
-            song_info['alias'] = song_alias[1:len(song_alias) - 1]
-        else:
-            song_info['name'] = re.split(r'-', song_title.text)[0].strip()
-
-        #artists' names and ids
-        artist_tags = song_soup.find_all(href=re.compile(r'^/artist\?id=[0-9]+$'), class_="s-fc7")
-        artist_list = []
-        artist_id_list = []
-        for tag in artist_tags:
-            artist_list.append(tag.text)
-            artist_href = tag['href']
-            _, artist_id = re.split(r'=', artist_href, maxsplit=1)
-            artist_id_list.append(artist_id)
-        song_info['artist list'] = artist_list
-        song_info['artist id list'] = artist_id_list
-
-        #getting the lyrics and picture with webdriver
-        driver.get(song_info['url'])
-        wait = WebDriverWait(driver, 15) #driver will wait for at most 15s for any movement or raise errors
-
-        #change to iframe 
-        iframe = wait.until(EC.presence_of_element_located((By.TAG_NAME, "iframe")))
-        driver.switch_to.frame(iframe)
-
-        #get the image
-        image = wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'j-img')))
-        img_url = image.get_attribute('src')
-        IMG_PATH = f'{SONG_IMAGE_PATH}/song{song_id}.jpg'
-        response = requests.get(img_url, stream=True)
-        with open(IMG_PATH, "wb") as f:
-            for chunck in response.iter_content(chunk_size=8192):
-                f.write(chunck)
-        print(f"song{song_id}'s image saved")
-
-        #click the "展开" button for lyrics
         try:
-            more = wait.until(EC.element_to_be_clickable((By.XPATH, "//*[text()='展开']")))
-            driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", more)
-            time.sleep(0.5)
-            more.click()
-        except TimeoutException:
-            print('No "展开" button')
-        
-        #get the lyrcis
-        element = driver.find_element(By.ID, "lyric-content")
-        lyrics = element.text
-        song_info['lyrics'] = lyrics
+            #getting the song page and the lyrics (without a browser if possible)
+            response = tool.requests_get(song_info['url'])
+            response.raise_for_status()
+            lyrics = get_lyrics_with_requests(tool, song_id, site_url)
 
-        #store the song
-        INTRO_PATH = f"{SONG_INTRO_PATH}/song{song_id}.json"
-        with open(INTRO_PATH, 'w', encoding='utf-8') as f:
-            json.dump(song_info, f, ensure_ascii=False, sort_keys=False, indent=4)
-        print(f"song{song_id}'s intro is saved")
+            #the page is parsed (and the song stored) while the next songs are fetched
+            parsed = parser.submit(parse_and_save_song, response.text, song_info, lyrics)
+            song_futures.append((song_info, parsed, chain(parsed, partial(store_parsed_song, tool, pool, images))))
+        except Exception as error:
+            state.mark_failed(song_info['url'], repr(error))
+            tool.metrics.count('errors')
+            print(f"song{song_id} failed: {error!r}")
 
-def curl_song_through_artists(tool: RequestsGet, driver: webdriver.Chrome):
+    #a song is done once it is stored with its image
+    stored = []
+    for song_info, parsed, future in song_futures:
+        try:
+            future.result()
+            print(f"song{song_info['id']}'s image saved")
+            state.mark_done(song_info['url'])
+            tool.metrics.page_done('song')
+            #the parsed info (the song_info sent to the parse pool was a copy)
+            stored.append(parsed.result()[0])
+        except Exception as error:
+            state.mark_failed(song_info['url'], repr(error))
+            tool.metrics.count('errors')
+            print(f"song{song_info['id']} failed: {error!r}")
+    return stored
+
+def curl_song_through_artists(tool: RequestsGet, pool: DriverPool, images: ImagePipeline, parser: ParsePool,
+                              state: CrawlState, site_url: str = SITE_URL):
 
     """a function getting songs from known artists.
     
@@ -136,74 +285,192 @@ def curl_song_through_artists(tool: RequestsGet, driver: webdriver.Chrome):
     on that page, this function will retrieve all songs' ids and urls. Then, it will
     store the info locally.
 
+    Only the artists and songs still in the frontier of the crawl state are fetched, so
+    a crawl that stopped resumes from where it stopped.
+
     Args:
         tool (RequestsGet): a tool contains headers and cookies for the get requests
-        driver (webdriver.Chrome): a driver constructed with selenium, which will be
-            used in the function get_songs_info(...)
+        pool (DriverPool): the headless drivers, which will be used in the
+            function get_songs_info(...)
+        images (ImagePipeline): the threads downloading the songs' images
+        parser (ParsePool): the processes parsing the song pages and storing the songs
+        state (CrawlState): the crawl state of the artists and songs
+        site_url (str): the root url of the site, can be pointed to a local stand-in
 
     Returns:
         None
     """
 
-    ARTIST_SONGPAGE_URL = "https://music.163.com/artist"
-    artist_id_list = get_all_artist_ids()
-    for id in artist_id_list:
+    ARTIST_SONGPAGE_URL = f"{site_url}/artist"
+
+    #the artists not in the state yet join the frontier in the order of the hrefs
+    for id in get_all_artist_ids():
+        state.add(f"{ARTIST_SONGPAGE_URL}?id={id}", 'artist')
+
+    for artist_url in state.pending('artist'):
+        _, id = re.split(r'=', artist_url, maxsplit=1)
+        try:
+            #get the artist's songs page
+            response = tool.requests_get(url=ARTIST_SONGPAGE_URL, params={'id': id})
+            response.raise_for_status()
+            with tool.metrics.stage('parse'):
+                song_url_list = parse_song_list(response.text)
+            #get first 25 songs
+            song_url_list = song_url_list[:25]
+
+            #get the id list and stores
+            with tool.metrics.stage('write'):
+                save_artist_song_ids(id, construct_song_id_list(song_url_list))
+        except Exception as error:
+            state.mark_failed(artist_url, repr(error))
+            tool.metrics.count('errors')
+            print(f"artist{id} failed: {error!r}")
+            continue
 
-        #get the artist's songs page
-        response = tool.requests_get(url=ARTIST_SONGPAGE_URL, params={'id': id})
-        response.raise_for_status()
-        song_list_soup = BeautifulSoup(response.text, 'lxml')
-        song_list = song_list_soup.find("ul", class_="f-hide")
-        song_url_list = [song.a['href'] for song in song_list]
-        #get first 25 songs
-        song_url_list = song_url_list[:25]
-
-        #get the id list and stores
-        song_id_list = construct_song_id_list(song_url_list)
-        STORE_PATH = f'{ARTIST_SONG_IDS_PATH}/artist{id}songs.json'
-        with open(STORE_PATH, "w", encoding='utf-8') as f:
-            json.dump(song_id_list, f, sort_keys=False, indent=4)
-        print(f"artist{id}'s songs' ids saved")
-        
         #get and store the songs info
-        get_songs_info(tool, driver, song_url_list)
+        get_songs_info(tool, pool, images, parser, song_url_list, state, site_url)
+        state.mark_done(artist_url)
+        tool.metrics.page_done('artist')
+
+    #the songs left in the frontier (re-queued, or interrupted in an earlier run)
+    song_url_list = [url[len(site_url):] for url in state.pending('song') if url.startswith(site_url)]
+    get_songs_info(tool, pool, images, parser, song_url_list, state, site_url)
+
+def discover_songs(tool: RequestsGet, pool: DriverPool, images: ImagePipeline, parser: ParsePool,
+                   state: CrawlState, site_url: str = SITE_URL, max_depth: int = 1,
+                   max_artists: int | None = None, max_songs: int | None = None, album_page_size: int = 12):
+
+    """a function getting the whole discography of the known artists, and of their co-artists.
+
+    Unlike curl_song_through_artists, the songs are not limited to the artist's songs
+    page: for every artist the pages of its albums are gone through (each page links
+    the next one), and every song of every album is fetched. The artists listed by the
+    songs stored (the co-artists) are added to the crawl, one depth further, until
+    max_depth; their desc pages are also queued for artist_info_curl.
+
+    Every page found is put in the frontier of the crawl state and the crawl goes
+    through the frontier as a stream (see CrawlState.stream), breadth first, so nothing
+    but an album's songs is held in memory whatever the size of the crawl, and an
+    interrupted discovery resumes from its frontier.
+
+    Args:
+        tool (RequestsGet): a tool contains headers and cookies for the get requests
+        pool (DriverPool): the headless drivers, used by get_songs_info(...)
+        images (ImagePipeline): the threads downloading the songs' images
+        parser (ParsePool): the processes parsing the song pages and storing the songs
+        state (CrawlState): the crawl state of the artists, albums and songs
+        site_url (str): the root url of the site, can be pointed to a local stand-in
+        max_depth (int): how many co-artists away from the known artists the crawl goes
+        max_artists (int | None): the most artists in the crawl state (no limit if None)
+        max_songs (int | None): the most songs in the crawl state (no limit if None)
+        album_page_size (int): the number of albums asked for in a page of an artist's albums
+
+    Returns:
+        None
+    """
+
+    ARTIST_SONGPAGE_URL = f"{site_url}/artist"
+
+    #the artists not in the state yet join the frontier in the order of the hrefs
+    for id in get_all_artist_ids():
+        state.add(f"{ARTIST_SONGPAGE_URL}?id={id}", 'artist')
+
+    for url, kind, depth in state.stream(('artist', 'artist albums', 'album')):
+        if max_songs is not None and state.count('song') >= max_songs:
+            print(f"{max_songs} songs reached, the discovery stops")
+            break
+        id = parse_qs(urlsplit(url).query)['id'][0]
+        try:
+            response = tool.requests_get(url)
+            response.raise_for_status()
+            if kind == 'artist':
+                #the artist's songs page (all of it), then the first page of its albums
+                with tool.metrics.stage('parse'):
+                    song_url_list = parse_song_list(response.text)
+                with tool.metrics.stage('write'):
+                    save_artist_song_ids(id, construct_song_id_list(song_url_list))
+                state.add(f"{site_url}/artist/album?id={id}&limit={album_page_size}&offset=0", 'artist albums', depth)
+            elif kind == 'artist albums':
+                #the albums of the page, and the next page
+                with tool.metrics.stage('parse'):
+                    album_url_list, next_url = parse_album_list(response.text)
+                for album_url in album_url_list:
+                    state.add(f"{site_url}{album_url}", 'album', depth)
+                if next_url is not None:
+                    state.add(f"{site_url}{next_url}", 'artist albums', depth)
+            else:
+                with tool.metrics.stage('parse'):
+                    song_url_list = parse_song_list(response.text)
+        except Exception as error:
+            state.mark_failed(url, repr(error))
+            tool.metrics.count('errors')
+            print(f"{kind} {id} failed: {error!r}")
+            continue
+
+        if kind == 'album':
+            if max_songs is not None:
+                song_url_list = song_url_list[:max(0, max_songs - state.count('song'))]
+            songs = get_songs_info(tool, pool, images, parser, song_url_list, state, site_url)
+            #the co-artists of the album's songs join the crawl one depth further
+            if depth < max_depth:
+                for song in songs:
+                    for artist_id in song['artist id list']:
+                        if max_artists is not None and state.count('artist') >= max_artists:
+                            break
+                        if state.add(f"{ARTIST_SONGPAGE_URL}?id={artist_id}", 'artist', depth + 1):
+                            state.add(f"{site_url}/artist/desc?id={artist_id}", 'artist desc', depth + 1)
+                            tool.metrics.count('artists discovered')
+        state.mark_done(url)
+        tool.metrics.page_done(kind)
+
+    #the songs left in the frontier (re-queued, or interrupted in an earlier run)
+    song_url_list = [url[len(site_url):] for url in state.pending('song') if url.startswith(site_url)]
+    get_songs_info(tool, pool, images, parser, song_url_list, state, site_url)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="crawl the songs of the known artists")
+    parser.add_argument('--drivers', type=int, default=2, help="number of headless drivers")
+    parser.add_argument('--recycle-after', type=int, default=100, help="pages loaded before a driver is replaced")
+    parser.add_argument('--fixed-sleeps', action='store_true', help="sleep before clicking instead of explicit waits")
+    parser.add_argument('--image-workers', type=int, default=8, help="number of threads downloading the images")
+    parser.add_argument('--parse-workers', type=int, default=None, help="processes parsing the pages (0: no process)")
+    parser.add_argument('--parse-queue', type=int, default=None, help="most fetched pages waiting to be parsed")
+    parser.add_argument('--requeue-failed', action='store_true', help="try the failed artists and songs again")
+    parser.add_argument('--max-retries', type=int, default=None, help="don't re-queue urls that failed this often")
+    parser.add_argument('--no-cache', action='store_true', help="don't use the http cache")
+    parser.add_argument('--offline', action='store_true', help="parse every cached page again without the network")
+    parser.add_argument('--site-url', default=SITE_URL, help="root url of the site (or a local stand-in)")
+    parser.add_argument('--discover', action='store_true', help="crawl the artists' albums and their co-artists")
+    parser.add_argument('--max-depth', type=int, default=1, help="co-artists away from the known artists (with --discover)")
+    parser.add_argument('--max-artists', type=int, default=None, help="most artists crawled (with --discover)")
+    parser.add_argument('--max-songs', type=int, default=None, help="most songs crawled (with --discover)")
+    parser.add_argument('--rate', type=float, default=2.0, help="requests per second on each host at the start")
+    parser.add_argument('--max-rate', type=float, default=20.0, help="most requests per second on each host")
+    parser.add_argument('--progress', action='store_true', help="show a live progress line")
+    parser.add_argument('--report', default=None, help="path of the json report (default: under saved_info/crawl_reports)")
+    args = parser.parse_args()
+
     #prepare for requests
-    tool = RequestsGet(
-        headers = {
-            "referer": "https://music.163.com/",
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
-        }, 
-        cookies = {
-            "_iuqxldmzr_": "32",
-            "*ntes*nnid": "66528d90a67b40f5083977b2aa13f1fb,1750984768492",
-            "*ntes*nuid": "66528d90a67b40f5083977b2aa13f1fb",
-            "WEVNSM": "1.0.0",
-            "WNMCID": "wvtjxf.1750984768861.01.0",
-            "NMTID": "00O7aLHpTbFcg_iC0nCm7NyqWczpIYAAAGXrtM58g",
-            "sDeviceId": "YD-l%2B6BoGmhqc1AF1EQQQaTPoj4t09g4aiS",
-            "ntes_utid": "tid._.mMP9FniabwxEBkRRUBeDP9jt8x8ksbiW._.0",
-            "WM_TID": "%2BYEnlCDbZ1xFVUQQQQOCOoi8p04hzMbF",
-            "**snaker**id": "CpNqIxmBogQLpWV9",
-            "gdxidpyhxdE": "oC5cpwv7PdGK%5CrmjJB8pisHZ9m1bBCR4w4gVu%5C3l%5CdaVIcn1L9PMEOTPvc2C8cMYGtX4%2BX3N43UcZQ%2FC5xOL2zmMWV4Avj84tVTrpcwfbjN%2BLY31po577AjeOjXkfxxdf9fUWC9iWY1Ko9l9AVy3zsovRIhtL%2BVVzbY9dl0EYqvKTeab%3A1750985729881",
-            "__csrf": "dd241c7029354383215c754cbca3fbbc",
-            "MUSIC_U": "00C3F1F27B7227B3ADC8357A5221494AD43A2E473D70140C67E44C374292212270FD60D72117FF1C8D04F475CFC613AF28264AF280B916F00CA8541633CD8FF0DCA322F55A7545CBE45807FB36FABC2D8C9765E4835C0E517CC51EBA66B07B63B88377B4AB73DEA1792995652DEFDFA3A100511F345AFB8948D4847DCFE5063CAEF379ECC1C3EB07DD3EE103BC7F385C3BB0C1D4B47F8CFF3C0B8E1BFE0260AFC372679E42AA7A852234A6BC65C4309550185473C79DE4ADF8AA60605B73674309FA299BF95F163D527B4EB504389D48829AD480E1BD63652CF1EDA146C77FDADE91A513C8719F7E00FAAFD93519D6437CB0C52E7B519F95698A5FA5C7E5E4B32968C75C52F20F06B46D80ED1E25A0B02F56837B26D608822215B2C8A34A946CAB151832BA86D2F3B32BD196A4FCA46D1D9044C74CF5D9823C1098DB7EB73AC2ADED8A88FFACC861B2981645C2EF743FBE6747205EE9A20619C0AA1B44AD6C92C185DAB10053BD76255C9312E6D7D02B58",
-            "__remember_me": "true",
-            "P_INFO": "15652144978|1750984965|1|music|00&99|null&null&null#bej&null#10#0|&0||15652144978",
-            "ntes_kaola_ad": "1",
-            "JSESSIONID-WYYY": "XS7a6BigwtwhR0RhteE%2FVuxgGr1HyDUHnZATC8pH37RU6I1Su8sOXsrf33Adk7Y0bRTtjhcwtdZ%5CyG%2FcTdFoOxy%2Fza0JOFnsAfob3Hjw2hRx%2B4xyCW4iEZfzGfxAh3uIsoO%2BW0gKEiAru2uFdm6FBpKdwuniVD9ZYB%2BGd23DDpqXqoys%3A1751068190136",
-            "WM_NI": "KaKg7wE4tYc7KsLvnkUbjDC0vBlN%2Bry9DP3%2B7O0osQKBQpX4wLoOA4r%2Bu%2BN9BICLyFdBTj0E1A%2BzViLHOjv9tEeD6WdfzVAunXOGebIELB2OeNdVX%2FHlzun8oRseYNnBQXU%3D",
-            "WM_NIKE": "9ca17ae2e6ffcda170e2e6eed4b16f8c95fb96c54aae9a8fb7c44f829e9ab1d66af7b0aa8eeb4990ae009bd62af0fea7c3b92a89bf8588b67d87ecbcbae23d89ad8497ed6197bea6a5c23cb69ea4afaa7abbe78cb1b221f5910090f25b899e9f91db40b594a1b0c440b2f5bbcccd3382978dadfc4ea89e9c8bb34ff39fe59bd5639098818bf533b89baba5b55da8bab6b7c47fae8881a8e86a8b9b84a3b145a792acb7db258cb4b696ed34ad8ebd86dc46ae9e9fb9d837e2a3"
-        }
-    )
-    
-    #prepare selenium driver without screen
-    chrome_options = Options()
-    chrome_options.add_argument('--headless')
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--enable-javascript')
-    driver = webdriver.Chrome(options=chrome_options)
-
-    curl_song_through_artists(tool, driver)
-    driver.quit()
+    cache = None if args.no_cache else HttpCache(offline=args.offline)
+    metrics = CrawlMetrics('song_curl', progress=args.progress)
+    rate = RateController(initial_rate=args.rate, max_rate=args.max_rate, metrics=metrics)
+    tool = RequestsGet(headers=HEADERS, cookies=COOKIES, cache=cache, metrics=metrics, rate=rate)
+    # an offline run goes through all the songs again, so it has its own (temporary) state
+    state = CrawlState(':memory:') if args.offline else CrawlState()
+    if args.requeue_failed:
+        print(f"{state.requeue_failed(max_retries=args.max_retries)} failed urls re-queued")
+
+    #prepare the selenium drivers without screen (only started if a song needs them)
+    with DriverPool(args.drivers, args.recycle_after, explicit_waits=not args.fixed_sleeps,
+                    metrics=metrics) as pool, \
+            ImagePipeline(tool, workers=args.image_workers) as images, \
+            ParsePool(args.parse_workers, args.parse_queue) as parse_pool:
+        if args.discover:
+            discover_songs(
+                tool, pool, images, parse_pool, state, args.site_url, args.max_depth, args.max_artists, args.max_songs
+            )
+        else:
+            curl_song_through_artists(tool, pool, images, parse_pool, state, args.site_url)
+    tool.report_latency()
+    print(state.counts())
+    print(f"report written to {metrics.write_report(args.report)}")
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class SongConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'song'
+
+    def ready(self) -> None:
+
+        """use the token cache, and keep the inverted index up to date as the songs and artists change"""
+
+        from django.conf import settings
+        from song.indexing import connect_signals
+        from song.token_cache import configure
+        configure(
+            getattr(settings, 'SONG_TOKEN_CACHE', None), getattr(settings, 'SONG_TOKEN_CACHE_BYTES', 256 * 1024 * 1024)
+        )
+        connect_signals()
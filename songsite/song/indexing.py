@@ -0,0 +1,551 @@
+"""the incremental maintenance of the inverted index, as the songs and artists change.
+
+construct_inverted_index builds the whole index. After it, update_index(...) keeps the
+index of the documents given up to date: the tokens of each document now (see
+tokenize.py) are compared to its postings in the index, and only the postings gone,
+changed and new are written, with the df of their segments (a segment no document has
+any more is deleted). The postings are rows or blobs, as the index is stored (see
+postings.py); with blobs, the segments of each document are kept (see SongDocument), so
+only the blobs of the segments the documents had or have are read.
+
+The saves and deletes of songs and artists (and the changes of the songs' artists) are
+caught by signals (see connect_signals) and put in the IndexQueue, once their
+transaction is committed. A thread of the queue indexes them in batches, a moment after
+they come, so a burst of saves is indexed at once. The commands hold the queue (see
+IndexQueue.held): what they change is indexed in batches at their end, in their thread.
+The loader also gives the queue the documents whose links it changed with bulk queries,
+which send no signal. A batch the thread fails to index is tried again, and after
+MAX_ATTEMPTS its documents are written to a changes file for construct_inverted_index
+--changes (settings.SONG_INDEX_FAILED, see record_failed).
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterable, Iterator
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from song.models import Song, Artist, SongSegment, SongIndex, SongDocument, ArtistSegment, ArtistIndex, ArtistDocument
+from song.postings import decode_postings, encode_postings, stored_in
+from song.token_cache import get_cache
+from song.tokenize import artist_document, segments_in_document, song_document, term_frequencies
+
+logger = logging.getLogger(__name__)
+
+# the documents indexed in a batch, and the seconds the queue waits for more before indexing
+BATCH_SIZE = 500
+DELAY = 1.0
+# the most parameters of a query
+CHUNK = 500
+# the times the queue's thread tries to index a document before it is recorded as failed
+MAX_ATTEMPTS = 3
+
+# the models of the index of each kind of documents: the segments, the postings and their foreign key
+MODELS = {
+    'song': (SongSegment, SongIndex, 'song_segment'),
+    'artist': (ArtistSegment, ArtistIndex, 'artist_segment'),
+}
+# the models of the segments of each document, when the index is stored in blobs
+DOCUMENT_MODELS = {'song': SongDocument, 'artist': ArtistDocument}
+
+def chunks(items: Iterable, size: int = CHUNK) -> Iterator[list]:
+
+    """the items, size at a time"""
+
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+def indexed_documents(kind: str, ids: list[int], collapse_duplicates: bool) -> dict[int, dict[str, int]]:
+
+    """the term frequencies of the documents of the ids that are in the index now
+
+    The songs are all indexed (but the near duplicates if collapse_duplicates), the
+    artists only if they are complete (as in construct_inverted_index).
+    """
+
+    if kind == 'song':
+        objects = Song.objects.filter(id__in=ids).prefetch_related('artist')
+        if collapse_duplicates:
+            objects = objects.filter(lyrics_group__isnull=True)
+        documents = map(song_document, objects)
+    else:
+        documents = map(artist_document, Artist.objects.filter(id__in=ids, original_url__isnull=False))
+    tfs = {doc_id: term_frequencies(segments_in_document(strings)) for doc_id, strings in documents}
+    # the tokens of the new texts are kept for the next rebuild
+    if get_cache() is not None:
+        get_cache().flush()
+    return tfs
+
+def update_index(kind: str, ids: Iterable[int], collapse_duplicates: bool | None = None) -> dict[str, int]:
+
+    """update the index of the documents of the ids (deleted or not indexed documents are removed)
+
+    The postings are updated in the storage the index has (see postings.stored_in).
+
+    Args:
+        kind (str): the kind of the documents ('song' or 'artist')
+        ids (Iterable[int]): the ids of the documents
+        collapse_duplicates (bool | None):
+            whether the near duplicate songs are left out of the index,
+            settings.SONG_INDEX_COLLAPSE_DUPLICATES if None
+
+    Returns:
+        counts (dict[str, int]): the documents, and the postings and segments added, changed and deleted
+    """
+
+    if collapse_duplicates is None:
+        collapse_duplicates = getattr(settings, 'SONG_INDEX_COLLAPSE_DUPLICATES', False)
+    ids = sorted(set(ids))
+    with transaction.atomic():
+        new: dict[int, dict[str, int]] = {}
+        for chunk in chunks(ids):
+            new.update(indexed_documents(kind, chunk, collapse_duplicates))
+        if stored_in(*MODELS[kind][:2]) == 'blobs':
+            counts = update_blobs(kind, ids, new)
+        else:
+            counts = update_rows(kind, ids, new)
+    return dict(counts, documents=len(ids))
+
+def update_rows(kind: str, ids: list[int], new: dict[int, dict[str, int]]) -> dict[str, int]:
+
+    """update the postings rows of the documents to their term frequencies now (in a transaction)
+
+    Args:
+        kind (str): the kind of the documents ('song' or 'artist')
+        ids (list[int]): the ids of the documents
+        new (dict[int, dict[str, int]]): the term frequencies of the documents indexed now
+
+    Returns:
+        counts (dict[str, int]): the postings and segments added, changed and deleted
+    """
+
+    segment_model, index_model, segment_field = MODELS[kind]
+    # the postings of the documents in the index: their id and tf, by document and token
+    old: dict[int, dict[str, tuple[int, int]]] = {}
+    for chunk in chunks(ids):
+        rows = index_model.objects.filter(article_id__in=chunk).values_list(
+            'id', 'article_id', f"{segment_field}__token", 'tf'
+        )
+        for posting_id, doc_id, segment, tf in rows:
+            old.setdefault(doc_id, {})[segment] = (posting_id, tf)
+
+    # what changes: the df of the segments, and the postings
+    df_changes: Counter = Counter()
+    gone_postings: list[int] = []
+    changed_postings: list = []
+    new_postings: list[tuple[str, int, int]] = []
+    for doc_id in ids:
+        old_tfs, new_tfs = old.get(doc_id, {}), new.get(doc_id, {})
+        for segment, (posting_id, tf) in old_tfs.items():
+            if segment not in new_tfs:
+                gone_postings.append(posting_id)
+                df_changes[segment] -= 1
+            elif new_tfs[segment] != tf:
+                changed_postings.append(index_model(id=posting_id, tf=new_tfs[segment]))
+        for segment, tf in new_tfs.items():
+            if segment not in old_tfs:
+                new_postings.append((segment, doc_id, tf))
+                df_changes[segment] += 1
+
+    # the segments: the df changed, the new ones created, the ones without document deleted
+    segments: dict[str, object] = {}
+    for chunk in chunks(segment for segment, change in df_changes.items() if change):
+        segments.update((segment.token, segment) for segment in segment_model.objects.filter(token__in=chunk))
+    created, updated, emptied = [], [], []
+    for segment, change in df_changes.items():
+        if not change:
+            continue
+        if segment not in segments:
+            created.append(segment_model(token=segment, df=change))
+            continue
+        segments[segment].df += change
+        (updated if segments[segment].df > 0 else emptied).append(segments[segment])
+    for chunk in chunks(gone_postings):
+        index_model.objects.filter(id__in=chunk).delete()
+    for chunk in chunks(emptied):
+        segment_model.objects.filter(id__in=[segment.id for segment in chunk]).delete()
+    segment_model.objects.bulk_update(updated, ['df'], batch_size=CHUNK)
+    segment_model.objects.bulk_create(created, batch_size=CHUNK)
+    for chunk in chunks({segment for segment, _, _ in new_postings} - set(segments)):
+        segments.update((segment.token, segment) for segment in segment_model.objects.filter(token__in=chunk))
+
+    # the postings
+    index_model.objects.bulk_update(changed_postings, ['tf'], batch_size=CHUNK)
+    index_model.objects.bulk_create([
+        index_model(article_id=doc_id, tf=tf, **{f"{segment_field}_id": segments[segment].id})
+        for segment, doc_id, tf in new_postings
+    ], batch_size=CHUNK)
+    return {
+        'postings added': len(new_postings), 'postings changed': len(changed_postings),
+        'postings deleted': len(gone_postings), 'segments added': len(created), 'segments deleted': len(emptied),
+    }
+
+def update_blobs(kind: str, ids: list[int], new: dict[int, dict[str, int]]) -> dict[str, int]:
+
+    """update the posting blobs of the segments to the term frequencies of the documents now (in a transaction)
+
+    Only the blobs of the segments the documents had (kept with them, see SongDocument) and
+    of the tokens they have now are read, and the ones that change written again, with
+    the segments of the documents.
+
+    Args: see update_rows(...)
+
+    Returns: see update_rows(...)
+    """
+
+    segment_model, document_model = MODELS[kind][0], DOCUMENT_MODELS[kind]
+    documents = set(ids)
+    # the documents and tfs of each token of the documents now
+    new_postings: dict[str, dict[int, int]] = {}
+    for doc_id, tfs in new.items():
+        for segment, tf in tfs.items():
+            new_postings.setdefault(segment, {})[doc_id] = tf
+
+    # the segments of the documents in the index, and the ones of their tokens now
+    kept: dict[int, int] = {}
+    old_segment_ids: set[int] = set()
+    for chunk in chunks(ids):
+        rows = document_model.objects.filter(article_id__in=chunk).values_list('id', 'article_id', 'segments')
+        for document_id, doc_id, segments in rows:
+            kept[doc_id] = document_id
+            old_segment_ids.update(decode_postings(segments)[0])
+    blobs: dict[str, tuple[int, bytes]] = {}
+    for chunk in chunks(old_segment_ids):
+        blobs.update(
+            (segment, (segment_id, blob)) for segment_id, segment, blob in
+            segment_model.objects.filter(id__in=chunk).values_list('id', 'token', 'postings')
+        )
+    for chunk in chunks(new_postings.keys() - blobs.keys()):
+        blobs.update(
+            (segment, (segment_id, blob)) for segment_id, segment, blob in
+            segment_model.objects.filter(token__in=chunk).values_list('id', 'token', 'postings')
+        )
+
+    counts = Counter({key: 0 for key in (
+        'postings added', 'postings changed', 'postings deleted', 'segments added', 'segments deleted'
+    )})
+    segment_ids: dict[str, int] = {}
+    updated, emptied = [], []
+    for segment, (segment_id, blob) in blobs.items():
+        segment_ids[segment] = segment_id
+        added = new_postings.pop(segment, {})
+        postings = dict(zip(*decode_postings(blob)))
+        old = {doc_id: postings.pop(doc_id) for doc_id in documents.intersection(postings)}
+        counts['postings deleted'] += len(old.keys() - added.keys())
+        counts['postings added'] += len(added.keys() - old.keys())
+        counts['postings changed'] += sum(1 for doc_id in added.keys() & old.keys() if added[doc_id] != old[doc_id])
+        if old == added:
+            continue
+        postings.update(added)
+        if postings:
+            updated.append(segment_model(id=segment_id, df=len(postings), postings=encode_postings(postings.items())))
+        else:
+            emptied.append(segment_id)
+    for chunk in chunks(emptied):
+        segment_model.objects.filter(id__in=chunk).delete()
+    segment_model.objects.bulk_update(updated, ['df', 'postings'], batch_size=CHUNK)
+    # the tokens no segment has yet
+    segment_model.objects.bulk_create([
+        segment_model(token=segment, df=len(postings), postings=encode_postings(postings.items()))
+        for segment, postings in new_postings.items()
+    ], batch_size=CHUNK)
+    for chunk in chunks(new_postings):
+        segment_ids.update(segment_model.objects.filter(token__in=chunk).values_list('token', 'id'))
+    counts['postings added'] += sum(len(postings) for postings in new_postings.values())
+    counts['segments added'] = len(new_postings)
+    counts['segments deleted'] = len(emptied)
+
+    # the segments of the documents: written again, or deleted with the documents not indexed any more
+    gone = [document_id for doc_id, document_id in kept.items() if not new.get(doc_id)]
+    for chunk in chunks(gone):
+        document_model.objects.filter(id__in=chunk).delete()
+    changed, created = [], []
+    for doc_id, tfs in new.items():
+        if not tfs:
+            continue
+        segments = encode_postings((segment_ids[segment], tf) for segment, tf in tfs.items())
+        if doc_id in kept:
+            changed.append(document_model(id=kept[doc_id], segments=segments))
+        else:
+            created.append(document_model(article_id=doc_id, segments=segments))
+    document_model.objects.bulk_update(changed, ['segments'], batch_size=CHUNK)
+    document_model.objects.bulk_create(created, batch_size=CHUNK)
+    return dict(counts)
+
+def update_changes(changes: dict, collapse_duplicates: bool | None = None) -> dict[str, dict[str, int]]:
+
+    """update the index of the documents of a changes file of load_songs_artists --incremental
+
+    Returns:
+        counts (dict[str, dict[str, int]]): what update_index gives, for the songs and the artists
+    """
+
+    return {
+        kind: update_index(kind, [*changes[f"{kind}s"]['changed'], *changes[f"{kind}s"]['deleted']], collapse_duplicates)
+        for kind in MODELS
+    }
+
+# serializes the writes of the changes file of the documents not indexed
+_failed_lock = threading.Lock()
+
+def record_failed(kind: str, ids: Iterable[int]) -> str:
+
+    """add documents the queue failed to index to the changes file of settings.SONG_INDEX_FAILED
+
+    The file has the format of the changes files of load_songs_artists --incremental, so
+    construct_inverted_index --changes indexes them again.
+
+    Returns:
+        path (str): the changes file
+    """
+
+    path = str(getattr(settings, 'SONG_INDEX_FAILED', settings.BASE_DIR / 'index_failed.json'))
+    with _failed_lock:
+        changes = {f"{other}s": {'changed': [], 'deleted': []} for other in MODELS}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                changes.update(json.load(f))
+        changes[f"{kind}s"]['changed'] = sorted(set(changes[f"{kind}s"]['changed']) | set(ids))
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(changes, f, indent=4)
+        os.replace(f"{path}.tmp", path)
+    return path
+
+class IndexQueue:
+
+    """the documents waiting to be indexed, indexed in batches by a thread
+
+    Attributes:
+        batch_size (int): the most documents of a kind indexed at once
+        delay (float): the seconds waited for more documents before indexing
+        pending (dict[str, set[int]]): the ids of the documents waiting, by kind
+        attempts (dict[str, dict[int, int]]): the failed attempts of the documents waiting again, by kind
+        holds (int): the number of held(...) blocks the queue is in, the thread waits while it is held
+        condition (threading.Condition): guards pending and holds, wakes the thread
+        indexing (threading.Lock): taken while a batch is indexed
+        thread (threading.Thread | None): the thread indexing, started with the first documents
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, delay: float = DELAY):
+
+        """make an empty queue, its thread starts with the first documents"""
+
+        self.batch_size = batch_size
+        self.delay = delay
+        self.pending = {kind: set() for kind in MODELS}
+        self.attempts = {kind: {} for kind in MODELS}
+        self.holds = 0
+        self.condition = threading.Condition()
+        self.indexing = threading.Lock()
+        self.thread = None
+
+    def put(self, kind: str, ids: Iterable[int]) -> None:
+
+        """add documents to index, now or once their transaction is committed"""
+
+        ids = set(ids)
+        if ids:
+            transaction.on_commit(lambda: self.add(kind, ids))
+
+    def add(self, kind: str, ids: set[int]) -> None:
+
+        """add documents to index, and wake the thread"""
+
+        with self.condition:
+            self.pending[kind].update(ids)
+            if self.holds:
+                return
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="index-queue", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def take(self) -> tuple[str, list[int]] | None:
+
+        """take a batch of the documents waiting (hold the condition)"""
+
+        for kind, ids in self.pending.items():
+            if ids:
+                batch = [ids.pop() for _ in range(min(self.batch_size, len(ids)))]
+                return kind, batch
+        return None
+
+    def flush(self) -> dict[str, int]:
+
+        """index all the documents waiting, in this thread (a batch that fails is recorded, see record_failed)
+
+        Returns:
+            counts (dict[str, int]): the documents and postings indexed (see update_index)
+        """
+
+        counts: Counter = Counter()
+        with self.indexing:
+            while True:
+                with self.condition:
+                    batch = self.take()
+                if batch is None:
+                    return dict(counts)
+                try:
+                    counts.update(update_index(*batch))
+                except Exception:
+                    # its documents are left to construct_inverted_index --changes
+                    record_failed(*batch)
+                    raise
+
+    def retry(self, kind: str, ids: list[int]) -> None:
+
+        """put the documents of a batch that failed back in the queue, or record them after MAX_ATTEMPTS"""
+
+        given_up = []
+        with self.condition:
+            for id in ids:
+                attempts = self.attempts[kind].get(id, 0) + 1
+                if attempts < MAX_ATTEMPTS:
+                    self.attempts[kind][id] = attempts
+                    self.pending[kind].add(id)
+                else:
+                    self.attempts[kind].pop(id, None)
+                    given_up.append(id)
+        if given_up:
+            path = record_failed(kind, given_up)
+            logger.error(
+                "the %ss %s were not indexed after %d attempts, run construct_inverted_index --changes %s",
+                kind, given_up, MAX_ATTEMPTS, path
+            )
+
+    def clear(self) -> None:
+
+        """forget the documents waiting"""
+
+        with self.condition:
+            for ids in self.pending.values():
+                ids.clear()
+
+    @contextmanager
+    def held(self, flush: bool = True):
+
+        """while in the block the thread leaves the documents waiting, at its end they are indexed
+
+        Args:
+            flush (bool): index the documents waiting at the end of the block, else forget them
+        """
+
+        with self.condition:
+            self.holds += 1
+        try:
+            yield self
+        finally:
+            with self.condition:
+                self.holds -= 1
+                released = self.holds == 0
+            if released:
+                if flush:
+                    self.flush()
+                else:
+                    self.clear()
+
+    def run(self) -> None:
+
+        """index the documents as they come, a batch at a time (the thread's loop)"""
+
+        while True:
+            with self.condition:
+                while self.holds or not any(self.pending.values()):
+                    self.condition.wait()
+            # the documents saved together are indexed together (and the failed ones tried again a delay later)
+            time.sleep(self.delay)
+            failed = []
+            try:
+                with self.indexing:
+                    while not self.holds:
+                        with self.condition:
+                            batch = self.take()
+                        if batch is None:
+                            break
+                        try:
+                            update_index(*batch)
+                        except Exception:
+                            logger.exception("indexing the %ss %s failed", *batch)
+                            failed.append(batch)
+                            continue
+                        with self.condition:
+                            for id in batch[1]:
+                                self.attempts[batch[0]].pop(id, None)
+            finally:
+                # the thread's connections, the next batch may come much later
+                connections.close_all()
+                for batch in failed:
+                    self.retry(*batch)
+
+# the queue of the process
+index_queue = IndexQueue()
+# what is waiting when the process ends is indexed
+atexit.register(index_queue.flush)
+
+def song_saved(sender, instance: Song, **kwargs) -> None:
+
+    """index the song saved"""
+
+    index_queue.put('song', [instance.id])
+
+def artist_saved(sender, instance: Artist, created: bool, **kwargs) -> None:
+
+    """index the artist saved, and its songs (its name is in their documents)"""
+
+    index_queue.put('artist', [instance.id])
+    if not created:
+        index_queue.put('song', instance.song_set.values_list('id', flat=True))
+
+def song_deleted(sender, instance: Song, **kwargs) -> None:
+
+    """remove the song deleted from the index"""
+
+    index_queue.put('song', [instance.id])
+
+def artist_deleting(sender, instance: Artist, **kwargs) -> None:
+
+    """remember the songs of the artist deleted, they are indexed again without it"""
+
+    instance._index_song_ids = list(instance.song_set.values_list('id', flat=True))
+
+def artist_deleted(sender, instance: Artist, **kwargs) -> None:
+
+    """remove the artist deleted from the index, and index its songs again"""
+
+    index_queue.put('artist', [instance.id])
+    index_queue.put('song', getattr(instance, '_index_song_ids', ()))
+
+def song_artists_changed(sender, instance, action: str, reverse: bool, pk_set: set | None, **kwargs) -> None:
+
+    """index the songs whose artists changed"""
+
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        # the artists of a song changed
+        if action != 'pre_clear':
+            index_queue.put('song', [instance.id])
+    elif action == 'pre_clear':
+        # the songs of an artist are all removed, they are only known before
+        index_queue.put('song', instance.song_set.values_list('id', flat=True))
+    elif action != 'post_clear':
+        index_queue.put('song', pk_set or ())
+
+def connect_signals() -> None:
+
+    """put the songs and artists saved and deleted in the index queue (see SongConfig.ready)"""
+
+    post_save.connect(song_saved, sender=Song, dispatch_uid='index_song_saved')
+    post_save.connect(artist_saved, sender=Artist, dispatch_uid='index_artist_saved')
+    post_delete.connect(song_deleted, sender=Song, dispatch_uid='index_song_deleted')
+    pre_delete.connect(artist_deleting, sender=Artist, dispatch_uid='index_artist_deleting')
+    post_delete.connect(artist_deleted, sender=Artist, dispatch_uid='index_artist_deleted')
+    m2m_changed.connect(song_artists_changed, sender=Song.artist.through, dispatch_uid='index_song_artists')
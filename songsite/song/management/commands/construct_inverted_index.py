@@ -1,11 +1,34 @@
-from typing import Any
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Iterable, Iterator
 from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from song.indexing import DOCUMENT_MODELS, update_changes
 from song.models import Song, Artist, SongSegment, SongIndex, ArtistSegment, ArtistIndex
-import jieba
+from song.postings import STORAGES, encode_postings, index_storage
+from song.token_cache import get_cache
+from song.tokenize import Document, Postings, artist_document, init_worker, song_document, tokenize_documents, worker_settings
+import json
+import time
+
+# the documents tokenized by a task of the pool
+DOCUMENTS_PER_TASK = 200
 
 class Command(BaseCommand):
 
-    """This command is for building the inverted index for the search/check function"""
+    """This command is for building the inverted index for the search/check function
+
+    The documents are tokenized in a pool of processes (see song/tokenize.py), and the
+    postings (the documents and term frequencies of each token) of the tasks are merged
+    in memory, then the index is rebuilt with bulk inserts: the segments, then the
+    postings, in one transaction for the songs and one for the artists, so the search
+    sees the old index until the new one is complete. The postings are rows, or a blob
+    in each segment with --storage blobs (see song/postings.py), with the segments of
+    each document for the indexer (see SongDocument). With --changes, only
+    the documents of a changes file of load_songs_artists --incremental are indexed
+    again (see song/indexing.py).
+    """
 
     def add_arguments(self, parser: CommandParser) -> None:
 
@@ -15,172 +38,220 @@ class Command(BaseCommand):
         parser.add_argument(
             '--clear',
             action="store_true",
-            help="clear all existing indexes"
+            help="clear all existing indexes (the build always replaces them)"
         )
 
-    def handle(self, *args: Any, **options: Any) -> None:
+        # an argument for indexing one song of each group of near duplicates (see near_dup.py)
+        parser.add_argument(
+            '--collapse_duplicates',
+            action="store_true",
+            help="don't index the songs whose lyrics are near duplicates of another song's"
+        )
 
-        """the main function of this command"""
+        # rows inserted per query
+        parser.add_argument(
+            '--batch_size',
+            type=int,
+            default=5000,
+            help="segments or postings inserted per query"
+        )
 
-        if options['clear']:
-            self.stdout.write('clearing existing indexes')
-            SongSegment.objects.all().delete()
-            ArtistSegment.objects.all().delete()
-        self.create_song_segments()
-        self.create_artist_segments()
-        
-    def create_song_segments(self):
+        # update the index of the documents of a changes file instead of rebuilding it
+        parser.add_argument(
+            '--changes',
+            type=str,
+            default=None,
+            help="json file of the changed and deleted documents' ids of load_songs_artists --incremental"
+        )
 
-        """creating index for song docs"""
+        # how the postings are stored
+        parser.add_argument(
+            '--storage',
+            choices=STORAGES,
+            default=None,
+            help="store the postings in rows or in a compressed blob per segment (default: settings.SONG_INDEX_STORAGE)"
+        )
 
-        songs = Song.objects.all()
-        for song in songs:
-            # extract all segments from the song, and put them in a dict where the key is
-            # the token and the item is the number of appearance
-            song_segments = self.segments_in_song(song)
-            song_segments_info = self.analyze_segments(song_segments)
-            for segment in song_segments_info:
-                # if the segment index has not been created, create a new one; if
-                # it's been created, add its df value.
-                seg_obj, created = SongSegment.objects.get_or_create(
-                    token=segment,
-                    defaults={'df': 1}
-                )
-                if created:
-                    self.stdout.write(f"new song segment {segment} created")
-                else:
-                    self.stdout.write(f"adding df for song segment {segment}")
-                    seg_obj.df += 1
-                    seg_obj.save()
+        # the processes tokenizing the documents
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help="processes tokenizing the documents (default: one per core, 0: tokenize in this process)"
+        )
 
-                #adding the doc index for this segment
-                seg_obj.songindex_set.create(article_id=song.id, tf=song_segments_info[segment])
+    def handle(self, *args: Any, **options: Any) -> None:
 
-    def segments_in_song(self, song: Song) -> list[str]:
+        """the main function of this command"""
 
-        """extracting a list of tokens from a song.
-        
-        This function extracts a list of tokens from a song object, including from its
-        name, alias, lyrics, and artists about it.
+        self.batch_size = options['batch_size']
+        self.storage = options['storage'] or index_storage()
+        if options['changes'] is not None:
+            self.update_changes(options['changes'], options['collapse_duplicates'] or None)
+            return
+        if options['clear']:
+            self.stdout.write('clearing existing indexes')
+        # the processes tokenizing the documents, each loads jieba's dictionary once and uses the token cache
+        self.pool = ProcessPoolExecutor(options['workers'], initializer=init_worker, initargs=worker_settings()) \
+            if options['workers'] != 0 else None
+        self.window = 2 * (self.pool._max_workers if self.pool is not None else 1)
+        try:
+            self.create_song_segments(options['collapse_duplicates'])
+            self.create_artist_segments()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+
+    def update_changes(self, changes_path: str, collapse_duplicates: bool | None) -> None:
+
+        """update the index of the documents changed and deleted in the changes file
+
+        The near duplicate songs are left out if collapse_duplicates, or as
+        settings.SONG_INDEX_COLLAPSE_DUPLICATES says if it is None.
+        """
 
-        Args:
-            song (Song): the song that will be analyzed
+        start = time.perf_counter()
+        with open(changes_path, 'r', encoding='utf-8') as f:
+            changes = json.load(f)
+        for kind, counts in update_changes(changes, collapse_duplicates).items():
+            self.stdout.write(
+                f"{kind} index: {counts['documents']} documents updated, {counts['postings added']} postings added, "
+                f"{counts['postings changed']} changed and {counts['postings deleted']} deleted, "
+                f"{counts['segments added']} segments added and {counts['segments deleted']} deleted"
+            )
+        self.stdout.write(f"updated in {time.perf_counter() - start:.2f}s")
 
-        Returns:
-            segments (list[str]): the list of tokens extracted
-        """
+    def create_song_segments(self, collapse_duplicates: bool = False):
 
-        segments = []
-        segments.extend(self.segments_in_str(song.name))
-        if song.alias is not None:
-            segments.extend(self.segments_in_str(song.alias))
-        segments.extend(self.segments_in_str(song.lyrics))
-        for artist in song.artist.all():
-            segments.extend(self.segments_in_str(artist.name))
-        return segments
+        """creating index for song docs (only the first song of each lyrics if collapse_duplicates)"""
 
-    def segments_in_str(self, in_str: str) -> list[str]:
+        songs = Song.objects.all()
+        if collapse_duplicates:
+            songs = songs.filter(lyrics_group__isnull=True)
+        # the artists of a chunk of songs in one query, instead of a query per song
+        songs = songs.prefetch_related('artist').iterator(chunk_size=2000)
+        self.build_index('song', SongSegment, SongIndex, 'song_segment', map(song_document, songs))
+
+    def build_index(self, kind: str, segment_model, index_model, segment_field: str,
+                    documents: Iterable[Document]) -> None:
 
-        """extract tokens from a string.
-        
-        This function extract tokens (except the too common onse) from the input string.
+        """replace the inverted index of a kind of documents
 
         Args:
-            in_str (str): the input string
-        
-        Returns:
-            tokens/segments_list (list[str]): the list of tokens
+            kind (str): the kind of the documents ('song' or 'artist'), for the report
+            segment_model (class): the model of the tokens (SongSegment or ArtistSegment)
+            index_model (class): the model of the postings (SongIndex or ArtistIndex)
+            segment_field (str): the foreign key of the postings to their token
+            documents (Iterable[Document]): the id and strings of each document (see song/tokenize.py)
         """
 
-        seg_list = jieba.cut_for_search(in_str)
-        segments = []
-        for segment in seg_list:
-            if len(segment.strip()) > 1:
-                segments.append(segment.strip())
-
-        common_chars = {',', ' ', '.', '"', "'", '，', '‘', '’', '“', '”', '。', ':', '：', '\n', '?', 
-                        '？', '!', '！', '(', ')', '（', '）', '-', '——', ';', '；'}
-        for char in in_str:
-            if char not in common_chars:
-                segments.append(char)
-        return segments
-    
-    def analyze_segments(self, segments: list[str]) -> dict[str, int]:
+        start = time.perf_counter()
+        # the document id and term frequency of each token's postings, the df is their number
+        postings: Postings = {}
+        document_count = 0
+        tokenize_time = 0.0
+        cache_counts = {'hits': 0, 'misses': 0}
+        for task_postings, count, seconds, task_cache_counts in self.tokenized(documents):
+            document_count += count
+            tokenize_time += seconds
+            for key, value in task_cache_counts.items():
+                cache_counts[key] += value
+            # the tasks are in the order of the documents, so are the postings of each token
+            for segment, segment_postings in task_postings.items():
+                if segment in postings:
+                    postings[segment].extend(segment_postings)
+                else:
+                    postings[segment] = segment_postings
+        merge_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        document_model = DOCUMENT_MODELS[kind]
+        with transaction.atomic():
+            # the postings first, so deleting the segments has nothing to cascade to
+            index_model.objects.all().delete()
+            document_model.objects.all().delete()
+            segment_model.objects.all().delete()
+            if self.storage == 'blobs':
+                # each segment with its postings, no row
+                self.bulk_insert(segment_model, (
+                    segment_model(token=segment, df=len(segment_postings), postings=encode_postings(segment_postings))
+                    for segment, segment_postings in postings.items()
+                ))
+                # and the segments of each document
+                segment_ids = dict(segment_model.objects.values_list('token', 'id'))
+                document_segments: dict[int, list[tuple[int, int]]] = {}
+                for segment, segment_postings in postings.items():
+                    for doc_id, tf in segment_postings:
+                        document_segments.setdefault(doc_id, []).append((segment_ids[segment], tf))
+                self.bulk_insert(document_model, (
+                    document_model(article_id=doc_id, segments=encode_postings(segments))
+                    for doc_id, segments in document_segments.items()
+                ))
+            else:
+                self.bulk_insert(segment_model, (
+                    segment_model(token=segment, df=len(segment_postings)) for segment, segment_postings in postings.items()
+                ))
+                segment_ids = dict(segment_model.objects.values_list('token', 'id'))
+                self.bulk_insert(index_model, (
+                    index_model(article_id=doc_id, tf=tf, **{f"{segment_field}_id": segment_ids[segment]})
+                    for segment, segment_postings in postings.items() for doc_id, tf in segment_postings
+                ))
+        write_time = time.perf_counter() - start
+        workers = self.pool._max_workers if self.pool is not None else 0
+        self.stdout.write(
+            f"{kind} index: {document_count} documents, {len(postings)} segments, "
+            f"{sum(len(segment_postings) for segment_postings in postings.values())} postings "
+            f"(tokenizing {tokenize_time:.2f}s of {workers or 'no'} worker processes, "
+            f"fetching, tokenizing and merging {merge_time:.2f}s, writing {write_time:.2f}s in {self.storage})"
+        )
+        if get_cache() is not None:
+            lookups = cache_counts['hits'] + cache_counts['misses']
+            self.stdout.write(
+                f"{kind} token cache: {cache_counts['hits']} hits, {cache_counts['misses']} misses "
+                f"({cache_counts['hits'] / lookups if lookups else 0:.1%} hit rate), {get_cache().stats()['bytes']} bytes"
+            )
 
-        """Converts the list of tokens in to a dict recording the frequency of each token.
+    def tokenized(self, documents: Iterable[Document]) -> Iterator[tuple[Postings, int, float, dict[str, int]]]:
 
-        This function makes a dict that records the frequency of each token appeared in the segments/tokens
-        list. 
+        """the postings of the documents, DOCUMENTS_PER_TASK documents at a time, in order
 
-        Args:
-            segments (list[str]): the segments/tokens list of a doc
+        The tasks run in the pool's processes (in this one if there is no pool), at most
+        self.window ahead of the postings merged, so the documents fetched wait in memory
+        a few tasks at most.
 
         Returns:
-            segment_data (dict[str, int]): the frequency of appearance of each token in the input list
+            results (Iterator[tuple[Postings, int, float, dict[str, int]]]): what tokenize_documents gives for each task
         """
 
-        segment_data = {}
-        for segment in segments:
-            if segment in segment_data:
-                segment_data[segment] += 1
-            else:
-                segment_data[segment] = 1
-        return segment_data
-    
+        documents = iter(documents)
+        if self.pool is None:
+            while task := list(islice(documents, DOCUMENTS_PER_TASK)):
+                yield tokenize_documents(task)
+            return
+        pending = deque()
+        while True:
+            # keep the pool busy while the postings are merged
+            while len(pending) < self.window:
+                task = list(islice(documents, DOCUMENTS_PER_TASK))
+                if not task:
+                    break
+                pending.append(self.pool.submit(tokenize_documents, task))
+            if not pending:
+                return
+            yield pending.popleft().result()
+
+    def bulk_insert(self, model, objects: Iterator) -> None:
+
+        """insert the objects with bulk_create, batch_size objects per query"""
+
+        objects = iter(objects)
+        while batch := list(islice(objects, self.batch_size)):
+            model.objects.bulk_create(batch)
+
     def create_artist_segments(self):
 
         """creating index for artist docs"""
 
         # should only considers the artist with complete information
-        artists = Artist.objects.filter(original_url__isnull=False)
-        for artist in artists:
-            # extract all segments from the artist, and put them in a dict where the key is
-            # the token and the item is the number of appearance
-            artist_segments = self.segments_in_artist(artist)
-            artist_segments_info = self.analyze_segments(artist_segments)
-            for segment in artist_segments_info:
-                # if the segment index has not been created, create a new one; if
-                # it's been created, add its df value.
-                seg_obj, created = ArtistSegment.objects.get_or_create(
-                    token=segment,
-                    defaults={'df': 1}
-                )
-                if created:
-                    self.stdout.write(f"new artist segment {segment} created")
-                else:
-                    self.stdout.write(f"adding df for artist segment {segment}")
-                    seg_obj.df += 1
-                    seg_obj.save()
-
-                #adding the doc index for this segment
-                seg_obj.artistindex_set.create(article_id=artist.id, tf=artist_segments_info[segment])
-
-    def segments_in_artist(self, artist: Artist) -> list[str]:
-
-        """Extracting a list of tokens from an artist.
-        
-        This function extracts a list of tokens from an artist object, including from its 
-        name, alias, intro, history, master work, and milestones.
-
-        Args:
-            artist (Artist): the artist that will be analyzed
-
-        Returns:
-            segments (list[str]): the list of tokens extracted
-        """
-
-        segments = []
-        segments.extend(self.segments_in_str(artist.name))
-        if artist.alias is not None:
-            segments.extend(self.segments_in_str(artist.alias))
-        if artist.intro is not None:
-            segments.extend(self.segments_in_str(artist.intro))
-        if artist.history is not None:
-            segments.extend(self.segments_in_str(artist.history))
-        if artist.master_work is not None:
-            for work in artist.master_work:
-                segments.extend(self.segments_in_str(work))
-        if artist.milestones is not None:
-            for milestone in artist.milestones:
-                segments.extend(self.segments_in_str(milestone))
-        return segments
\ No newline at end of file
+        artists = Artist.objects.filter(original_url__isnull=False).iterator(chunk_size=2000)
+        self.build_index('artist', ArtistSegment, ArtistIndex, 'artist_segment', map(artist_document, artists))
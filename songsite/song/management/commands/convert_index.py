@@ -0,0 +1,186 @@
+from itertools import groupby, islice
+from typing import Any
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.functions import Length
+from song.indexing import DOCUMENT_MODELS
+from song.models import SongSegment, SongIndex, ArtistSegment, ArtistIndex
+from song.postings import STORAGES, decode_postings, encode_postings, stored_in
+import random
+import time
+
+class Command(BaseCommand):
+
+    """This command converts the postings of the inverted index to the other storage (see song/postings.py)
+
+    The postings are copied to the other storage without tokenizing the documents again,
+    then the sizes of both storages and the time the search takes to read the postings
+    of a sample of the segments from each are compared, and the old storage is removed
+    (kept with --keep), in one transaction for the songs and one for the artists. Set
+    SONG_INDEX_STORAGE to the new storage so the next builds use it.
+    """
+
+    def add_arguments(self, parser: CommandParser) -> None:
+
+        """arguments of the command"""
+
+        # the storage the index is converted to
+        parser.add_argument(
+            '--storage',
+            choices=STORAGES,
+            required=True,
+            help="store the postings in rows, or in a compressed blob per segment"
+        )
+
+        # keep the old storage, the search reads the blobs first
+        parser.add_argument(
+            '--keep',
+            action="store_true",
+            help="keep the postings of the old storage"
+        )
+
+        # the segments the read times are compared on
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=200,
+            help="segments whose postings are read from both storages (half the most frequent, half at random)"
+        )
+
+        # rows or segments written per query
+        parser.add_argument(
+            '--batch_size',
+            type=int,
+            default=5000,
+            help="postings or segments written per query"
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+
+        """the main function of this command"""
+
+        self.batch_size = options['batch_size']
+        for kind, segment_model, index_model, segment_field in (
+            ('song', SongSegment, SongIndex, 'song_segment'),
+            ('artist', ArtistSegment, ArtistIndex, 'artist_segment'),
+        ):
+            storage = stored_in(segment_model, index_model)
+            if storage == options['storage']:
+                self.stdout.write(f"the {kind} index is already stored in {storage}")
+                continue
+            start = time.perf_counter()
+            document_model = DOCUMENT_MODELS[kind]
+            with transaction.atomic():
+                if options['storage'] == 'blobs':
+                    self.rows_to_blobs(segment_model, index_model, segment_field, document_model)
+                else:
+                    self.blobs_to_rows(segment_model, index_model, segment_field)
+                convert_time = time.perf_counter() - start
+                self.compare(kind, segment_model, index_model, segment_field, document_model, options['samples'])
+                if not options['keep']:
+                    if storage == 'rows':
+                        index_model.objects.all().delete()
+                    else:
+                        segment_model.objects.update(postings=None)
+                        document_model.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(
+                f"{kind} index converted from {storage} to {options['storage']} in {convert_time:.2f}s"
+                f"{', the ' + storage + ' kept' if options['keep'] else ''}"
+            ))
+
+    def rows_to_blobs(self, segment_model, index_model, segment_field: str, document_model) -> None:
+
+        """write the blob of each segment, and the segments of each document, from the rows"""
+
+        rows = index_model.objects.order_by(f"{segment_field}_id", 'article_id').values_list(
+            f"{segment_field}_id", 'article_id', 'tf'
+        ).iterator(chunk_size=self.batch_size)
+        segments = (
+            segment_model(id=segment_id, postings=encode_postings((doc_id, tf) for _, doc_id, tf in postings))
+            for segment_id, postings in groupby(rows, key=lambda row: row[0])
+        )
+        while batch := list(islice(segments, self.batch_size)):
+            segment_model.objects.bulk_update(batch, ['postings'])
+        document_model.objects.all().delete()
+        rows = index_model.objects.order_by('article_id').values_list(
+            'article_id', f"{segment_field}_id", 'tf'
+        ).iterator(chunk_size=self.batch_size)
+        documents = (
+            document_model(article_id=doc_id, segments=encode_postings((segment_id, tf) for _, segment_id, tf in segments))
+            for doc_id, segments in groupby(rows, key=lambda row: row[0])
+        )
+        while batch := list(islice(documents, self.batch_size)):
+            document_model.objects.bulk_create(batch)
+
+    def blobs_to_rows(self, segment_model, index_model, segment_field: str) -> None:
+
+        """write the rows of each segment from its blob"""
+
+        segments = segment_model.objects.filter(postings__isnull=False).values_list('id', 'postings').iterator(
+            chunk_size=self.batch_size
+        )
+        postings = (
+            index_model(article_id=doc_id, tf=tf, **{f"{segment_field}_id": segment_id})
+            for segment_id, blob in segments for doc_id, tf in zip(*decode_postings(blob))
+        )
+        while batch := list(islice(postings, self.batch_size)):
+            index_model.objects.bulk_create(batch)
+
+    def compare(self, kind: str, segment_model, index_model, segment_field: str, document_model, samples: int) -> None:
+
+        """write the sizes of both storages, and the time to read the postings of a sample of segments from each"""
+
+        postings = index_model.objects.count()
+        rows_bytes = self.table_bytes(index_model._meta.db_table)
+        # the blobs, and the segments of the documents the indexer needs with them
+        blob_bytes = (segment_model.objects.aggregate(total=Sum(Length('postings')))['total'] or 0) + \
+            (document_model.objects.aggregate(total=Sum(Length('segments')))['total'] or 0)
+        if rows_bytes is None:
+            rows_size = "size unknown"
+        else:
+            rows_size = f"{rows_bytes} bytes with their indexes ({rows_bytes / max(postings, 1):.1f} bytes a posting)"
+        self.stdout.write(
+            f"{kind} index: {postings} postings; rows: {rows_size}; "
+            f"blobs: {blob_bytes} bytes with the segments of the documents ({blob_bytes / max(postings, 1):.1f} bytes a posting)"
+        )
+
+        # the most frequent segments (the longest postings) and segments at random
+        by_df = list(segment_model.objects.order_by('-df').values_list('id', flat=True))
+        most_frequent, others = by_df[:samples // 2], by_df[samples // 2:]
+        sample = most_frequent + random.sample(others, min(samples - len(most_frequent), len(others)))
+        rows_time = blobs_time = 0.0
+        for segment_id in sample:
+            start = time.perf_counter()
+            rows = index_model.objects.filter(**{f"{segment_field}_id": segment_id})
+            from_rows = dict(rows.values_list('article_id', 'tf'))
+            rows_time += time.perf_counter() - start
+            start = time.perf_counter()
+            blob = segment_model.objects.values_list('postings', flat=True).get(id=segment_id)
+            from_blob = dict(zip(*decode_postings(blob)))
+            blobs_time += time.perf_counter() - start
+            if from_rows != from_blob:
+                raise RuntimeError(f"the postings of the {kind} segment {segment_id} differ in the two storages")
+        self.stdout.write(
+            f"{kind} index: reading the postings of {len(sample)} segments: rows {rows_time * 1000:.1f}ms, "
+            f"blobs {blobs_time * 1000:.1f}ms ({blobs_time / max(rows_time, 1e-9):.0%} of the rows' time)"
+        )
+
+    def table_bytes(self, table: str) -> int | None:
+
+        """the bytes of a table and its indexes (None where it can't be known)"""
+
+        if connection.vendor != 'sqlite':
+            return None
+        try:
+            # a savepoint, the conversion's transaction goes on if the query fails
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT SUM(d.pgsize) FROM dbstat AS d JOIN sqlite_master AS m ON m.name = d.name "
+                    "WHERE m.tbl_name = %s",
+                    [table]
+                )
+                return cursor.fetchone()[0]
+        except Exception:
+            # sqlite built without the dbstat table
+            return None
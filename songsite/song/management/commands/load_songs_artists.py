@@ -1,10 +1,26 @@
 import json
 import glob
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandParser
-from django.db import transaction
+from django.db import connection, transaction
+from song.indexing import index_queue
+from song.manifest import Scan, read_manifest, write_manifest, update_manifest, forget_stamps, scan_corpus, scan_json_files
 from song.models import Song, Artist
+from song.records import decode_files, decode_shard, song_fields
 import os
-import re
+import time
+
+# the corpus store is a module of the crawler, at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[4]))
+from corpus_store import CorpusStore
+
+# the json files decoded by a task of the pool
+FILES_PER_TASK = 256
 
 class Command(BaseCommand):
 
@@ -14,22 +30,87 @@ class Command(BaseCommand):
 
         """arguments of this command"""
 
-        # path to the song information folder, required
+        # path to the song information folder (the json files)
         parser.add_argument(
             '--song_info_path',
             type=str,
-            required=True,
             help="directory of songs' information",
         )
 
-        # path to the artist information folder, required
+        # path to the artist information folder (the json files)
         parser.add_argument(
             '--artist_info_path',
             type=str,
-            required=True,
             help="directory of artists' information",
         )
 
+        # path to the corpus store (see corpus_store.py), instead of the json files
+        parser.add_argument(
+            '--corpus_path',
+            type=str,
+            help="directory of the corpus store (instead of the info paths)",
+        )
+
+        # load one song of each group of near duplicates (see near_dup.py)
+        parser.add_argument(
+            '--collapse_duplicates',
+            action='store_true',
+            help="skip the songs whose lyrics are near duplicates of another song's",
+        )
+
+        # read everything first, then insert with a few bulk queries
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help="insert the songs, artists and links with bulk queries",
+        )
+
+        # objects inserted per transaction in the bulk mode
+        parser.add_argument(
+            '--batch_size',
+            type=int,
+            default=1000,
+            help="objects inserted per transaction with --bulk",
+        )
+
+        # only load what changed since the last load recorded in the manifest
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help="only load the new, changed and deleted songs and artists since the last incremental load",
+        )
+
+        # the manifest of the incremental loads
+        parser.add_argument(
+            '--manifest',
+            type=str,
+            default=str(settings.BASE_DIR / 'load_manifest.json'),
+            help="manifest of the incremental loads",
+        )
+
+        # where the ids of the documents changed by an incremental load are written
+        parser.add_argument(
+            '--changes',
+            type=str,
+            default=None,
+            help="json file of the changed and deleted documents' ids (default: load_changes.json next to the manifest)",
+        )
+
+        # the processes decoding and normalizing the records
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help="processes decoding the records (default: one per core, 0: decode in this process)",
+        )
+
+        # leave the inverted index as it is
+        parser.add_argument(
+            '--skip_index',
+            action='store_true',
+            help="don't update the inverted index of the songs and artists changed (faster before a rebuild with construct_inverted_index)",
+        )
+
         # clear all information before adding new songs/artists
         parser.add_argument(
             '--clear',
@@ -41,9 +122,79 @@ class Command(BaseCommand):
 
         """the main function of this command."""
 
-        # get the path of the information
-        song_info_dir = options['song_info_path']
-        artist_info_dir = options['artist_info_path']
+        if options['corpus_path'] is None and (options['song_info_path'] is None or options['artist_info_path'] is None):
+            self.stdout.write(
+                self.style.ERROR("give --corpus_path, or both --song_info_path and --artist_info_path")
+            )
+            return
+
+        self.collapse_duplicates = options['collapse_duplicates']
+        self.bulk = options['bulk']
+        self.batch_size = options['batch_size']
+        self.incremental = options['incremental']
+        self.manifest_path = options['manifest']
+        self.changes_path = options['changes'] or os.path.join(os.path.dirname(self.manifest_path), 'load_changes.json')
+        # the original id of each song skipped, and of the song it is a near duplicate of
+        self.collapsed: dict[str, str] = {}
+        # the records, errors and seconds of the decoding of each collection (see decoded())
+        self.stages: dict[str, dict] = {}
+
+        # the documents changed are indexed at the end, in batches (see song/indexing.py)
+        with index_queue.held(flush=not options['skip_index']):
+            if options['clear']:
+                self.stdout.write('clearing all data')
+                Song.objects.all().delete()
+                Artist.objects.all().delete()
+                # the manifest describes what was loaded
+                if os.path.exists(self.manifest_path):
+                    os.remove(self.manifest_path)
+
+            # the processes decoding the records, started at the first records decoded
+            self.pool = ProcessPoolExecutor(options['workers']) if options['workers'] != 0 else None
+            self.window = 2 * (self.pool._max_workers if self.pool is not None else 1)
+            start = time.perf_counter()
+            try:
+                if options['corpus_path'] is not None:
+                    self.load_corpus(options['corpus_path'])
+                else:
+                    self.load_json_files(options['song_info_path'], options['artist_info_path'])
+            finally:
+                if self.pool is not None:
+                    self.pool.shutdown(cancel_futures=True)
+            self.report_stages(time.perf_counter() - start)
+            if not options['skip_index']:
+                start = time.perf_counter()
+                counts = index_queue.flush()
+                self.stdout.write(
+                    f"index: {counts.get('documents', 0)} documents updated, {counts.get('postings added', 0)} postings "
+                    f"added, {counts.get('postings changed', 0)} changed and {counts.get('postings deleted', 0)} "
+                    f"deleted in {time.perf_counter() - start:.2f}s"
+                )
+
+    def load_corpus(self, corpus_path: str) -> None:
+
+        """load the songs and artists from the corpus store, streaming its records"""
+
+        if not os.path.exists(f"{corpus_path}/corpus.json"):
+            self.stdout.write(
+                self.style.ERROR(f"Can't find a corpus store in {corpus_path}")
+            )
+            return
+        with CorpusStore(corpus_path) as store:
+            if self.incremental:
+                self.load_incremental(scan_corpus(store))
+                return
+            shards = range(store.shards)
+        # each process decodes a shard at a time, reading the store itself
+        self.load(
+            lambda: self.decoded('songs', decode_shard, [(corpus_path, 'songs', shard) for shard in shards]),
+            self.decoded('artists', decode_shard, [(corpus_path, 'artists', shard) for shard in shards]),
+            self.decoded('artist songs', decode_shard, [(corpus_path, 'artist songs', shard) for shard in shards]),
+        )
+
+    def load_json_files(self, song_info_dir: str, artist_info_dir: str) -> None:
+
+        """load the songs and artists from the json files of the info directories"""
 
         if not os.path.exists(song_info_dir):
             self.stdout.write(
@@ -55,10 +206,9 @@ class Command(BaseCommand):
                 self.style.ERROR(f"Can't find {artist_info_dir}")
             )
 
-        if options['clear']:
-            self.stdout.write('clearing all data')
-            Song.objects.all().delete()
-            Artist.objects.all().delete()
+        if self.incremental:
+            self.load_incremental(scan_json_files(song_info_dir, artist_info_dir))
+            return
 
         # get the files contain the information
         song_jsons = glob.glob(f"{song_info_dir}/song_intro/*.json") # files of songs
@@ -81,93 +231,402 @@ class Command(BaseCommand):
                 self.style.WARNING(f'No jsons in {artist_info_dir}/artist_song_ids')
             )
 
+        self.load(
+            lambda: self.decoded('songs', decode_files, self.file_tasks('songs', song_jsons)),
+            self.decoded('artists', decode_files, self.file_tasks('artists', artist_jsons)),
+            self.decoded('artist songs', decode_files, self.file_tasks('artist songs', artist_songs)),
+        )
+
+    def file_tasks(self, collection: str, paths: list[str]) -> list[tuple]:
+
+        """the tasks of decode_files decoding the files, FILES_PER_TASK at a time"""
+
+        return [(collection, paths[i:i + FILES_PER_TASK]) for i in range(0, len(paths), FILES_PER_TASK)]
+
+    def decoded(self, collection: str, decode: Callable, tasks: list[tuple]) -> Iterator[dict]:
+
+        """the records decoded by each task, in the order of the tasks
+
+        The tasks run in the pool's processes (in this one if there is no pool), at most
+        self.window ahead of the records written, so the records decoded wait in memory
+        a few tasks at most. The records skipped are reported.
+
+        Args:
+            collection (str): the collection of the records, for the report of the stages
+            decode (Callable): decode_files or decode_shard
+            tasks (list[tuple]): the arguments of each call of decode
+
+        Returns:
+            records (Iterator[dict]): the normalized records (see records.py)
+        """
+
+        stage = self.stages.setdefault(collection, {'records': 0, 'errors': 0, 'decode': 0.0, 'wait': 0.0})
+        tasks = iter(tasks)
+        pending = deque()
+        while True:
+            # keep the pool busy while the records are written
+            while self.pool is not None and len(pending) < self.window:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pending.append(self.pool.submit(decode, *task))
+            start = time.perf_counter()
+            if self.pool is not None:
+                if not pending:
+                    return
+                records, errors, seconds = pending.popleft().result()
+            else:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                records, errors, seconds = decode(*task)
+            # the time the writer waited for the records (all of the decoding without pool)
+            stage['wait'] += time.perf_counter() - start
+            stage['decode'] += seconds
+            stage['records'] += len(records)
+            stage['errors'] += len(errors)
+            for error in errors:
+                self.stdout.write(self.style.WARNING(f"skipped {error}"))
+            yield from records
+
+    def report_stages(self, seconds: float) -> None:
+
+        """write the records per second of the decoding of each collection, and of the writing"""
+
+        if not self.stages:
+            return
+        workers = self.pool._max_workers if self.pool is not None else 0
+        for collection, stage in self.stages.items():
+            self.stdout.write(
+                f"decoding {collection}: {stage['records']} records ({stage['errors']} skipped) in "
+                f"{stage['decode']:.2f}s of {workers or 'no'} worker processes "
+                f"({stage['records'] / max(stage['decode'], 1e-9):.0f} records/s of a process)"
+            )
+        records = sum(stage['records'] for stage in self.stages.values())
+        wait = sum(stage['wait'] for stage in self.stages.values())
+        write = seconds - wait
+        self.stdout.write(
+            f"writing: {records} records in {write:.2f}s ({records / max(write, 1e-9):.0f} records/s), "
+            f"waited {wait:.2f}s for the decoding, {seconds:.2f}s in all"
+        )
+
+    def load(self, songs, artists: Iterator[dict], relations: Iterator[dict]) -> None:
+
+        """store the songs and artists and link them
+
+        Args:
+            songs (Callable[[], Iterator[dict]]): gives the songs' records (they are gone through twice)
+            artists (Iterator[dict]): the complete artists' records
+            relations (Iterator[dict]): the original id and song ids of each artist (see records.py)
+        """
+
+        if self.bulk:
+            self.load_bulk(songs, artists, relations)
+            return
+
         # loads all songs in
-        for song in song_jsons:
-            with open(song, "r", encoding='utf-8') as f:
-                song_data = json.load(f)
+        for song_data in songs():
             self.process_song_data(song_data)
 
         # loads all complete artists (with intro, pirctures, urls, etc.) in
-        for artist in artist_jsons:
-            with open(artist, "r", encoding='utf-8') as f:
-                artist_data = json.load(f)
+        for artist_data in artists:
             self.process_artist_data(artist_data)
 
         # for each artist, link their songs in the site  
-        for relation in artist_songs:
-            with open(relation, "r", encoding='utf-8') as f:
-                artist_song_relation = json.load(f)
-                # since the file name is in the pattern of 'artist{artist_id}songs', we can
-                # extract the file_name from the full path and then get the artist_id
-                file_name = re.search(r'artist[0-9]+songs', relation).group(0)
-                artist_org_id = file_name[len('artist'):len(file_name) - len('songs')]
-            self.add_songs_to_artist(artist_song_relation, artist_org_id)
+        for relation in relations:
+            self.add_songs_to_artist(relation['song ids'], relation['original_id'])
 
         # for each song, link their artists in the site
-        for song in song_jsons:
-            with open(song, "r", encoding='utf-8') as f:
-                song_data = json.load(f)
+        for song_data in songs():
             self.add_artists_to_song(song_data)
 
-    def process_song_data(self, song_data: dict) -> None:
+    def load_bulk(self, songs, artists: Iterator[dict], relations: Iterator[dict]) -> None:
+
+        """store the songs and artists and link them with bulk queries
 
-        """store the data from the loaded song dictionary into the data base"""
+        The inputs are read once, and the original ids are resolved through dicts of the
+        objects in the data base instead of a query each. The result is the one of load():
+        the songs and complete artists already created are kept as they are, and each
+        artist of a song that is not linked to it as a complete artist gets an Artist
+        object of its own, with only its name.
 
-        song_name = song_data['name']
-        song_alias = song_data.get('alias') # a song may have no alias, use get method
-        org_url = song_data['url']
-        lyrics = song_data['lyrics']
-        # get rid of the "收起" at the end of the lyrics string
-        if re.search(r'收起$', lyrics) is not None:
-            lyrics = lyrics[:len(lyrics) - 2]
-        lyrics = lyrics.replace('\n', '<br>')
-        org_id = str(song_data['id']) # cast original id into string (the type in the Song object)
+        Args: see load(...) (the songs are only gone through once)
+        """
+
+        start = time.perf_counter()
+        song_list = list(songs())
+        artist_list = list(artists)
+        relation_list = [(relation['original_id'], relation['song ids']) for relation in relations]
+        read_time = time.perf_counter() - start
+
+        # the songs, the first of the same original id wins (as with get_or_create)
+        start = time.perf_counter()
+        song_ids = dict(Song.objects.values_list('original_id', 'id'))
+        new_songs = {}
+        for record in song_list:
+            if not self.collapse(record) and record['original_id'] not in song_ids:
+                new_songs.setdefault(record['original_id'], Song(**song_fields(record)))
+        self.bulk_insert(Song, list(new_songs.values()))
+        song_ids = dict(Song.objects.values_list('original_id', 'id'))
+
+        # the complete artists (the artists with only a name have no original id)
+        artist_ids = dict(Artist.objects.filter(original_id__isnull=False).values_list('original_id', 'id'))
+        new_artists = {}
+        for record in artist_list:
+            if record['original_id'] not in artist_ids:
+                new_artists.setdefault(record['original_id'], Artist(**record))
+        self.bulk_insert(Artist, list(new_artists.values()))
+        artist_ids = dict(Artist.objects.filter(original_id__isnull=False).values_list('original_id', 'id'))
+        objects_time = time.perf_counter() - start
+
+        # the links of the artists to their songs, then of the songs to their complete artists
+        start = time.perf_counter()
+        Link = Song.artist.through
+        song_artists: dict[int, set[int]] = {}
+        for song_pk, artist_pk in Link.objects.values_list('song_id', 'artist_id'):
+            song_artists.setdefault(song_pk, set()).add(artist_pk)
+        new_links = []
+
+        def link(song_pk: int, artist_pk: int) -> None:
+            if artist_pk not in song_artists.setdefault(song_pk, set()):
+                song_artists[song_pk].add(artist_pk)
+                new_links.append(Link(song_id=song_pk, artist_id=artist_pk))
+
+        for artist_org_id, song_id_list in relation_list:
+            if artist_org_id not in artist_ids:
+                self.stdout.write(self.style.WARNING(f"artist{artist_org_id} is not in the data base"))
+                continue
+            for song_id in song_id_list:
+                # a song skipped is linked through the song it is a near duplicate of
+                song_id = self.collapsed.get(song_id, song_id)
+                if song_id not in song_ids:
+                    self.stdout.write(self.style.WARNING(f"song{song_id} of artist{artist_org_id} is not in the data base"))
+                    continue
+                link(song_ids[song_id], artist_ids[artist_org_id])
+        for record in song_list:
+            if record['original_id'] not in self.collapsed:
+                for artist_id in record['artist ids']:
+                    if artist_id in artist_ids:
+                        link(song_ids[record['original_id']], artist_ids[artist_id])
+
+        # the artists of the songs with no complete artist of their name get one with only the name
+        artist_names = dict(Artist.objects.values_list('id', 'name'))
+        name_artists = []
+        for record in song_list:
+            if record['original_id'] in self.collapsed:
+                continue
+            song_pk = song_ids[record['original_id']]
+            names = {artist_names[artist_pk] for artist_pk in song_artists.get(song_pk, ())}
+            for artist_name in record['artist names']:
+                if artist_name not in names:
+                    names.add(artist_name)
+                    name_artists.append((song_pk, Artist(name=artist_name)))
+        self.bulk_insert(Artist, [artist for _, artist in name_artists], need_pk=True)
+        for song_pk, artist in name_artists:
+            link(song_pk, artist.pk)
+        self.bulk_insert(Link, new_links)
+        # the bulk queries send no signal: the new songs and artists, and the songs with new links are indexed
+        index_queue.put('song', [*(song_ids[org_id] for org_id in new_songs), *(link.song_id for link in new_links)])
+        index_queue.put('artist', [artist_ids[org_id] for org_id in new_artists])
+        links_time = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(new_songs)} songs, {len(new_artists)} complete artists, {len(name_artists)} artists with "
+            f"only a name and {len(new_links)} links created (read {read_time:.2f}s, "
+            f"songs and artists {objects_time:.2f}s, links {links_time:.2f}s)"
+        ))
+
+    def bulk_insert(self, model, objects: list, need_pk: bool = False) -> None:
+
+        """insert the objects with bulk_create, batch_size objects per transaction
+
+        If need_pk, the objects must get their primary key: bulk_create sets it where the
+        data base returns it (sqlite, postgresql), elsewhere they are saved one by one.
+        """
+
+        for i in range(0, len(objects), self.batch_size):
+            with transaction.atomic():
+                if not need_pk or connection.features.can_return_rows_from_bulk_insert:
+                    model.objects.bulk_create(objects[i:i + self.batch_size])
+                else:
+                    for obj in objects[i:i + self.batch_size]:
+                        obj.save()
+
+    def load_incremental(self, scan: Scan) -> None:
+
+        """load the songs and artists new, changed or deleted since the last load of the manifest
+
+        The changed songs and complete artists are updated (or created), the deleted ones
+        deleted, and the links of every song they touch are made again: its complete
+        artists (through its artist ids and the artists' song ids) and its artists with
+        only a name. The ids (in the data base, as in the inverted index) of the songs
+        and artists changed and deleted are written in the changes file, then the manifest.
+        """
+
+        start = time.perf_counter()
+        old = read_manifest(self.manifest_path)
+        if old['collapse duplicates'] != self.collapse_duplicates:
+            # the songs skipped are not the same, all the songs are loaded again
+            forget_stamps(old, 'songs')
+        manifest, changed, deleted, errors = update_manifest(old, scan)
+        for error in errors:
+            self.stdout.write(self.style.WARNING(f"skipped {error}"))
+        manifest['collapse duplicates'] = self.collapse_duplicates
+        scan_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            changes = self.apply_changes(old['collections'], manifest['collections'], changed, deleted)
+        # the links set with bulk queries send no signal, every document changed is indexed again
+        for kind in ('song', 'artist'):
+            index_queue.put(kind, [*changes[f"{kind}s"]['changed'], *changes[f"{kind}s"]['deleted']])
+        load_time = time.perf_counter() - start
+
+        with open(self.changes_path, 'w', encoding='utf-8') as f:
+            json.dump(changes, f, indent=4)
+        # only once the changes are committed, a failed load is done again from the old manifest
+        write_manifest(self.manifest_path, manifest)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(changed['songs'])} songs and {len(changed['artists'])} artists new or changed, "
+            f"{len(deleted['songs'])} songs and {len(deleted['artists'])} artists deleted in the files; "
+            f"song documents: {len(changes['songs']['changed'])} changed, {len(changes['songs']['deleted'])} deleted; "
+            f"artist documents: {len(changes['artists']['changed'])} changed, {len(changes['artists']['deleted'])} deleted "
+            f"(scan {scan_time:.2f}s, load {load_time:.2f}s), written to {self.changes_path}"
+        ))
+
+    def apply_changes(self, old: dict, new: dict, changed: dict[str, dict[str, dict]],
+                      deleted: dict[str, set[str]]) -> dict:
+
+        """update the data base to the changes of update_manifest(...)
+
+        Args:
+            old (dict): the manifest entries of the last load, by collection
+            new (dict): the manifest entries now, by collection
+            changed (dict[str, dict[str, dict]]): the record of each new or changed original id, by collection
+            deleted (dict[str, set[str]]): the original ids no longer there, by collection
+
+        Returns:
+            changes (dict): the ids of the song and artist documents changed and deleted
+        """
+
+        song_entries = {entry['id']: entry for entry in new['songs'].values()}
+        if self.collapse_duplicates:
+            self.collapsed = {id: entry['group'] for id, entry in song_entries.items() if entry['group'] is not None}
+        old_relations = {entry['id']: entry['songs'] for entry in old.get('artist songs', {}).values()}
+        relations = {entry['id']: entry['songs'] for entry in new['artist songs'].values()}
+        changes = {kind: {'changed': set(), 'deleted': set()} for kind in ('songs', 'artists')}
+
+        # the songs deleted, and the ones now skipped as near duplicates, with their artists with only a name
+        gone = deleted['songs'] | (set(changed['songs']) & set(self.collapsed))
+        gone_songs = Song.objects.filter(original_id__in=gone)
+        changes['songs']['deleted'].update(gone_songs.values_list('id', flat=True))
+        Artist.objects.filter(song__in=gone_songs, original_id__isnull=True).delete()
+        gone_songs.delete()
+
+        # the complete artists
+        gone_artists = Artist.objects.filter(original_id__in=deleted['artists'])
+        changes['artists']['deleted'].update(gone_artists.values_list('id', flat=True))
+        gone_artists.delete()
+        for org_id, record in changed['artists'].items():
+            fields = dict(record)
+            fields.pop('original_id')
+            artist, _ = Artist.objects.update_or_create(original_id=org_id, defaults=fields)
+            changes['artists']['changed'].add(artist.id)
+
+        # the songs
+        for org_id, record in changed['songs'].items():
+            if org_id in gone:
+                continue
+            fields = song_fields(record)
+            fields.pop('original_id')
+            Song.objects.update_or_create(original_id=org_id, defaults=fields)
+
+        # the songs whose links may change: the songs changed, the songs of the relations
+        # changed, and the songs of the complete artists changed (by their ids or their relations)
+        touched = set(changed['songs'])
+        for artist_org_id in set(changed['artist songs']) | deleted['artist songs']:
+            touched.update(old_relations.get(artist_org_id, ()), relations.get(artist_org_id, ()))
+        artists_touched = set(changed['artists']) | deleted['artists']
+        for artist_org_id in artists_touched:
+            touched.update(old_relations.get(artist_org_id, ()), relations.get(artist_org_id, ()))
+        touched.update(id for id, entry in song_entries.items() if artists_touched.intersection(entry['artists']))
+        # a song skipped is linked through the song it is a near duplicate of
+        touched = {self.collapsed.get(id, id) for id in touched} - gone
+
+        # the artists of each song through the artists' song ids
+        related: dict[str, set[str]] = {}
+        for artist_org_id, song_ids in relations.items():
+            for song_id in song_ids:
+                related.setdefault(self.collapsed.get(song_id, song_id), set()).add(artist_org_id)
+        complete_artists = Artist.objects.filter(original_id__isnull=False)
+        artist_ids = dict(complete_artists.values_list('original_id', 'id'))
+        artist_names = dict(complete_artists.values_list('id', 'name'))
+
+        for song in Song.objects.filter(original_id__in=touched).prefetch_related('artist'):
+            entry = song_entries.get(song.original_id)
+            if entry is None:
+                continue
+            artists = {
+                artist_ids[artist_org_id] for artist_org_id in [*entry['artists'], *related.get(song.original_id, ())]
+                if artist_org_id in artist_ids
+            }
+            names = {artist_names[artist_id] for artist_id in artists}
+            # the artists with only a name still needed are kept, the others deleted
+            kept = {}
+            for artist in song.artist.all():
+                if artist.original_id is None:
+                    if artist.name in entry['names'] and artist.name not in names and artist.name not in kept:
+                        kept[artist.name] = artist.id
+                    else:
+                        artist.delete()
+            for artist_name in entry['names']:
+                if artist_name not in names and artist_name not in kept:
+                    kept[artist_name] = Artist.objects.create(name=artist_name).id
+            song.artist.set(artists | set(kept.values()))
+            changes['songs']['changed'].add(song.id)
+
+        return {kind: {key: sorted(ids) for key, ids in ids_by_key.items()} for kind, ids_by_key in changes.items()}
+
+    def collapse(self, record: dict) -> bool:
+
+        """whether the song is skipped, as a near duplicate of another song (recorded in self.collapsed)"""
+
+        if record['lyrics_group'] is None or not self.collapse_duplicates:
+            return False
+        self.collapsed[record['original_id']] = record['lyrics_group']
+        return True
+
+    def process_song_data(self, record: dict) -> None:
+
+        """store the song of the record (see records.py) into the data base"""
+
+        if self.collapse(record):
+            self.stdout.write(f"song{record['original_id']} skipped, a near duplicate of song{record['lyrics_group']}")
+            return
+        fields = song_fields(record)
+        org_id = fields.pop('original_id')
 
         # check whether the song is already created, if not, create it
         song_to_create, created = Song.objects.get_or_create(
             original_id=org_id,
-            defaults={
-                'name': song_name,
-                'alias': song_alias,
-                'original_url': org_url,
-                'lyrics': lyrics,
-            }
+            defaults=fields
         )
         if created:
             self.stdout.write(f"successfully created song{org_id}")
         else:
             self.stdout.write(f"song{org_id} already created")
 
-    def process_artist_data(self, artist_data: dict) -> None:
+    def process_artist_data(self, record: dict) -> None:
 
-        """store the data from the artist dictionary into the data base"""
+        """store the artist of the record (see records.py) into the data base"""
 
-        artist_name = artist_data['name']
-        # an artist may have no alias or multiple alias
-        if 'alias' in artist_data:
-            artist_alias = '，'.join(artist_data['alias'])
-        else:
-            artist_alias = None
-        org_url = artist_data['url']
-        org_id = str(artist_data['id'])
-        artist_intro_block = artist_data['intro']
-        artist_intro = artist_intro_block['intro']
-        artist_history = artist_intro_block.get('history')
-        artist_master_work = artist_intro_block.get('master work')
-        artist_milestones = artist_intro_block.get('milestones')
+        fields = dict(record)
+        org_id = fields.pop('original_id')
 
         # check whether the artist is already created, if not, create it
         artist_to_create, created = Artist.objects.get_or_create(
             original_id=org_id,
-            defaults={
-                'name': artist_name,
-                'alias': artist_alias,
-                'original_url': org_url,
-                'intro': artist_intro,
-                'history': artist_history,
-                'master_work': artist_master_work,
-                'milestones': artist_milestones,
-            }
+            defaults=fields
         )
         if created:
             self.stdout.write(f"successfully created artist{org_id}")
@@ -188,6 +647,8 @@ class Command(BaseCommand):
 
         artist = Artist.objects.get(original_id=artist_org_id)
         for song_id in artist_song_relation:
+            # a song skipped is linked through the song it is a near duplicate of
+            song_id = self.collapsed.get(str(song_id), song_id)
             song = Song.objects.get(original_id=str(song_id))
             if artist.song_set.filter(pk=song.id).exists():
                 # avoid the condition that the song is already added to the artist
@@ -196,12 +657,14 @@ class Command(BaseCommand):
                 artist.song_set.add(song)
                 self.stdout.write(f"adding song{song_id} to artist{artist_org_id}")
 
-    def add_artists_to_song(self, song_data: dict) -> None:
+    def add_artists_to_song(self, record: dict) -> None:
 
-        """adding artist to the song according to the song_data"""
+        """adding artist to the song according to the song's record"""
 
-        song_org_id = str(song_data['id'])
-        artist_id_list = song_data['artist id list']
+        song_org_id = record['original_id']
+        if song_org_id in self.collapsed:
+            return
+        artist_id_list = record['artist ids']
         song = Song.objects.get(original_id=song_org_id)
 
         # first adding the complete artists (artists with intro, urls, pictures, etc.)
@@ -214,7 +677,7 @@ class Command(BaseCommand):
                 artist = Artist.objects.get(original_id=str(artist_id))
                 song.artist.add(artist)
                 self.stdout.write(f"adding artist{artist_id} to song{song_org_id}")
-        artist_name_list = song_data['artist list']
+        artist_name_list = record['artist names']
         for artist_name in artist_name_list:
             # if the name of the artist is in the artist name list, but it's still not added to the song,
             # this artist has to be incomplete, so create an Artist object for him/her only with the name,
@@ -0,0 +1,156 @@
+"""the manifest of the loads of load_songs_artists, for the incremental loads.
+
+The manifest records, for every file (or record of a corpus store) loaded, a stamp
+(the modification time and size of a file, the place of a record in its segment) and
+the sha1 of its content, with what the links of the songs and artists depend on:
+    songs: the song's original id, group (see near_dup.py), artists' ids and names
+    artists: the artist's original id
+    artist songs: the artist's original id and the original ids of its songs
+A file whose stamp is the one recorded is not read again, a file read again whose
+content has the same hash is not loaded again. So the next load only reads and
+loads the new and changed files, and the ids missing since the last load are the
+ones deleted. A file that can't be read (see records.py) keeps its last entry, and
+is read again at the next load.
+"""
+
+import glob
+import hashlib
+import json
+import os
+from typing import Callable
+from song.records import COLLECTIONS, loads, normalize
+
+MANIFEST_VERSION = 1
+
+# what a scan gives for each collection: the stamp of each file (or record), and a function reading it
+Scan = dict[str, dict[str, tuple[str, Callable[[], bytes]]]]
+
+def empty_manifest() -> dict:
+
+    """the manifest of a data base where nothing was loaded"""
+
+    return {'version': MANIFEST_VERSION, 'collapse duplicates': False, 'collections': {c: {} for c in COLLECTIONS}}
+
+def read_manifest(path: str) -> dict:
+
+    """the manifest at the path, an empty one if there is none (or of another version)"""
+
+    if not os.path.exists(path):
+        return empty_manifest()
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return empty_manifest()
+    return manifest
+
+def write_manifest(path: str, manifest: dict) -> None:
+
+    """write the manifest at the path, replacing the previous one at once"""
+
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+def file_reader(path: str) -> Callable[[], bytes]:
+
+    """a function reading the file's content"""
+
+    def read() -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+def scan_json_files(song_info_dir: str, artist_info_dir: str) -> Scan:
+
+    """the stamps of the json files of the info directories (without reading them)"""
+
+    scan: Scan = {}
+    for collection, pattern in (
+        ('songs', f"{song_info_dir}/song_intro/*.json"),
+        ('artists', f"{artist_info_dir}/artist_intro/*.json"),
+        ('artist songs', f"{artist_info_dir}/artist_song_ids/*.json"),
+    ):
+        scan[collection] = {}
+        for path in glob.glob(pattern):
+            stat = os.stat(path)
+            scan[collection][path] = (f"{stat.st_mtime_ns}:{stat.st_size}", file_reader(path))
+    return scan
+
+def scan_corpus(store) -> Scan:
+
+    """the stamps of the records of a corpus store (see corpus_store.py, without reading them)"""
+
+    scan: Scan = {}
+    for collection in COLLECTIONS:
+        scan[collection] = {
+            f"{collection}/{id}": (f"{segment}:{offset}:{length}", lambda place=(segment, offset, length): store.read(*place))
+            for id, (segment, offset, length) in store.locations(collection).items()
+        }
+    return scan
+
+def manifest_entry(collection: str, record: dict, stamp: str, digest: str) -> dict:
+
+    """what the manifest keeps of a (normalized) record"""
+
+    entry = {'stamp': stamp, 'hash': digest, 'id': record['original_id']}
+    if collection == 'songs':
+        entry['group'] = record['lyrics_group']
+        entry['artists'] = record['artist ids']
+        entry['names'] = record['artist names']
+    elif collection == 'artist songs':
+        entry['songs'] = record['song ids']
+    return entry
+
+def update_manifest(old: dict, scan: Scan) -> tuple[dict, dict[str, dict[str, dict]], dict[str, set[str]], list[str]]:
+
+    """compare the scan to the manifest of the last load
+
+    Args:
+        old (dict): the manifest of the last load
+        scan (Scan): the stamps of the files (or records) now
+
+    Returns:
+        manifest (dict): the manifest of the files now
+        changed (dict[str, dict[str, dict]]): the normalized record of each new or changed original id, by collection
+        deleted (dict[str, set[str]]): the original ids no longer there, by collection
+        errors (list[str]): what was wrong with the files that couldn't be read
+    """
+
+    manifest = dict(old, collections={})
+    changed: dict[str, dict[str, dict]] = {}
+    deleted: dict[str, set[str]] = {}
+    errors: list[str] = []
+    for collection in COLLECTIONS:
+        old_entries = old['collections'].get(collection, {})
+        entries = manifest['collections'][collection] = {}
+        changed[collection] = {}
+        for key, (stamp, read) in scan.get(collection, {}).items():
+            previous = old_entries.get(key)
+            if previous is not None and previous['stamp'] == stamp:
+                entries[key] = previous
+                continue
+            try:
+                data = read()
+                digest = hashlib.sha1(data).hexdigest()
+                if previous is not None and previous['hash'] == digest:
+                    # touched but not changed
+                    entries[key] = dict(previous, stamp=stamp)
+                    continue
+                record = normalize(collection, loads(data), key)
+            except (OSError, ValueError) as error:
+                errors.append(f"{key}: {error}")
+                if previous is not None:
+                    entries[key] = dict(previous, stamp=None)
+                continue
+            entries[key] = manifest_entry(collection, record, stamp, digest)
+            changed[collection][entries[key]['id']] = record
+        ids = {entry['id'] for entry in entries.values()}
+        deleted[collection] = {entry['id'] for entry in old_entries.values()} - ids
+    return manifest, changed, deleted, errors
+
+def forget_stamps(manifest: dict, collection: str) -> None:
+
+    """make every file (or record) of the collection read and loaded again at the next update"""
+
+    for entry in manifest['collections'][collection].values():
+        entry['stamp'] = entry['hash'] = None
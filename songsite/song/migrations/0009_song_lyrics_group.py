@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('song', '0008_alter_artistindex_article_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='lyrics_group',
+            field=models.CharField(blank=True, max_length=15, null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('song', '0009_song_lyrics_group'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='artist',
+            name='original_id',
+            field=models.CharField(blank=True, max_length=15, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='artistindex',
+            name='article_id',
+            field=models.PositiveIntegerField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='original_id',
+            field=models.CharField(max_length=15, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='songindex',
+            name='article_id',
+            field=models.PositiveIntegerField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['song', '-pub_date'], name='comment_song_pub_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='artistindex',
+            constraint=models.UniqueConstraint(fields=('artist_segment', 'article_id'), name='artistindex_segment_article'),
+        ),
+        migrations.AddConstraint(
+            model_name='songindex',
+            constraint=models.UniqueConstraint(fields=('song_segment', 'article_id'), name='songindex_segment_article'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('song', '0010_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artistsegment',
+            name='postings',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='songsegment',
+            name='postings',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('song', '0011_segment_postings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtistDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('article_id', models.PositiveIntegerField(unique=True)),
+                ('segments', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SongDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('article_id', models.PositiveIntegerField(unique=True)),
+                ('segments', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -37,7 +37,7 @@ class Artist(models.Model):
 
     name = models.CharField(max_length=50)
     alias = models.CharField(max_length=50, null=True, blank=True)
-    original_id = models.CharField(max_length=15, null=True, blank=True)
+    original_id = models.CharField(max_length=15, unique=True, null=True, blank=True) # null for the artists with only a name
     intro = models.CharField(max_length=2000, null=True, blank=True)
     history = models.CharField(max_length=10000, null=True, blank=True)
     master_work = models.JSONField(default=list, null=True, blank=True)
@@ -57,14 +57,18 @@ class Song(models.Model):
         original_url (CharField): the song's url in the original website
         artist (ManyToManyField): the artist contributed for the song
         lyrics (CharField): the lyrics of the song
+        lyrics_group (CharField):
+            the original id of the first song with (almost) the same lyrics, only for the songs
+            that are near duplicates of another one (see near_dup.py at the root of the repository)
     """
 
     name = models.CharField(max_length=50)
     alias = models.CharField(max_length=50, null=True, blank=True)
-    original_id = models.CharField(max_length=15)
+    original_id = models.CharField(max_length=15, unique=True)
     original_url = models.CharField(max_length=50)
     artist = models.ManyToManyField('Artist')
     lyrics = models.CharField(max_length=2000)
+    lyrics_group = models.CharField(max_length=15, null=True, blank=True)
 
 class Comment(models.Model):
 
@@ -84,6 +88,10 @@ class Comment(models.Model):
     comment_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('发布时间', auto_now_add=True)
 
+    class Meta:
+        # the comments of a song are listed from new to old
+        indexes = [models.Index(fields=['song', '-pub_date'], name='comment_song_pub_date')]
+
 class SongSegment(models.Model):
 
     """The song segment model (for the inverted index of songs)
@@ -93,10 +101,14 @@ class SongSegment(models.Model):
     Attributes:
         token (CharField): the token for index
         df (PositiveIntegerField): document frequency
+        postings (BinaryField):
+            the compressed postings of the token, only when the index is stored in blobs
+            instead of SongIndex rows (see song/postings.py)
     """
 
     token = models.CharField(max_length=20, unique=True) # setting unique=True for making the index
     df = models.PositiveIntegerField()
+    postings = models.BinaryField(null=True, blank=True)
 
 class SongIndex(models.Model):
 
@@ -111,10 +123,16 @@ class SongIndex(models.Model):
         song_segment (ForeignKey): the corresponding song segment/token
     """
 
-    article_id = models.PositiveIntegerField()
+    article_id = models.PositiveIntegerField(db_index=True) # indexed for removing the postings of a document
     tf = models.PositiveIntegerField()
     song_segment = models.ForeignKey(SongSegment, on_delete=models.CASCADE)
 
+    class Meta:
+        # a token has one posting per document, fetched by the token
+        constraints = [
+            models.UniqueConstraint(fields=['song_segment', 'article_id'], name='songindex_segment_article')
+        ]
+
 class ArtistSegment(models.Model):
 
     """The artist segment model (for the inverted index of songs)
@@ -124,10 +142,14 @@ class ArtistSegment(models.Model):
     Attributes:
         token (CharField): the token for index
         df (PositiveIntegerField): document frequency
+        postings (BinaryField):
+            the compressed postings of the token, only when the index is stored in blobs
+            instead of ArtistIndex rows (see song/postings.py)
     """
 
     token = models.CharField(max_length=20, unique=True)
     df = models.PositiveIntegerField()
+    postings = models.BinaryField(null=True, blank=True)
 
 class ArtistIndex(models.Model):
 
@@ -142,6 +164,40 @@ class ArtistIndex(models.Model):
         song_segment (ForeignKey): the corresponding song segment/token
     """
 
-    article_id = models.PositiveIntegerField()
+    article_id = models.PositiveIntegerField(db_index=True) # indexed for removing the postings of a document
     tf = models.PositiveIntegerField()
-    artist_segment = models.ForeignKey(ArtistSegment, on_delete=models.CASCADE)
\ No newline at end of file
+    artist_segment = models.ForeignKey(ArtistSegment, on_delete=models.CASCADE)
+
+    class Meta:
+        # a token has one posting per document, fetched by the token
+        constraints = [
+            models.UniqueConstraint(fields=['artist_segment', 'article_id'], name='artistindex_segment_article')
+        ]
+class SongDocument(models.Model):
+
+    """The segments of a song document (for updating the inverted index stored in blobs)
+
+    The blob of a segment doesn't tell which documents it has without being decoded, so when
+    the index is stored in blobs, the segments of each document are kept too: the indexer
+    reads the blobs of the segments a document had and has, not all of them (see
+    song/indexing.py).
+
+    Attributes:
+        article_id (PositiveIntegerField): the song document's id
+        segments (BinaryField): the ids and term frequencies of its song segments (see song/postings.py)
+    """
+
+    article_id = models.PositiveIntegerField(unique=True)
+    segments = models.BinaryField()
+
+class ArtistDocument(models.Model):
+
+    """The segments of an artist document (for updating the inverted index stored in blobs)
+
+    Attributes:
+        article_id (PositiveIntegerField): the artist document's id
+        segments (BinaryField): the ids and term frequencies of its artist segments (see song/postings.py)
+    """
+
+    article_id = models.PositiveIntegerField(unique=True)
+    segments = models.BinaryField()
@@ -0,0 +1,98 @@
+"""the compressed posting lists of the inverted index.
+
+The index stores the postings (the document id and term frequency) of its tokens in one
+of two ways, as settings.SONG_INDEX_STORAGE says:
+    'rows': a SongIndex (ArtistIndex) row per posting, as built since the beginning
+    'blobs': the postings of each segment in its `postings` field, with no row
+A posting list blob is the varints (7 bits a byte, the lowest first, the high bit set
+on every byte but the last) of each posting in the order of the document ids: the
+difference of its document id to the previous one (to 0 for the first), then its tf.
+The ids of the documents of a token are close, so most postings take 2 or 3 bytes
+instead of a row of four columns and three indexes.
+
+The search reads a segment's postings from its blob when it has one, from its rows
+otherwise (see segment_postings). The builder writes the storage of the settings, the
+indexer the storage the index already has (see stored_in). convert_index converts an
+index from one storage to the other, and compares their sizes and the time to read
+the postings.
+"""
+
+from array import array
+from itertools import accumulate
+from typing import Iterable
+from django.conf import settings
+
+STORAGES = ('rows', 'blobs')
+
+def index_storage() -> str:
+
+    """the storage the index is built and updated with (settings.SONG_INDEX_STORAGE, 'rows' by default)"""
+
+    storage = getattr(settings, 'SONG_INDEX_STORAGE', 'rows')
+    if storage not in STORAGES:
+        raise ValueError(f"SONG_INDEX_STORAGE is {storage!r}, not one of {', '.join(STORAGES)}")
+    return storage
+
+def stored_in(segment_model, index_model) -> str:
+
+    """the storage of an index: blobs if a segment has one, rows if a posting is a row, else the settings'"""
+
+    if segment_model.objects.filter(postings__isnull=False).exists():
+        return 'blobs'
+    if index_model.objects.exists():
+        return 'rows'
+    return index_storage()
+
+def encode_postings(postings: Iterable[tuple[int, int]]) -> bytes:
+
+    """the blob of the postings (document id, tf), in any order (a document appears once)"""
+
+    out = bytearray()
+    previous = 0
+    for doc_id, tf in sorted(postings):
+        for value in (doc_id - previous, tf):
+            while value > 0x7f:
+                out.append((value & 0x7f) | 0x80)
+                value >>= 7
+            out.append(value)
+        previous = doc_id
+    return bytes(out)
+
+def decode_postings(data: bytes) -> tuple[array, array]:
+
+    """the document ids (in order) and term frequencies of a blob of encode_postings(...)"""
+
+    if max(data, default=0) < 0x80:
+        # every varint is a byte (the postings of the frequent tokens mostly): no loop in python
+        # a bytes initializer would be read as the machine's 8 byte integers, not a value per byte
+        return array('q', accumulate(data[0::2])), array('q', list(data[1::2]))
+    doc_ids, tfs = array('q'), array('q')
+    doc_id = value = shift = 0
+    is_tf = False
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            continue
+        value |= byte << shift
+        if is_tf:
+            tfs.append(value)
+        else:
+            doc_id += value
+            doc_ids.append(doc_id)
+        is_tf = not is_tf
+        value = shift = 0
+    return doc_ids, tfs
+
+def segment_postings(segment, index_set) -> Iterable[tuple[int, int]]:
+
+    """the (document id, tf) of the postings of a segment, from its blob or its rows
+
+    Args:
+        segment (SongSegment | ArtistSegment): the segment
+        index_set (RelatedManager): its rows (segment.songindex_set or segment.artistindex_set)
+    """
+
+    if segment.postings is not None:
+        return zip(*decode_postings(segment.postings))
+    return index_set.values_list('article_id', 'tf')
@@ -0,0 +1,161 @@
+"""the records load_songs_artists reads: decoded, checked and normalized into the fields of the models.
+
+A record of each collection becomes:
+    songs: the fields of its Song ('original_id', 'name', 'alias', 'original_url',
+        'lyrics', 'lyrics_group') with its 'artist ids' and 'artist names'
+    artists: the fields of its Artist
+    artist songs: the artist's 'original_id' and the original ids of its 'song ids'
+A record missing what the models need raises a ValueError, and is reported and
+skipped by the decoders.
+
+The decoders (decode_files, decode_shard) run in the processes of the loader's pool
+(see load_songs_artists --workers), so this module doesn't use the data base. The
+json is decoded with orjson when it is installed.
+"""
+
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the corpus store is a module of the crawler, at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from corpus_store import CorpusStore
+
+COLLECTIONS = ('songs', 'artists', 'artist songs')
+
+# what the lyrics shown on the page may end with
+FOLDED_SUFFIX = '收起'
+
+def loads(data: bytes | str):
+
+    """decode the json (with orjson if it is installed)"""
+
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def require(data, keys: tuple[str, ...], kind: str) -> None:
+
+    """raise a ValueError if the record is not a dict with the keys"""
+
+    if not isinstance(data, dict):
+        raise ValueError(f"a {kind} record is a {type(data).__name__}, not an object")
+    missing = [key for key in keys if data.get(key) is None]
+    if missing:
+        raise ValueError(f"the {kind} record {data.get('id')} has no {', '.join(missing)}")
+
+def song_record(data: dict) -> dict:
+
+    """the fields of the Song object of a song's record, with its artists' ids and names"""
+
+    require(data, ('id', 'name', 'url', 'lyrics', 'artist id list', 'artist list'), 'song')
+    lyrics = data['lyrics']
+    # get rid of the "收起" at the end of the lyrics string
+    if lyrics.endswith(FOLDED_SUFFIX):
+        lyrics = lyrics[:len(lyrics) - len(FOLDED_SUFFIX)]
+    org_id = str(data['id']) # cast original id into string (the type in the Song object)
+    # the first song with the same lyrics, only kept for the near duplicates of another song
+    lyrics_group = data.get('lyrics group')
+    if lyrics_group is not None and str(lyrics_group) == org_id:
+        lyrics_group = None
+    return {
+        'original_id': org_id,
+        'name': data['name'],
+        'alias': data.get('alias'), # a song may have no alias, use get method
+        'original_url': data['url'],
+        'lyrics': lyrics.replace('\n', '<br>'),
+        'lyrics_group': None if lyrics_group is None else str(lyrics_group),
+        'artist ids': [str(id) for id in data['artist id list']],
+        'artist names': list(data['artist list']),
+    }
+
+def song_fields(record: dict) -> dict:
+
+    """the fields of the Song object of a song record (without its artists)"""
+
+    return {key: value for key, value in record.items() if key not in ('artist ids', 'artist names')}
+
+def artist_record(data: dict) -> dict:
+
+    """the fields of the Artist object of an artist's record"""
+
+    require(data, ('id', 'name', 'url', 'intro'), 'artist')
+    intro_block = data['intro']
+    if not isinstance(intro_block, dict) or 'intro' not in intro_block:
+        raise ValueError(f"the artist record {data['id']} has no intro")
+    # an artist may have no alias or multiple alias
+    alias = '，'.join(data['alias']) if 'alias' in data else None
+    return {
+        'original_id': str(data['id']),
+        'name': data['name'],
+        'alias': alias,
+        'original_url': data['url'],
+        'intro': intro_block['intro'],
+        'history': intro_block.get('history'),
+        'master_work': intro_block.get('master work'),
+        'milestones': intro_block.get('milestones'),
+    }
+
+def relation_record(data, key: str = '') -> dict:
+
+    """the artist's original id and its songs' original ids, of a record or of an artist_song_ids file
+
+    An artist_song_ids file only has the song ids, the artist's id is in the file's name (the key).
+    """
+
+    if isinstance(data, list):
+        match = re.search(r'artist([0-9]+)songs\.json$', key)
+        if match is None:
+            raise ValueError(f"no artist id in the name of {key}")
+        data = {'id': match.group(1), 'song ids': data}
+    require(data, ('id', 'song ids'), 'artist songs')
+    return {'original_id': str(data['id']), 'song ids': [str(id) for id in data['song ids']]}
+
+def normalize(collection: str, data, key: str = '') -> dict:
+
+    """the normalized record of the collection (key: the file or record it comes from)"""
+
+    if collection == 'songs':
+        return song_record(data)
+    if collection == 'artists':
+        return artist_record(data)
+    return relation_record(data, key)
+
+def decode_files(collection: str, paths: list[str]) -> tuple[list[dict], list[str], float]:
+
+    """decode and normalize json files of the collection (run in the loader's pool)
+
+    Returns:
+        records (list[dict]): the normalized records, in the order of the paths
+        errors (list[str]): what was wrong with the files skipped
+        seconds (float): the time spent
+    """
+
+    start = time.perf_counter()
+    records, errors = [], []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                records.append(normalize(collection, loads(f.read()), path))
+        except (OSError, ValueError) as error:
+            errors.append(f"{path}: {error}")
+    return records, errors, time.perf_counter() - start
+
+def decode_shard(corpus_path: str, collection: str, shard: int) -> tuple[list[dict], list[str], float]:
+
+    """decode and normalize the records of a shard of a corpus store (see decode_files)"""
+
+    start = time.perf_counter()
+    records, errors = [], []
+    with CorpusStore(corpus_path) as store:
+        for line in store.iterate_lines(collection, [shard]):
+            try:
+                records.append(normalize(collection, loads(line)))
+            except ValueError as error:
+                errors.append(f"{collection} shard {shard}: {error}")
+    return records, errors, time.perf_counter() - start
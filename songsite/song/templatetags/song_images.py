@@ -0,0 +1,25 @@
+from django import template
+from django.contrib.staticfiles import finders
+
+register = template.Library()
+
+@register.filter
+def thumbnail(image_path: str) -> str:
+
+    """the static path of the webp thumbnail of an image, or the image's own path if it has none
+
+    The thumbnails (song/thumbs/) are not in the repository, image_pipeline.py makes them
+    from the images (song/images/), so the pages show the images until it is run.
+
+    Args:
+        image_path (str): the static path of the image, e.g. song/images/song1.jpg
+
+    Returns:
+        path (str): song/thumbs/song1.webp if it exists, else image_path
+    """
+
+    directory, _, name = image_path.rpartition('/images/')
+    if not directory:
+        return image_path
+    thumb_path = f"{directory}/thumbs/{name.rsplit('.', 1)[0]}.webp"
+    return thumb_path if finders.find(thumb_path) else image_path
@@ -1,3 +1,609 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from .indexing import MAX_ATTEMPTS, IndexQueue, index_queue, update_index
+from .models import Song, Artist, Comment, SongSegment, SongIndex, SongDocument, ArtistSegment, ArtistIndex
+from .templatetags.song_images import thumbnail
+from .postings import decode_postings, encode_postings, segment_postings
+from . import manifest, token_cache
+from .token_cache import TokenCache, cache_settings, configure
 
 # Create your tests here.
+
+@skipUnless(connection.vendor == 'sqlite', "the query plans are the ones of SQLite")
+class QueryPlanTests(TestCase):
+
+    """the lookups of the loader, of the search and of the song page use an index (see migration 0010)"""
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        """a song with an artist, a comment and a posting"""
+
+        cls.artist = Artist.objects.create(name='artist', original_id='1', original_url='/artist?id=1')
+        cls.song = Song.objects.create(name='song', original_id='2', original_url='/song?id=2', lyrics='lyrics')
+        cls.song.artist.add(cls.artist)
+        Comment.objects.create(song=cls.song, user='user', comment_text='comment')
+        cls.song_segment = SongSegment.objects.create(token='song', df=1)
+        cls.song_segment.songindex_set.create(article_id=cls.song.id, tf=1)
+        cls.artist_segment = ArtistSegment.objects.create(token='artist', df=1)
+        cls.artist_segment.artistindex_set.create(article_id=cls.artist.id, tf=1)
+
+    def plan(self, queryset: QuerySet) -> str:
+
+        """the EXPLAIN QUERY PLAN of the queryset"""
+
+        return queryset.explain()
+
+    def assertSearches(self, queryset: QuerySet, table: str) -> None:
+
+        """the queryset searches the table through an index, without scanning it"""
+
+        plan = self.plan(queryset)
+        self.assertRegex(plan, rf"SEARCH {table} USING (COVERING )?INDEX")
+        self.assertNotIn(f"SCAN {table}", plan)
+
+    def test_loader_lookups(self) -> None:
+        self.assertSearches(Song.objects.filter(original_id='2'), 'song_song')
+        self.assertSearches(Song.objects.filter(original_id__in=['2', '3']), 'song_song')
+        self.assertSearches(Artist.objects.filter(original_id='1'), 'song_artist')
+        self.assertSearches(Artist.objects.filter(original_id__in=['1', '4']), 'song_artist')
+
+    def test_original_ids_are_unique(self) -> None:
+        self.assertTrue(Song._meta.get_field('original_id').unique)
+        self.assertTrue(Artist._meta.get_field('original_id').unique)
+        # the artists with only a name have no original id, as many as there are
+        Artist.objects.create(name='a')
+        Artist.objects.create(name='b')
+        self.assertEqual(Artist.objects.filter(original_id__isnull=True).count(), 2)
+
+    def test_search_posting_fetch(self) -> None:
+        self.assertSearches(SongSegment.objects.filter(token='song'), 'song_songsegment')
+        self.assertSearches(self.song_segment.songindex_set.all(), 'song_songindex')
+        self.assertSearches(ArtistSegment.objects.filter(token='artist'), 'song_artistsegment')
+        self.assertSearches(self.artist_segment.artistindex_set.all(), 'song_artistindex')
+
+    def test_postings_of_a_document(self) -> None:
+        self.assertSearches(SongIndex.objects.filter(article_id=self.song.id), 'song_songindex')
+        self.assertSearches(ArtistIndex.objects.filter(article_id=self.artist.id), 'song_artistindex')
+
+    def test_comment_listing(self) -> None:
+        plan = self.plan(self.song.comment_set.order_by('-pub_date'))
+        self.assertIn("USING INDEX comment_song_pub_date", plan)
+        # the index gives the comments in order
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class PostingsCodecTests(SimpleTestCase):
+
+    """the blobs of encode_postings decode to the same postings, in the order of the documents (see postings.py)"""
+
+    def assertRoundTrip(self, postings: list[tuple[int, int]]) -> bytes:
+
+        """the blob of the postings decodes to them, sorted, and is returned"""
+
+        blob = encode_postings(postings)
+        doc_ids, tfs = decode_postings(blob)
+        self.assertEqual(list(zip(doc_ids, tfs)), sorted(postings))
+        return blob
+
+    def test_empty(self) -> None:
+        self.assertEqual(self.assertRoundTrip([]), b'')
+
+    def test_single_byte_varints(self) -> None:
+        # an even and an odd number of postings, every varint in a byte
+        for count in (1, 3, 8, 9):
+            blob = self.assertRoundTrip([(doc_id, 1 + doc_id % 5) for doc_id in range(1, count + 1)])
+            self.assertEqual(len(blob), 2 * count)
+
+    def test_multi_byte_varints(self) -> None:
+        self.assertRoundTrip([(127, 127), (128, 128), (300, 1), (2 ** 21, 2 ** 14), (2 ** 40, 70000)])
+        # single byte postings after a multi byte one
+        self.assertRoundTrip([(1, 1), (2, 1), (200, 1), (201, 2)])
+
+    def test_unsorted(self) -> None:
+        self.assertRoundTrip([(50, 2), (3, 1), (1000, 7), (4, 1)])
+
+
+class IndexTestCase(TestCase):
+
+    """builds the inverted index of the test data base and reads it (see construct_inverted_index)"""
+
+    def setUp(self) -> None:
+
+        """build without the token cache of the site"""
+
+        self.cache_settings = cache_settings()
+        configure(None)
+
+    def tearDown(self) -> None:
+        configure(*self.cache_settings)
+
+    def build(self, storage: str = 'rows', workers: int = 0) -> dict[str, dict[str, dict[int, int]]]:
+
+        """build the index in the storage, and read the postings of each token as the search does"""
+
+        call_command('construct_inverted_index', storage=storage, workers=workers, stdout=StringIO())
+        return self.postings()
+
+    def postings(self) -> dict[str, dict[str, dict[int, int]]]:
+
+        """the postings of each token of the index, as the search reads them"""
+
+        return {
+            'song': {
+                segment.token: dict(segment_postings(segment, segment.songindex_set))
+                for segment in SongSegment.objects.all()
+            },
+            'artist': {
+                segment.token: dict(segment_postings(segment, segment.artistindex_set))
+                for segment in ArtistSegment.objects.all()
+            },
+        }
+
+class IndexBuildTests(IndexTestCase):
+
+    """the index built in memory has the tokens, df and tf of the documents (see construct_inverted_index)"""
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        """two songs of an artist, and a song of no complete artist (its artist has only a name)"""
+
+        cls.artist = Artist.objects.create(name='周杰伦', original_id='1', original_url='/artist?id=1', intro='台湾歌手')
+        cls.sunny = Song.objects.create(name='晴天', original_id='2', original_url='/song?id=2', lyrics='hello hello world')
+        cls.rainy = Song.objects.create(name='雨天', original_id='3', original_url='/song?id=3', lyrics='hello there')
+        cls.sunny.artist.add(cls.artist)
+        cls.rainy.artist.add(cls.artist)
+        # the artists with only a name are not indexed
+        Artist.objects.create(name='无名')
+
+    def test_tokens_df_and_tf(self) -> None:
+        index = self.build()
+        sunny, rainy = self.sunny.id, self.rainy.id
+        self.assertEqual(index['song']['hello'], {sunny: 2, rainy: 1})
+        self.assertEqual(index['song']['world'], {sunny: 1})
+        self.assertEqual(index['song']['there'], {rainy: 1})
+        self.assertEqual(index['song']['晴天'], {sunny: 1})
+        # the characters of the strings are tokens too, the spaces are not
+        self.assertEqual(index['song']['天'], {sunny: 1, rainy: 1})
+        self.assertEqual(index['song']['l'], {sunny: 5, rainy: 2})
+        self.assertEqual(index['song']['e'], {sunny: 2, rainy: 3})
+        self.assertNotIn(' ', index['song'])
+        # the artists' names are in the songs' documents
+        self.assertEqual(index['song']['周杰伦'], {sunny: 1, rainy: 1})
+        self.assertEqual(len(index['song']), 20)
+        self.assertEqual(index['artist'], {
+            token: {self.artist.id: 1} for token in ('周杰伦', '周', '杰', '伦', '台湾', '歌手', '台湾歌手', '台', '湾', '歌', '手')
+        })
+        # the df of each segment is the number of its documents
+        for segment in SongSegment.objects.all():
+            self.assertEqual(segment.df, len(index['song'][segment.token]))
+        for segment in ArtistSegment.objects.all():
+            self.assertEqual(segment.df, 1)
+
+    def test_rebuild_replaces_the_index(self) -> None:
+        index = self.build()
+        self.rainy.delete()
+        rebuilt = self.build()
+        self.assertNotIn('there', rebuilt['song'])
+        self.assertEqual(rebuilt['song']['hello'], {self.sunny.id: 2})
+        self.assertEqual(SongSegment.objects.get(token='hello').df, 1)
+        self.assertEqual(len(rebuilt['artist']), len(index['artist']))
+
+    def test_pool_matches_this_process(self) -> None:
+        in_process = self.build(workers=0)
+        # a task per document, so the postings of the tasks are merged in order
+        with mock.patch('song.management.commands.construct_inverted_index.DOCUMENTS_PER_TASK', 1):
+            pooled = self.build(workers=2)
+        self.assertEqual(pooled, in_process)
+
+class IndexQueueTests(IndexTestCase):
+
+    """the saves and deletes of the songs and artists keep the index (in rows) equal to a rebuild (see indexing.py)"""
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        """three songs of two artists"""
+
+        cls.artist = Artist.objects.create(name='周杰伦', original_id='1', original_url='/artist?id=1', intro='台湾歌手')
+        cls.other = Artist.objects.create(name='林俊杰', original_id='2', original_url='/artist?id=2', intro='新加坡歌手')
+        cls.sunny = Song.objects.create(name='晴天', original_id='3', original_url='/song?id=3', lyrics='hello hello world')
+        cls.rainy = Song.objects.create(name='雨天', original_id='4', original_url='/song?id=4', lyrics='hello there')
+        cls.cloudy = Song.objects.create(name='阴天', original_id='5', original_url='/song?id=5', lyrics='江南')
+        cls.sunny.artist.add(cls.artist)
+        cls.rainy.artist.add(cls.artist)
+        cls.cloudy.artist.add(cls.other)
+
+    def dfs(self) -> dict[str, dict[str, int]]:
+
+        """the df of each segment"""
+
+        return {
+            'song': dict(SongSegment.objects.values_list('token', 'df')),
+            'artist': dict(ArtistSegment.objects.values_list('token', 'df')),
+        }
+
+    def test_orm_changes_match_rebuild(self) -> None:
+        self.build()
+        rainy_id = self.rainy.id
+        self.assertEqual(SongSegment.objects.get(token='hello').df, 2)
+        # the thread of the queue waits, the documents are indexed by the flush in this thread
+        with index_queue.held():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.sunny.lyrics = 'goodbye world'
+                self.sunny.save()
+                self.rainy.delete()
+                song = Song.objects.create(name='多云', original_id='6', original_url='/song?id=6', lyrics='hello again')
+                song.artist.add(self.other)
+                self.other.name = '林俊杰JJ'
+                self.other.save()
+                self.cloudy.artist.remove(self.other)
+                self.artist.delete()
+            self.assertEqual(index_queue.pending['song'], {self.sunny.id, rainy_id, self.cloudy.id, song.id})
+            counts = index_queue.flush()
+        self.assertEqual(counts['documents'], 6)
+
+        updated, dfs = self.postings(), self.dfs()
+        # the df goes down with the documents gone, a segment of no document is deleted
+        self.assertEqual(updated['song']['hello'], {song.id: 1})
+        self.assertEqual(dfs['song']['hello'], 1)
+        self.assertNotIn('there', dfs['song'])
+        self.assertNotIn('周杰伦', dfs['song'])
+        self.assertNotIn('周杰伦', dfs['artist'])
+        self.assertEqual(self.build(), updated)
+        self.assertEqual(self.dfs(), dfs)
+
+class IndexQueueRetryTests(SimpleTestCase):
+
+    """a batch the queue's thread fails to index is tried again, then recorded for construct_inverted_index --changes"""
+
+    def setUp(self) -> None:
+
+        """the changes file of the documents not indexed in a temporary folder"""
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'index_failed.json')
+        failed_file = override_settings(SONG_INDEX_FAILED=self.path)
+        failed_file.enable()
+        self.addCleanup(failed_file.disable)
+
+    def wait(self, done) -> None:
+
+        """wait for the thread of the queue until done() (5 seconds at most)"""
+
+        deadline = time.monotonic() + 5
+        while not done():
+            self.assertLess(time.monotonic(), deadline, "the queue's thread didn't get there")
+            time.sleep(0.01)
+
+    def test_failed_batch_is_retried(self) -> None:
+        queue = IndexQueue(delay=0.01)
+        with mock.patch('song.indexing.update_index', side_effect=[RuntimeError('database is locked'), {}]) as update, \
+                self.assertLogs('song.indexing', 'ERROR'):
+            queue.add('song', {1, 2})
+            self.wait(lambda: update.call_count == 2 and not queue.pending['song'] and not queue.attempts['song'])
+        self.assertEqual(sorted(update.call_args.args[1]), [1, 2])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_failing_batch_is_recorded(self) -> None:
+        queue = IndexQueue(delay=0.01)
+        with mock.patch('song.indexing.update_index', side_effect=RuntimeError('no such table')) as update, \
+                self.assertLogs('song.indexing', 'ERROR') as logs:
+            queue.add('artist', {3})
+            self.wait(lambda: any('were not indexed' in line for line in logs.output))
+        self.assertEqual(update.call_count, MAX_ATTEMPTS)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            changes = json.load(f)
+        self.assertEqual(changes['artists'], {'changed': [3], 'deleted': []})
+        self.assertEqual(changes['songs'], {'changed': [], 'deleted': []})
+
+    def test_failing_flush_is_recorded(self) -> None:
+        queue = IndexQueue()
+        with queue.held(flush=False):
+            queue.add('song', {4})
+            with mock.patch('song.indexing.update_index', side_effect=RuntimeError('no such table')), \
+                    self.assertRaises(RuntimeError):
+                queue.flush()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['songs']['changed'], [4])
+
+class BlobIndexTests(IndexTestCase):
+
+    """an index built in blobs gives the postings of the one built in rows (see construct_inverted_index --storage)"""
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        """songs and artists sharing tokens, so some postings are long"""
+
+        artist = Artist.objects.create(name='周杰伦', original_id='1', original_url='/artist?id=1', intro='台湾 歌手')
+        for number in range(12):
+            song = Song.objects.create(
+                name=f'晴天 {number}', original_id=str(100 + number), original_url=f'/song?id={100 + number}',
+                lyrics='故事的小黄花 从出生那年就飘着 ' * (1 + number % 3) + ('刮风这天' if number % 2 else '')
+            )
+            song.artist.add(artist)
+
+    def test_blobs_match_rows(self) -> None:
+        rows = self.build('rows')
+        self.assertFalse(SongSegment.objects.filter(postings__isnull=False).exists())
+        blobs = self.build('blobs')
+        self.assertFalse(SongIndex.objects.exists())
+        self.assertFalse(ArtistIndex.objects.exists())
+        self.assertFalse(SongSegment.objects.filter(postings__isnull=True).exists())
+        self.assertEqual(blobs, rows)
+        # a token of every song
+        self.assertEqual(len(blobs['song']['晴天']), 12)
+
+    def document_segments(self) -> dict[int, dict[str, int]]:
+
+        """the tokens and tfs of each song document, as the indexer keeps them"""
+
+        tokens = dict(SongSegment.objects.values_list('id', 'token'))
+        return {
+            doc_id: {tokens[segment_id]: tf for segment_id, tf in zip(*decode_postings(segments))}
+            for doc_id, segments in SongDocument.objects.values_list('article_id', 'segments')
+        }
+
+    def test_update_blobs_matches_rebuild(self) -> None:
+        self.build('blobs')
+        songs = list(Song.objects.order_by('id'))
+        songs[0].lyrics = '完全不同的歌词'
+        songs[0].save()
+        deleted_id = songs[1].id
+        songs[1].delete()
+        new_song = Song.objects.create(name='七里香', original_id='999', original_url='/song?id=999', lyrics='窗外的麻雀')
+        with CaptureQueriesContext(connection) as queries:
+            update_index('song', [songs[0].id, deleted_id, new_song.id])
+        # only the segments of the documents are read
+        for query in queries.captured_queries:
+            selected, _, tables = query['sql'].partition(' FROM ')
+            if selected.startswith('SELECT') and '"song_songsegment"."postings"' in selected:
+                self.assertRegex(tables, r'WHERE "song_songsegment"\."(id|token)" IN')
+        updated, updated_documents = self.postings(), self.document_segments()
+        self.assertEqual(self.build('blobs'), updated)
+        self.assertEqual(self.document_segments(), updated_documents)
+        self.assertNotIn(deleted_id, updated_documents)
+
+
+class TokenCacheTests(SimpleTestCase):
+
+    """the token cache keeps the tokens of the texts, bounded in size (see token_cache.py)"""
+
+    def setUp(self) -> None:
+
+        """a cache in a temporary folder, and a tokenization that counts its calls"""
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'tokens.sqlite3')
+        self.calls = []
+
+    def open(self, max_bytes: int = 1024 * 1024) -> TokenCache:
+
+        """a cache on the file, closed at the end of the test"""
+
+        cache = TokenCache(self.path, max_bytes)
+        self.addCleanup(cache.connection.close)
+        return cache
+
+    def tokenize(self, text: str) -> list[str]:
+        self.calls.append(text)
+        return text.split()
+
+    def test_hit_and_miss(self) -> None:
+        cache = self.open()
+        self.assertEqual(cache.tokens('segments', 'one two three', self.tokenize), ['one', 'two', 'three'])
+        self.assertEqual(cache.tokens('segments', 'one two three', self.tokenize), ['one', 'two', 'three'])
+        # another kind of tokens of the same text
+        cache.tokens('query', 'one two three', self.tokenize)
+        self.assertEqual(self.calls, ['one two three', 'one two three'])
+        self.assertEqual((cache.counts['hits'], cache.counts['misses']), (1, 2))
+        # written, another process finds them
+        cache.flush()
+        other = self.open()
+        other.tokens('segments', 'one two three', self.tokenize)
+        self.assertEqual(other.counts['hits'], 1)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_texts_are_kept_as_they_are(self) -> None:
+        cache = self.open()
+        # the texts differing in their spaces, line ends or Unicode forms are other entries
+        texts = ['caf\u00e9 line\nend', 'cafe\u0301 line\r\nend', ' caf\u00e9 line\nend ']
+        for text in texts:
+            self.assertEqual(cache.tokens('segments', text, self.tokenize), text.split())
+        self.assertEqual(self.calls, texts)
+        self.assertEqual(cache.counts['misses'], 3)
+
+    def test_eviction_of_the_least_recently_used(self) -> None:
+        texts = [f"text number {number}" for number in range(3)]
+        # the bytes of an entry, its tokens in json
+        size = len(json.dumps(texts[0].split(), ensure_ascii=False).encode('utf-8'))
+        cache = self.open(max_bytes=2 * size + size // 2)
+        cache.tokens('segments', texts[0], self.tokenize)
+        cache.tokens('segments', texts[1], self.tokenize)
+        cache.flush()
+        time.sleep(0.01)
+        # the first is used again, the second is the least recently used
+        cache.tokens('segments', texts[0], self.tokenize)
+        cache.tokens('segments', texts[2], self.tokenize)
+        cache.flush()
+        self.assertEqual(cache.counts['evicted'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+        del self.calls[:]
+        for text in texts:
+            cache.tokens('segments', text, self.tokenize)
+        self.assertEqual(self.calls, [texts[1]])
+
+    def test_new_tokenizer_version_misses(self) -> None:
+        cache = self.open()
+        cache.tokens('segments', 'one two three', self.tokenize)
+        cache.flush()
+        with mock.patch.object(token_cache, 'TOKENIZER_VERSION', token_cache.TOKENIZER_VERSION + 1):
+            newer = self.open()
+        newer.tokens('segments', 'one two three', self.tokenize)
+        self.assertEqual(newer.counts['misses'], 1)
+        self.assertEqual(len(self.calls), 2)
+
+
+class ThumbnailFilterTests(SimpleTestCase):
+
+    """the pages show the webp thumbnail of an image when there is one, else the image (see templatetags/song_images.py)"""
+
+    def test_image_without_thumbnail(self) -> None:
+        self.assertEqual(thumbnail('song/images/song0.jpg'), 'song/images/song0.jpg')
+
+    def test_image_with_thumbnail(self) -> None:
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, 'song', 'thumbs'))
+            open(os.path.join(folder, 'song', 'thumbs', 'song0.webp'), 'wb').close()
+            with override_settings(STATICFILES_DIRS=[folder]):
+                self.assertEqual(thumbnail('song/images/song0.jpg'), 'song/thumbs/song0.webp')
+
+
+# the records of the crawler the loader is tested on: two artists and their songs
+SAVED_INFO = settings.BASE_DIR.parent / 'saved_info'
+FIXTURE_ARTISTS = ('15199791', '29804746')
+
+class LoaderTests(TestCase):
+
+    """load_songs_artists gives the same data base in all its modes (see --bulk, --incremental and --workers)"""
+
+    def setUp(self) -> None:
+
+        """a copy of the records of the fixture artists and of their songs in a temporary folder"""
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.song_info = os.path.join(folder.name, 'song_info')
+        self.artist_info = os.path.join(folder.name, 'artist_info')
+        self.manifest = os.path.join(folder.name, 'load_manifest.json')
+        for directory in ('song_info/song_intro', 'artist_info/artist_intro', 'artist_info/artist_song_ids'):
+            os.makedirs(os.path.join(folder.name, directory))
+        for artist_id in FIXTURE_ARTISTS:
+            shutil.copy(SAVED_INFO / f'artist_info/artist_intro/artist{artist_id}.json', self.artist_path(artist_id))
+            shutil.copy(SAVED_INFO / f'artist_info/artist_song_ids/artist{artist_id}songs.json', self.songs_path(artist_id))
+            for song_id in self.read(self.songs_path(artist_id)):
+                shutil.copy(SAVED_INFO / f'song_info/song_intro/song{song_id}.json', self.song_path(song_id))
+
+    def song_path(self, song_id) -> str:
+        return os.path.join(self.song_info, 'song_intro', f'song{song_id}.json')
+
+    def artist_path(self, artist_id) -> str:
+        return os.path.join(self.artist_info, 'artist_intro', f'artist{artist_id}.json')
+
+    def songs_path(self, artist_id) -> str:
+        return os.path.join(self.artist_info, 'artist_song_ids', f'artist{artist_id}songs.json')
+
+    def read(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write(self, path: str, data) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def load(self, **options) -> str:
+
+        """run the loader on the copy (without pool or index, unless the options say so), and give its output"""
+
+        out = StringIO()
+        call_command(
+            'load_songs_artists', song_info_path=self.song_info, artist_info_path=self.artist_info,
+            manifest=self.manifest, **{'workers': 0, 'skip_index': True, **options}, stdout=out
+        )
+        return out.getvalue()
+
+    def database(self) -> tuple[list, list, list]:
+
+        """the songs, the artists and their links, without the primary keys of the data base"""
+
+        songs = sorted(Song.objects.values_list(
+            'original_id', 'name', 'alias', 'original_url', 'lyrics', 'lyrics_group'
+        ), key=str)
+        artists = sorted(Artist.objects.values_list(
+            'original_id', 'name', 'alias', 'original_url', 'intro', 'history', 'master_work', 'milestones'
+        ), key=str)
+        links = sorted(Song.artist.through.objects.values_list(
+            'song__original_id', 'artist__original_id', 'artist__name'
+        ), key=str)
+        return songs, artists, links
+
+    def test_bulk_matches_plain(self) -> None:
+        self.load()
+        plain = self.database()
+        self.assertEqual(len(plain[0]), 29)
+        self.assertEqual(sum(1 for artist in plain[1] if artist[0] is not None), 2)
+        self.load(clear=True, bulk=True)
+        self.assertEqual(self.database(), plain)
+
+    def test_incremental_matches_full_load(self) -> None:
+        self.load(incremental=True)
+        # the files read by the next loads
+        reads = []
+        file_reader = manifest.file_reader
+
+        def counting_reader(path: str):
+            read = file_reader(path)
+            return lambda: reads.append(path) or read()
+
+        with mock.patch.object(manifest, 'file_reader', counting_reader):
+            out = self.load(incremental=True)
+            self.assertEqual(reads, [])
+            self.assertIn("0 songs and 0 artists new or changed, 0 songs and 0 artists deleted", out)
+
+            # a song edited, a song removed (with its artist's link) and a song added
+            song_ids = self.read(self.songs_path(FIXTURE_ARTISTS[0]))
+            edited, removed = song_ids[0], song_ids[1]
+            record = self.read(self.song_path(edited))
+            record['name'] += ' (live)'
+            self.write(self.song_path(edited), record)
+            os.remove(self.song_path(removed))
+            self.write(self.songs_path(FIXTURE_ARTISTS[0]), [id for id in song_ids if id != removed])
+            added = next(
+                path for path in sorted((SAVED_INFO / 'song_info/song_intro').glob('*.json'))
+                if not os.path.exists(self.song_path(path.stem[len('song'):]))
+            )
+            shutil.copy(added, self.song_path(added.stem[len('song'):]))
+            out = self.load(incremental=True)
+
+        self.assertCountEqual(reads, [
+            self.song_path(edited), self.songs_path(FIXTURE_ARTISTS[0]), self.song_path(added.stem[len('song'):])
+        ])
+        self.assertIn("2 songs and 0 artists new or changed, 1 songs and 0 artists deleted", out)
+        self.assertTrue(Song.objects.filter(original_id=str(edited), name__endswith=' (live)').exists())
+        self.assertFalse(Song.objects.filter(original_id=str(removed)).exists())
+        incremental = self.database()
+        self.load(clear=True)
+        self.assertEqual(self.database(), incremental)
+
+    def test_decode_pool_matches_this_process(self) -> None:
+        # a file that isn't json is reported and skipped
+        broken = self.song_path(1)
+        with open(broken, 'w', encoding='utf-8') as f:
+            f.write('{"id": 1, "name": ')
+        in_process = self.load(workers=0)
+        database = self.database()
+        pooled = self.load(clear=True, workers=2)
+        self.assertEqual(self.database(), database)
+        self.assertEqual(len(database[0]), 29)
+        for out in (in_process, pooled):
+            self.assertIn(f"skipped {broken}: ", out)
+        # the records and errors of each collection (the songs are gone through twice)
+        decoded = re.findall(r"decoding ([a-z ]+): ([0-9]+) records \(([0-9]+) skipped\)", in_process)
+        self.assertEqual(re.findall(r"decoding ([a-z ]+): ([0-9]+) records \(([0-9]+) skipped\)", pooled), decoded)
+        self.assertEqual(decoded, [('songs', '58', '2'), ('artists', '2', '0'), ('artist songs', '2', '0')])
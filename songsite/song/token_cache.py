@@ -0,0 +1,263 @@
+"""a persistent cache of the tokens of the strings, so the same text isn't tokenized twice.
+
+The tokens of a string (see tokenize.py) are kept in an sqlite file, keyed by the hash
+of the kind of tokens, the version of the tokenizer (TOKENIZER_VERSION, raised when
+the tokenization changes), the version of jieba and its dictionary, and the exact
+text (a hit gives what the tokenizer gives for that text, nothing else). An
+index rebuild then only tokenizes the strings it hasn't seen, and the entries of an
+older tokenizer or dictionary are never used again and leave the cache as the least
+recently used ones.
+
+The file is bounded by max_bytes: when it holds more, the least recently used entries
+are evicted. The processes of the index builder's pool share the file (each with its
+own TokenCache), and so do the indexer and the search view of the site: the entries
+and uses of each are kept in memory and written together (see TokenCache.flush).
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+import jieba
+
+# raised when the tokens of a string change (see tokenize.segments_in_str)
+TOKENIZER_VERSION = 1
+# the strings shorter than that are tokenized about as fast as they are looked up
+MIN_LENGTH = 4
+# the entries and uses kept in memory before they are written
+FLUSH_EVERY = 2000
+
+def dictionary_version() -> str:
+
+    """the version of jieba and of its dictionary file (its path, size and modification time)"""
+
+    path = jieba.dt.dictionary or os.path.join(os.path.dirname(jieba.__file__), jieba.DEFAULT_DICT_NAME)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return f"jieba {jieba.__version__} {path}"
+    return f"jieba {jieba.__version__} {path} {stat.st_size}:{stat.st_mtime_ns}"
+
+class TokenCache:
+
+    """the tokens of the strings, in an sqlite file bounded in size, with least recently used eviction
+
+    Attributes:
+        path (str): the sqlite file
+        max_bytes (int): the most bytes of tokens kept
+        version (str): what the keys depend on but the text (see key)
+        connection (sqlite3.Connection): the connection to the file
+        lock (threading.Lock): serializes the accesses of the threads
+        new (dict[bytes, str]): the tokens (json) of the keys missed, not written yet
+        used (dict[bytes, float]): the time of the last use of the keys hit, not written yet
+        counts (dict[str, int]): the hits, misses and evictions of this cache
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+
+        """open the cache, making it if it doesn't exist"""
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = f"{TOKENIZER_VERSION} {dictionary_version()}"
+        self.lock = threading.Lock()
+        self.new: dict[bytes, str] = {}
+        self.used: dict[bytes, float] = {}
+        self.counts = {'hits': 0, 'misses': 0, 'evicted': 0}
+        # the processes of a pool write to the same file, they wait for each other
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                "key BLOB PRIMARY KEY, tokens TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS tokens_used ON tokens (used)")
+            # the bytes of all the entries, kept up to date by the writes (one process makes its row)
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS total (bytes INTEGER NOT NULL)")
+                if self.connection.execute("SELECT COUNT(*) FROM total").fetchone()[0] == 0:
+                    self.connection.execute("INSERT INTO total (bytes) SELECT COALESCE(SUM(size), 0) FROM tokens")
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def key(self, kind: str, text: str) -> bytes:
+
+        """the key of the tokens of a kind of a text"""
+
+        return hashlib.blake2b(f"{kind}\0{self.version}\0{text}".encode('utf-8'), digest_size=16).digest()
+
+    def tokens(self, kind: str, text: str, tokenize: Callable[[str], list[str]]) -> list[str]:
+
+        """the tokens of the text, from the cache or tokenized (and kept)
+
+        Args:
+            kind (str): the kind of tokens (what tokenize gives)
+            text (str): the text
+            tokenize (Callable[[str], list[str]]): the tokenization of the text
+
+        Returns:
+            tokens (list[str]): what tokenize(text) gives
+        """
+
+        if len(text) < MIN_LENGTH:
+            return tokenize(text)
+        key = self.key(kind, text)
+        with self.lock:
+            found = self.new.get(key)
+            if found is None:
+                row = self.connection.execute("SELECT tokens FROM tokens WHERE key = ?", (key,)).fetchone()
+                found = row[0] if row is not None else None
+            if found is not None:
+                self.counts['hits'] += 1
+                self.used[key] = time.time()
+                pending = len(self.used)
+            else:
+                self.counts['misses'] += 1
+        if found is None:
+            tokens = tokenize(text)
+            with self.lock:
+                self.new[key] = json.dumps(tokens, ensure_ascii=False)
+                pending = len(self.new) + len(self.used)
+        else:
+            tokens = json.loads(found)
+        if pending >= FLUSH_EVERY:
+            self.flush()
+        return tokens
+
+    def flush(self) -> None:
+
+        """write the entries and uses kept in memory, then evict the least recently used entries over max_bytes"""
+
+        with self.lock:
+            if not self.new and not self.used:
+                return
+            now = time.time()
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                added = 0
+                for key, tokens in self.new.items():
+                    size = len(tokens.encode('utf-8'))
+                    cursor = self.connection.execute(
+                        "INSERT OR IGNORE INTO tokens (key, tokens, size, used) VALUES (?, ?, ?, ?)",
+                        (key, tokens, size, now)
+                    )
+                    # another process may have added it
+                    added += size * cursor.rowcount
+                self.connection.executemany(
+                    "UPDATE tokens SET used = ? WHERE key = ?", [(used, key) for key, used in self.used.items()]
+                )
+                self.connection.execute("UPDATE total SET bytes = bytes + ?", (added,))
+                self.evict()
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.new.clear()
+            self.used.clear()
+
+    def evict(self) -> None:
+
+        """evict the least recently used entries down to 9/10 of max_bytes (hold the lock, in a transaction)"""
+
+        total = self.connection.execute("SELECT bytes FROM total").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes * 9 // 10
+        keys, freed = [], 0
+        for key, size in self.connection.execute("SELECT key, size FROM tokens ORDER BY used"):
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+        self.connection.executemany("DELETE FROM tokens WHERE key = ?", keys)
+        self.connection.execute("UPDATE total SET bytes = bytes - ?", (freed,))
+        self.counts['evicted'] += len(keys)
+
+    def clear(self) -> None:
+
+        """remove all the entries"""
+
+        with self.lock:
+            self.new.clear()
+            self.used.clear()
+            self.connection.execute("DELETE FROM tokens")
+            self.connection.execute("UPDATE total SET bytes = 0")
+
+    def stats(self) -> dict[str, float]:
+
+        """the hits, misses, hit rate and evictions of this cache, and the entries and bytes of the file"""
+
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+            total = self.connection.execute("SELECT bytes FROM total").fetchone()[0]
+            lookups = self.counts['hits'] + self.counts['misses']
+            return dict(
+                self.counts, **{'hit rate': self.counts['hits'] / lookups if lookups else 0.0},
+                entries=entries + len(self.new), bytes=total
+            )
+
+    def close(self) -> None:
+
+        """write what is kept in memory and close the connection"""
+
+        self.flush()
+        with self.lock:
+            self.connection.close()
+
+# where the cache of the process is (see configure), and the cache opened by the process
+_cache_path: str | None = None
+_cache_bytes = 256 * 1024 * 1024
+_cache: TokenCache | None = None
+_cache_pid: int | None = None
+_cache_lock = threading.Lock()
+
+def configure(path: str | None, max_bytes: int = 256 * 1024 * 1024) -> None:
+
+    """use the cache at the path in this process and the processes it starts (no cache if None)"""
+
+    global _cache_path, _cache_bytes, _cache
+    with _cache_lock:
+        if _cache is not None and _cache_pid == os.getpid():
+            _cache.close()
+        _cache_path = str(path) if path is not None else None
+        _cache_bytes = max_bytes
+        _cache = None
+
+def get_cache() -> TokenCache | None:
+
+    """the cache of this process, opened at the first use (None if there is none)"""
+
+    global _cache, _cache_pid
+    with _cache_lock:
+        if _cache_path is None:
+            return None
+        # a forked process gets its own connection
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = TokenCache(_cache_path, _cache_bytes)
+            _cache_pid = os.getpid()
+            # what is kept in memory is written at the end of the process
+            atexit.register(_cache.flush)
+        return _cache
+
+def cache_settings() -> tuple[str | None, int]:
+
+    """the path and size of the cache of this process, for configure(...) in the processes it starts"""
+
+    return _cache_path, _cache_bytes
+
+def cached_tokens(kind: str, text: str, tokenize: Callable[[str], list[str]]) -> list[str]:
+
+    """the tokens of the text, through the cache of the process if there is one (see TokenCache.tokens)"""
+
+    cache = get_cache()
+    if cache is None:
+        return tokenize(text)
+    return cache.tokens(kind, text, tokenize)
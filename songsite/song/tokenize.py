@@ -0,0 +1,142 @@
+"""the tokenization of the documents of the inverted index (see construct_inverted_index).
+
+A string gives the tokens of jieba's search mode longer than a character, and each of
+its characters but the punctuation and the spaces. A document gives the tokens of its
+strings:
+    songs: the name, alias, lyrics and artists' names
+    artists: the name, alias, intro, history, master works and milestones
+and the term frequency of each token.
+
+The documents are tokenized in the processes of the index builder's pool (see
+construct_inverted_index --workers), so this module doesn't use the data base: a
+document is the tuple of its id and strings, and a task gives the postings of its
+documents, merged by the builder. jieba loads its dictionary once in each process
+(see init_worker).
+
+The tokens of the strings (and of the queries of the search) go through the token
+cache of the process, when there is one (see token_cache.py).
+"""
+
+import time
+import jieba
+from song.token_cache import cache_settings, cached_tokens, configure, get_cache
+
+# the characters that are not tokens
+COMMON_CHARS = {',', ' ', '.', '"', "'", '，', '‘', '’', '“', '”', '。', ':', '：', '\n', '?',
+                '？', '!', '！', '(', ')', '（', '）', '-', '——', ';', '；'}
+
+# a document: its id, and its strings (or lists of strings, None when it has none)
+Document = tuple[int, tuple]
+# the id and term frequency of the documents of each token
+Postings = dict[str, list[tuple[int, int]]]
+
+def worker_settings() -> tuple:
+
+    """the arguments of init_worker in the processes of a pool started by this process"""
+
+    return cache_settings()
+
+def init_worker(cache_path: str | None = None, cache_bytes: int = 0) -> None:
+
+    """use the token cache of the process that started the pool, and load jieba's dictionary once"""
+
+    if cache_path is not None:
+        configure(cache_path, cache_bytes)
+    jieba.initialize()
+
+def segments_in_str(in_str: str) -> list[str]:
+
+    """the tokens of a string (see split_segments), through the token cache"""
+
+    return cached_tokens('segments', in_str, split_segments)
+
+def query_segments(query: str) -> list[str]:
+
+    """the tokens of a query of the search (jieba's search mode), through the token cache"""
+
+    return cached_tokens('query', query, lambda text: list(jieba.cut_for_search(text)))
+
+def split_segments(in_str: str) -> list[str]:
+
+    """extract tokens from a string.
+
+    This function extract tokens (except the too common onse) from the input string.
+
+    Args:
+        in_str (str): the input string
+
+    Returns:
+        tokens/segments_list (list[str]): the list of tokens
+    """
+
+    segments = []
+    for segment in jieba.cut_for_search(in_str):
+        if len(segment.strip()) > 1:
+            segments.append(segment.strip())
+    for char in in_str:
+        if char not in COMMON_CHARS:
+            segments.append(char)
+    return segments
+
+def song_document(song) -> Document:
+
+    """the document of a song (with its artists prefetched)"""
+
+    return song.id, (song.name, song.alias, song.lyrics, [artist.name for artist in song.artist.all()])
+
+def artist_document(artist) -> Document:
+
+    """the document of an artist"""
+
+    return artist.id, (
+        artist.name, artist.alias, artist.intro, artist.history, artist.master_work, artist.milestones
+    )
+
+def segments_in_document(strings: tuple) -> list[str]:
+
+    """the tokens of the strings of a document, in order"""
+
+    segments = []
+    for value in strings:
+        if value is None:
+            continue
+        for string in ([value] if isinstance(value, str) else value):
+            segments.extend(segments_in_str(string))
+    return segments
+
+def term_frequencies(segments: list[str]) -> dict[str, int]:
+
+    """the frequency of each token of the list, in the order they first appear"""
+
+    segment_data = {}
+    for segment in segments:
+        if segment in segment_data:
+            segment_data[segment] += 1
+        else:
+            segment_data[segment] = 1
+    return segment_data
+
+def tokenize_documents(documents: list[Document]) -> tuple[Postings, int, float, dict[str, int]]:
+
+    """the postings of the documents (run in the builder's pool)
+
+    Returns:
+        postings (Postings): the documents of each token, in the order of the documents
+        count (int): the number of documents
+        seconds (float): the time spent
+        cache_counts (dict[str, int]): the hits and misses of the token cache
+    """
+
+    start = time.perf_counter()
+    cache = get_cache()
+    before = dict(cache.counts) if cache is not None else {}
+    postings: Postings = {}
+    for doc_id, strings in documents:
+        for segment, tf in term_frequencies(segments_in_document(strings)).items():
+            postings.setdefault(segment, []).append((doc_id, tf))
+    cache_counts = {}
+    if cache is not None:
+        # the processes of a pool end without writing what their cache kept
+        cache.flush()
+        cache_counts = {key: cache.counts[key] - before[key] for key in ('hits', 'misses')}
+    return postings, len(documents), time.perf_counter() - start, cache_counts
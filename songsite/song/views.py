@@ -9,7 +9,8 @@ from django.core.cache import cache
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from .models import Song, Artist, Comment, SongSegment, SongIndex, ArtistSegment, ArtistIndex
-import jieba
+from .postings import segment_postings
+from .tokenize import query_segments
 import math
 import time
 import hashlib
@@ -220,7 +221,7 @@ def check(request):
             elapsed_time = cached_results['elapsed_time']
             start_time = time.time() # pagination time
         else:
-            query_seg = jieba.cut_for_search(query)
+            query_seg = query_segments(query) # through the token cache (see token_cache.py)
             found_doc = False # a flag for whether there is doc found
             tfidf_list = [] # the tfidf for each token in each doc
 
@@ -265,11 +266,11 @@ def check(request):
                         # document, and append this dict to the tfidf_list
                         if not found_doc:
                             found_doc = True
-                        index_set = song_seg.songindex_set.all()
                         idf = math.log(N / song_seg.df)
                         tfidf = {}
-                        for index in index_set:
-                            tfidf[index.article_id] = index.tf * idf
+                        # the postings from the segment's blob, or its rows (see postings.py)
+                        for article_id, tf in segment_postings(song_seg, song_seg.songindex_set):
+                            tfidf[article_id] = tf * idf
                         tfidf_list.append(tfidf)
             else:
                 # the client chose to search on artists, the total number of doc should be the 
@@ -286,11 +287,11 @@ def check(request):
                         # document, and append this dict to the tfidf_list
                         if not found_doc:
                             found_doc = True
-                        index_set = artist_seg.artistindex_set.all()
                         idf = math.log(N / artist_seg.df)
                         tfidf = {}
-                        for index in index_set:
-                            tfidf[index.article_id] = index.tf * idf
+                        # the postings from the segment's blob, or its rows (see postings.py)
+                        for article_id, tf in segment_postings(artist_seg, artist_seg.artistindex_set):
+                            tfidf[article_id] = tf * idf
                         tfidf_list.append(tfidf)
 
             # if no doc is found by this query, return a page with an error message
@@ -129,3 +129,20 @@ CACHES = {
         'LOCATION': 'unique-snowflake',
     }
 }
+
+# leave the songs that are near duplicates of another song out of the incremental
+# index updates (as construct_inverted_index --collapse_duplicates, see song/indexing.py)
+SONG_INDEX_COLLAPSE_DUPLICATES = False
+
+# the changes file of the documents the index queue failed to index, for
+# construct_inverted_index --changes (see song/indexing.py)
+SONG_INDEX_FAILED = BASE_DIR / 'index_failed.json'
+
+# the persistent cache of the tokens of the texts indexed and searched (None for no
+# cache), and the most bytes of tokens it keeps (see song/token_cache.py)
+SONG_TOKEN_CACHE = BASE_DIR / 'token_cache.sqlite3'
+SONG_TOKEN_CACHE_BYTES = 256 * 1024 * 1024
+
+# how the postings of the inverted index are stored: 'rows' (a SongIndex row each) or
+# 'blobs' (compressed, a blob per segment), see song/postings.py
+SONG_INDEX_STORAGE = 'rows'
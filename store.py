@@ -1,11 +1,42 @@
 """a module that stores the path to the directory for storing the information.
 
-This module contains three paths:
+All paths are under SAVED_INFO_PATH, which can be moved with the environment
+variable SONG_CURL_SAVED_INFO (e.g. when crawling a local stand-in of the site).
+
+This module contains these paths:
+    SAVED_INFO_PATH: the root directory of all crawled information
+    ARTIST_HREFS_PATH: the json file of the artists' hrefs
     ARTIST_SONG_IDS_PATH: stores each artist's corresponding song ids
+    ARTIST_INTRO_PATH: stores each artist's intro
+    ARTIST_IMAGE_PATH: stores each artist's image
+    ARTIST_THUMB_PATH: stores each artist's image thumbnail
     SONG_IMAGE_PATH: stores each song's image
+    SONG_THUMB_PATH: stores each song's image thumbnail
     SONG_INTRO_PATH: stores each song's intro
+    CRAWL_STATE_PATH: the sqlite file of the crawl state (frontier, done, failed urls)
+    HTTP_CACHE_PATH: the on-disk cache of the http responses
+    IMAGE_STORE_PATH: the images stored once by their content hash
+    CRAWL_REPORT_PATH: the json reports of the crawls' timings and counters
+    CORPUS_PATH: the packed store of the songs', artists' and artist songs' records
 """
 
-ARTIST_SONG_IDS_PATH = "C:/Chris Liu/清华/25暑期/python-course/song_curl/saved_info/artist_info/artist_song_ids"
-SONG_IMAGE_PATH = "C:/Chris Liu/清华/25暑期/python-course/song_curl/saved_info/song_info/song_image"
-SONG_INTRO_PATH = "C:/Chris Liu/清华/25暑期/python-course/song_curl/saved_info/song_info/song_intro"
\ No newline at end of file
+import os
+
+SAVED_INFO_PATH = os.environ.get(
+    "SONG_CURL_SAVED_INFO",
+    "C:/Chris Liu/清华/25暑期/python-course/song_curl/saved_info"
+)
+
+ARTIST_HREFS_PATH = f"{SAVED_INFO_PATH}/artist_hrefs.json"
+ARTIST_SONG_IDS_PATH = f"{SAVED_INFO_PATH}/artist_info/artist_song_ids"
+ARTIST_INTRO_PATH = f"{SAVED_INFO_PATH}/artist_info/artist_intro"
+ARTIST_IMAGE_PATH = f"{SAVED_INFO_PATH}/artist_info/artist_images"
+ARTIST_THUMB_PATH = f"{SAVED_INFO_PATH}/artist_info/artist_thumbs"
+SONG_IMAGE_PATH = f"{SAVED_INFO_PATH}/song_info/song_image"
+SONG_THUMB_PATH = f"{SAVED_INFO_PATH}/song_info/song_thumbs"
+SONG_INTRO_PATH = f"{SAVED_INFO_PATH}/song_info/song_intro"
+CRAWL_STATE_PATH = f"{SAVED_INFO_PATH}/crawl_state.sqlite3"
+HTTP_CACHE_PATH = f"{SAVED_INFO_PATH}/http_cache"
+IMAGE_STORE_PATH = f"{SAVED_INFO_PATH}/image_store"
+CRAWL_REPORT_PATH = f"{SAVED_INFO_PATH}/crawl_reports"
+CORPUS_PATH = f"{SAVED_INFO_PATH}/corpus"
@@ -0,0 +1,465 @@
+"""the tests of the crawlers, against the local replay server of the crawled info (see replay_server.py).
+
+Run them from this folder with: python -m unittest tests
+
+The replay server serves SONG_CURL_SAVED_INFO (the saved_info folder here if it is not
+set) from a process of its own. The crawlers of the tests write into a temporary folder:
+the variable is pointed to it before they are imported (see store.py), and the folder is
+removed at the end.
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SAVED_INFO = os.environ.get('SONG_CURL_SAVED_INFO') or os.path.join(ROOT, 'saved_info')
+OUTPUT = tempfile.mkdtemp(prefix='song_curl_tests_')
+os.environ['SONG_CURL_SAVED_INFO'] = OUTPUT
+
+import requests
+from async_song_curl import AsyncSongCrawler, TokenBucket
+from browser_pool import DriverPool
+from corpus_store import CorpusStore, corpus
+from crawl_state import CrawlState, DONE, FAILED, FRONTIER
+from http_cache import HttpCache, CacheMiss
+from image_pipeline import ImagePipeline
+from replay_server import ReplayServer
+from requests_get import RequestsGet, HEADERS, COOKIES
+from store import SONG_IMAGE_PATH
+
+# two artists of saved_info with few songs (11 and 18)
+ARTISTS = [15199791, 29804746]
+# an artist the replay server doesn't know (answered with a 404)
+UNKNOWN_ARTIST = 1
+# a song of the first of them
+SONG_ID = 1827600686
+
+def tearDownModule() -> None:
+    shutil.rmtree(OUTPUT, ignore_errors=True)
+
+def start_replay_server(*options: str) -> tuple[subprocess.Popen, str]:
+
+    """start the replay server of SAVED_INFO in a process of its own
+
+    Args:
+        options (str): the command line options of the server (see replay_server.py)
+
+    Returns:
+        process (subprocess.Popen): the process of the server
+        url (str): the root url of the server
+    """
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'replay_server.py'), '--port', '0', *options],
+        stdout=subprocess.PIPE, text=True, encoding='utf-8', env=dict(os.environ, SONG_CURL_SAVED_INFO=SAVED_INFO)
+    )
+    # the first line is "replaying on <url> (...)"
+    line = process.stdout.readline()
+    if not line.startswith('replaying on '):
+        process.kill()
+        raise RuntimeError(f"the replay server did not start: {line!r}")
+    return process, line.split()[2]
+
+class ReplayTestCase(unittest.TestCase):
+
+    """a test against a replay server started for its class
+
+    Attributes:
+        replay_options (tuple[str, ...]): the command line options of the server
+        server (subprocess.Popen): the process of the server
+        site_url (str): the root url of the server
+    """
+
+    replay_options: tuple[str, ...] = ()
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server, cls.site_url = start_replay_server(*cls.replay_options)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.terminate()
+        cls.server.wait()
+        cls.server.stdout.close()
+
+class TokenBucketTests(unittest.TestCase):
+
+    """the token bucket of async_song_curl lets a burst through, then paces at its rate"""
+
+    def test_burst_then_rate(self) -> None:
+        async def acquire_all(bucket: TokenBucket, count: int) -> list[float]:
+            times = []
+            for _ in range(count):
+                await bucket.acquire()
+                times.append(time.monotonic())
+            return times
+
+        start = time.monotonic()
+        times = asyncio.run(acquire_all(TokenBucket(rate=50, capacity=3), 13))
+        # the 3 tokens of the full bucket at once, then one every 1/50s
+        self.assertLess(times[2] - start, 0.02)
+        self.assertGreaterEqual(times[-1] - start, 10 / 50 - 0.005)
+
+class AsyncCrawlerTests(ReplayTestCase):
+
+    """the asyncio crawler of async_song_curl crawls the replay server within its limits"""
+
+    replay_options = ('--latency', '0.02')
+
+    def crawl(self, artist_id_list: list[int], tool: RequestsGet, state: CrawlState | None = None,
+              **options) -> CrawlState:
+
+        """crawl the artists' songs with the tool (the images with a tool of their own)
+
+        Args:
+            artist_id_list (list[int]): the artists crawled
+            tool (RequestsGet): the tool fetching the pages and the lyrics
+            state (CrawlState | None): the crawl state resumed, a new one if None
+            options: the limits of the crawler (concurrency, rate and burst)
+
+        Returns:
+            state (CrawlState): the crawl state at the end
+        """
+
+        os.makedirs(SONG_IMAGE_PATH, exist_ok=True)
+        state = state if state is not None else CrawlState(':memory:')
+        # the images are fetched by the pipeline's threads, outside the crawler's limits
+        image_tool = RequestsGet(HEADERS, COOKIES)
+        with contextlib.redirect_stdout(io.StringIO()), DriverPool(1) as pool, \
+                ImagePipeline(image_tool, workers=4) as images:
+            crawler = AsyncSongCrawler(tool, pool, images, state, site_url=self.site_url, **options)
+            asyncio.run(crawler.crawl(artist_id_list))
+        return state
+
+    def test_hosts_are_paced(self) -> None:
+        acquired = []
+        acquire = TokenBucket.acquire
+
+        async def timed_acquire(bucket: TokenBucket) -> None:
+            await acquire(bucket)
+            acquired.append(time.monotonic())
+
+        rate, burst = 50.0, 2
+        with mock.patch.object(TokenBucket, 'acquire', timed_acquire):
+            self.crawl(ARTISTS[:1], RequestsGet(HEADERS, COOKIES), concurrency=8, rate=rate, burst=burst)
+        # the artist's page, and the page, lyrics and image of each of its 11 songs
+        self.assertEqual(len(acquired), 1 + 11 * 3)
+        # in any span of time, at most the burst and the tokens added meanwhile
+        for i in range(len(acquired)):
+            for j in range(i + 1, len(acquired)):
+                self.assertLessEqual(j - i + 1, burst + rate * (acquired[j] - acquired[i] + 0.001))
+
+    def test_requests_in_flight_are_capped(self) -> None:
+        tool = RequestsGet(HEADERS, COOKIES)
+        requests_get = tool.requests_get
+        lock = threading.Lock()
+        in_flight = [0]
+        most = [0]
+
+        def counted_get(*args, **kwargs):
+            with lock:
+                in_flight[0] += 1
+                most[0] = max(most[0], in_flight[0])
+            try:
+                return requests_get(*args, **kwargs)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+        tool.requests_get = counted_get
+        state = self.crawl(ARTISTS, tool, concurrency=3, rate=1000.0, burst=1000)
+        self.assertEqual(most[0], 3)
+        self.assertEqual(state.counts()['song'], {DONE: 29})
+
+    def test_done_and_failed_are_recorded(self) -> None:
+        with open(f"{SAVED_INFO}/artist_info/artist_song_ids/artist{ARTISTS[1]}songs.json", 'r', encoding='utf-8') as f:
+            song_id_list = json.load(f)
+        failing_url = f"{self.site_url}/song?id={song_id_list[0]}"
+        tool = RequestsGet(HEADERS, COOKIES, max_retries=0)
+        requests_get = tool.requests_get
+
+        def failing_get(url: str, *args, **kwargs):
+            # the connection is lost on one song's page
+            if url == failing_url:
+                raise requests.ConnectionError("connection reset")
+            return requests_get(url, *args, **kwargs)
+
+        tool.requests_get = failing_get
+        state = self.crawl([ARTISTS[1], UNKNOWN_ARTIST], tool, rate=1000.0, burst=1000)
+        # the artist is done (its songs are stored) though one of them failed
+        self.assertEqual(state.status(f"{self.site_url}/artist?id={ARTISTS[1]}"), DONE)
+        self.assertEqual(state.status(f"{self.site_url}/artist?id={UNKNOWN_ARTIST}"), FAILED)
+        self.assertEqual(state.status(failing_url), FAILED)
+        self.assertEqual(state.counts()['song'], {DONE: 17, FAILED: 1})
+        self.assertEqual(corpus().get('artist songs', ARTISTS[1])['song ids'], song_id_list)
+        for id in song_id_list[1:]:
+            self.assertEqual(corpus().get('songs', id)['lyrics source'], 'http')
+            self.assertTrue(os.path.exists(f"{SONG_IMAGE_PATH}/song{id}.jpg"))
+
+    def test_songs_of_an_interrupted_artist_are_resumed(self) -> None:
+        artist_url = f"{self.site_url}/artist?id={ARTISTS[0]}"
+
+        async def interrupted(crawler: AsyncSongCrawler, song_url_list: list[str]) -> None:
+            raise asyncio.CancelledError
+
+        # the crawl stops once the artist's songs page is stored
+        state = CrawlState(':memory:')
+        with mock.patch.object(AsyncSongCrawler, 'crawl_songs', interrupted), self.assertRaises(asyncio.CancelledError):
+            self.crawl(ARTISTS[:1], RequestsGet(HEADERS, COOKIES), state, rate=1000.0, burst=1000)
+        self.assertEqual(state.status(artist_url), DONE)
+        self.assertEqual(state.counts()['song'], {FRONTIER: 11})
+        # the next run crawls the songs left in the frontier
+        self.crawl(ARTISTS[:1], RequestsGet(HEADERS, COOKIES), state, rate=1000.0, burst=1000)
+        self.assertEqual(state.counts()['song'], {DONE: 11})
+
+class SmokeTests(unittest.TestCase):
+
+    """bench_crawl.py crawls the first artists and their songs from the replay server into a temporary folder"""
+
+    def test_crawl_matches_saved_info(self) -> None:
+        out_path = os.path.join(OUTPUT, 'smoke')
+        subprocess.run(
+            [
+                sys.executable, os.path.join(ROOT, 'bench_crawl.py'), '--artists', '2', '--crawlers', 'artist', 'song',
+                '--parse-workers', '0', '--image-workers', '4', '--out', out_path, '--json', f"{out_path}/results.json",
+            ],
+            env=dict(os.environ, SONG_CURL_SAVED_INFO=SAVED_INFO), check=True, stdout=subprocess.DEVNULL
+        )
+        with open(f"{out_path}/results.json", 'r', encoding='utf-8') as f:
+            results = {result['crawler']: result for result in json.load(f)}
+        self.assertEqual(results['artist']['crawl state'], {'artist desc': {DONE: 2}})
+        self.assertEqual(results['song']['crawl state'], {'artist': {DONE: 2}, 'song': {DONE: 50}})
+
+        # the records crawled are the ones served
+        with CorpusStore(f"{out_path}/corpus") as store:
+            self.assertEqual(store.count('artist songs'), 2)
+            for artist in store.iterate('artists'):
+                with open(f"{SAVED_INFO}/artist_info/artist_intro/artist{artist['id']}.json", 'r', encoding='utf-8') as f:
+                    served = json.load(f)
+                for key in ('name', 'alias', 'intro'):
+                    self.assertEqual(artist[key], served[key])
+                self.assertTrue(os.path.exists(f"{out_path}/artist_info/artist_images/artist{artist['id']}.jpg"))
+            self.assertEqual(store.count('songs'), 50)
+            for song in store.iterate('songs'):
+                with open(f"{SAVED_INFO}/song_info/song_intro/song{song['id']}.json", 'r', encoding='utf-8') as f:
+                    served = json.load(f)
+                for key in ('name', 'alias', 'artist list', 'artist id list', 'lyrics'):
+                    self.assertEqual(song.get(key), served.get(key))
+                self.assertTrue(os.path.exists(f"{out_path}/song_info/song_image/song{song['id']}.jpg"))
+
+class RequestsGetTests(unittest.TestCase):
+
+    """RequestsGet.fetch retries the errors and the lost connections, as long as Retry-After asks"""
+
+    def test_errors_are_retried_after_retry_after(self) -> None:
+        tool = RequestsGet(HEADERS, COOKIES, max_retries=2, backoff=0.0)
+        with ReplayServer(error_rate=1.0, retry_after=0.2, use_recorded=False) as server, \
+                contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            response = tool.fetch(f"{server.url}/song?id={SONG_ID}")
+            elapsed = time.perf_counter() - start
+        # the answer of the last try is returned, for raise_for_status
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(server.counts['errors'], 3)
+        self.assertEqual([status for _, status, _ in tool.latencies], [503, 503, 503])
+        self.assertEqual(tool.metrics.counters['retries'], 2)
+        self.assertGreaterEqual(elapsed, 2 * 0.2)
+
+    def test_lost_connections_are_retried(self) -> None:
+        tool = RequestsGet(HEADERS, COOKIES, max_retries=1, backoff=0.0)
+        with ReplayServer(reset_rate=1.0, use_recorded=False) as server, contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(requests.ConnectionError):
+                tool.fetch(f"{server.url}/song?id={SONG_ID}")
+        self.assertEqual([status for _, status, _ in tool.latencies], [None, None])
+        self.assertEqual(tool.metrics.counters['request errors'], 1)
+
+    def test_retry_after(self) -> None:
+        tool = RequestsGet(HEADERS, COOKIES, max_backoff=30.0)
+        response = requests.Response()
+        response.headers['Retry-After'] = '2.5'
+        self.assertEqual(tool.retry_after(response), 2.5)
+        # an http date, and a delay longer than max_backoff
+        response.headers['Retry-After'] = formatdate(time.time() + 10, usegmt=True)
+        self.assertAlmostEqual(tool.retry_after(response), 10, delta=1.5)
+        response.headers['Retry-After'] = '120'
+        self.assertEqual(tool.retry_after(response), 30.0)
+        response.headers['Retry-After'] = 'soon'
+        self.assertEqual(tool.retry_after(response), 0)
+
+class ConditionalHandler(BaseHTTPRequestHandler):
+
+    """answers a page with an ETag, and a 304 to the requests already having it"""
+
+    ETAG = '"v1"'
+    BODY = '<html><body>晴天</body></html>'.encode('utf-8')
+
+    def do_GET(self) -> None:
+        self.server.conditions.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == self.ETAG:
+            self.send_response(304)
+            self.send_header('ETag', self.ETAG)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.ETAG)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.BODY)))
+        self.end_headers()
+        self.wfile.write(self.BODY)
+
+    def log_message(self, *args) -> None:
+        pass
+
+class HttpCacheTests(ReplayTestCase):
+
+    """the http cache answers a fresh entry, fetches a stale one again, and answers alone offline"""
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp(dir=OUTPUT)
+        self.url = f"{self.site_url}/song?id={SONG_ID}"
+
+    def test_fresh_entry_is_used(self) -> None:
+        tool = RequestsGet(HEADERS, COOKIES, cache=HttpCache(self.root))
+        first = tool.requests_get(f"{self.site_url}/song", params={'id': SONG_ID})
+        second = tool.requests_get(self.url)
+        self.assertEqual(len(tool.latencies), 1)
+        self.assertEqual(tool.metrics.counters['cache hits'], 1)
+        self.assertEqual(second.text, first.text)
+
+    def test_stale_entry_is_fetched_again(self) -> None:
+        tool = RequestsGet(HEADERS, COOKIES, cache=HttpCache(self.root, ttl_policy=[(r'/song\?', 0)]))
+        tool.requests_get(self.url)
+        tool.requests_get(self.url)
+        self.assertEqual(len(tool.latencies), 2)
+        self.assertNotIn('cache hits', tool.metrics.counters)
+
+    def test_stale_entry_is_revalidated(self) -> None:
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), ConditionalHandler)
+        httpd.conditions = []
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        url = f"http://127.0.0.1:{httpd.server_address[1]}/song?id={SONG_ID}"
+        cache = HttpCache(self.root, ttl_policy=[(r'/song\?', 0)])
+        tool = RequestsGet(HEADERS, COOKIES, cache=cache)
+        tool.requests_get(url)
+        fetched_at = cache.load(url)['fetched_at']
+        response = tool.requests_get(url)
+        # the 304 keeps the cached body, and makes the entry fresh again
+        self.assertEqual(httpd.conditions, [None, ConditionalHandler.ETAG])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, ConditionalHandler.BODY)
+        self.assertEqual(tool.metrics.counters['cache revalidated'], 1)
+        self.assertGreater(cache.load(url)['fetched_at'], fetched_at)
+
+    def test_offline(self) -> None:
+        online = RequestsGet(HEADERS, COOKIES, cache=HttpCache(self.root))
+        page = online.requests_get(self.url).text
+        # even a stale entry is answered, and nothing is sent
+        tool = RequestsGet(HEADERS, COOKIES, cache=HttpCache(self.root, offline=True, ttl_policy=[(r'/song\?', 0)]))
+        self.assertEqual(tool.requests_get(self.url).text, page)
+        with self.assertRaises(CacheMiss):
+            tool.requests_get(f"{self.site_url}/song?id={SONG_ID + 1}")
+        self.assertEqual(tool.latencies, [])
+
+class CrawlStateTests(unittest.TestCase):
+
+    """the leases of the crawl state give every frontier url to one worker at a time"""
+
+    def setUp(self) -> None:
+        self.urls = [f"/song?id={id}" for id in range(10)]
+
+    def test_claim_release_and_renew(self) -> None:
+        state = CrawlState(':memory:')
+        state.add_many(self.urls, 'song')
+        first = state.claim('a', ('song',), 4, lease=60)
+        second = state.claim('b', ('song',), 4, lease=60)
+        self.assertEqual([url for url, _, _ in first], self.urls[:4])
+        self.assertEqual([url for url, _, _ in second], self.urls[4:8])
+        self.assertEqual(state.leased(('song',)), 8)
+        # a worker stopping gives back the urls it hasn't done
+        state.mark_done(self.urls[0])
+        self.assertEqual(state.release('a'), 3)
+        third = state.claim('c', ('song',), 10, lease=60)
+        self.assertEqual([url for url, _, _ in third], self.urls[1:4] + self.urls[8:])
+        self.assertEqual(state.renew('b', 60), 4)
+        self.assertEqual(state.claim('d', ('song',), 10, lease=60), [])
+
+    def test_expired_leases_are_claimed_again(self) -> None:
+        state = CrawlState(':memory:')
+        state.add_many(self.urls, 'song')
+        self.assertEqual(len(state.claim('a', ('song',), 10, lease=0.05)), 10)
+        self.assertEqual(state.claim('b', ('song',), 10, lease=60), [])
+        time.sleep(0.1)
+        self.assertEqual(state.leased(('song',)), 0)
+        self.assertEqual(len(state.claim('b', ('song',), 10, lease=60)), 10)
+        # the worker whose leases expired has no url left to renew
+        self.assertEqual(state.renew('a', 60), 0)
+
+    def test_workers_sharing_a_file_claim_each_url_once(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(dir=OUTPUT), 'crawl_state.sqlite3')
+        urls = [f"/song?id={id}" for id in range(200)]
+        CrawlState(path).add_many(urls, 'song')
+        claimed: dict[str, list[str]] = {}
+
+        def work(worker: str) -> None:
+            state = CrawlState(path)
+            claimed[worker] = []
+            while batch := state.claim(worker, ('song',), 7, lease=60):
+                for url, _, _ in batch:
+                    claimed[worker].append(url)
+                    state.mark_done(url)
+            state.close()
+
+        workers = [threading.Thread(target=work, args=(f"worker{i}",)) for i in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        done = [url for urls_claimed in claimed.values() for url in urls_claimed]
+        self.assertEqual(sorted(done), sorted(urls))
+        self.assertEqual(CrawlState(path).counts(), {'song': {DONE: 200}})
+
+class CorpusStoreTests(unittest.TestCase):
+
+    """the records put in a corpus store are read back, by id and in bulk, by another writer"""
+
+    def test_round_trip(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(dir=OUTPUT), 'corpus')
+        records = [
+            {'id': id, 'name': f"歌{id}", 'artist list': ['周杰伦'], 'lyrics': f"第{id}句\n" * 20}
+            for id in range(50)
+        ]
+        # small segments, so the shards are cut in several
+        with CorpusStore(path, shards=4, segment_bytes=2048) as store:
+            for record in records:
+                store.put('songs', record)
+            records[7] = dict(records[7], lyrics='改过的歌词')
+            store.put('songs', records[7])
+        self.assertGreater(len(os.listdir(f"{path}/songs")), 4)
+
+        with CorpusStore(path, shards=16) as store:
+            # the settings are the store's
+            self.assertEqual(store.shards, 4)
+            self.assertEqual(store.count('songs'), 50)
+            self.assertEqual(store.get('songs', 7), records[7])
+            self.assertEqual(store.get('songs', '3'), records[3])
+            self.assertIsNone(store.get('songs', 50))
+            self.assertEqual(sorted(store.iterate('songs'), key=lambda record: record['id']), records)
+            store.put('artist songs', {'id': 1, 'song ids': [3, 7]})
+        with CorpusStore(path) as store:
+            self.assertEqual(store.get('artist songs', 1), {'id': 1, 'song ids': [3, 7]})
+            self.assertEqual(store.count('artists'), 0)